@@ -0,0 +1,36 @@
+"""add search_positions
+
+Revision ID: 7c1e2a9d4f10
+Revises: 4baa81bdc450
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e2a9d4f10'
+down_revision: Union[str, Sequence[str], None] = '4baa81bdc450'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('search_positions',
+    sa.Column('query', sa.Text(), nullable=False),
+    sa.Column('nm_id', sa.BigInteger(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('seen_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('query', 'nm_id')
+    )
+    op.create_index(op.f('ix_search_positions_nm_id'), 'search_positions', ['nm_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_search_positions_nm_id'), table_name='search_positions')
+    op.drop_table('search_positions')
@@ -0,0 +1,30 @@
+"""add product fingerprint and refreshed_at
+
+Revision ID: a3f5b8c2d611
+Revises: 7c1e2a9d4f10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f5b8c2d611'
+down_revision: Union[str, Sequence[str], None] = '7c1e2a9d4f10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('products', sa.Column('fingerprint', sa.Text(), nullable=True))
+    op.add_column('products', sa.Column('refreshed_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('products', 'refreshed_at')
+    op.drop_column('products', 'fingerprint')
@@ -0,0 +1,37 @@
+"""add product_regions
+
+Revision ID: a9c4e6b2d051
+Revises: f7a3c1d8e2b4
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c4e6b2d051'
+down_revision: Union[str, Sequence[str], None] = 'f7a3c1d8e2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_regions',
+    sa.Column('nm_id', sa.BigInteger(), nullable=False),
+    sa.Column('dest', sa.BigInteger(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=True),
+    sa.Column('stock', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('nm_id', 'dest')
+    )
+    op.create_index('ix_product_regions_dest_nm_id', 'product_regions', ['dest', 'nm_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_regions_dest_nm_id', table_name='product_regions')
+    op.drop_table('product_regions')
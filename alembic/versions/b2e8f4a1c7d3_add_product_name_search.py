@@ -0,0 +1,45 @@
+"""add product name search indexes
+
+Revision ID: b2e8f4a1c7d3
+Revises: a9c4e6b2d051
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2e8f4a1c7d3'
+down_revision: Union[str, Sequence[str], None] = 'a9c4e6b2d051'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Только Postgres: в SQLite индекс FTS5 создаёт само приложение (crud.ensure_search_index).
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CONCURRENTLY — таблица на миллионы строк не блокируется для записи, пока строится индекс
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_products_name_trgm', 'products', ['name'], unique=False,
+            postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}, postgresql_concurrently=True,
+        )
+        # выражение должно совпадать с запросом в crud.search_products, иначе индекс не применится
+        op.create_index(
+            'ix_products_name_fts', 'products', [sa.text("to_tsvector('russian', name)")], unique=False,
+            postgresql_using='gin', postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_products_name_fts', table_name='products')
+    op.drop_index('ix_products_name_trgm', table_name='products')
@@ -0,0 +1,46 @@
+"""add product_history
+
+Revision ID: c94d17e0b2a5
+Revises: a3f5b8c2d611
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c94d17e0b2a5'
+down_revision: Union[str, Sequence[str], None] = 'a3f5b8c2d611'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_history',
+    sa.Column('nm_id', sa.BigInteger(), nullable=False),
+    sa.Column('ts', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.Column('price_prev', sa.Integer(), nullable=True),
+    sa.Column('rating', sa.Float(), nullable=False),
+    sa.Column('review_count', sa.Integer(), nullable=False),
+    sa.Column('stock', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('nm_id', 'ts')
+    )
+    # BRIN: таблица пишется строго по возрастанию ts, индекс занимает килобайты
+    op.create_index('ix_product_history_ts', 'product_history', ['ts'], unique=False, postgresql_using='brin')
+    op.create_index(
+        'ix_product_history_price_changes', 'product_history', ['ts', 'nm_id'], unique=False,
+        postgresql_where=sa.text('price_prev IS DISTINCT FROM price'),
+        sqlite_where=sa.text('price_prev IS NOT price'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_history_price_changes', table_name='product_history')
+    op.drop_index('ix_product_history_ts', table_name='product_history')
+    op.drop_table('product_history')
@@ -0,0 +1,39 @@
+"""price changes index: skip first history row
+
+Revision ID: d3b7e1f05c92
+Revises: b2e8f4a1c7d3
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3b7e1f05c92'
+down_revision: Union[str, Sequence[str], None] = 'b2e8f4a1c7d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # первая строка товара (price_prev IS NULL) — не изменение цены
+    op.drop_index('ix_product_history_price_changes', table_name='product_history')
+    op.create_index(
+        'ix_product_history_price_changes', 'product_history', ['ts', 'nm_id'], unique=False,
+        postgresql_where=sa.text('price_prev IS NOT NULL AND price_prev != price'),
+        sqlite_where=sa.text('price_prev IS NOT NULL AND price_prev != price'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_history_price_changes', table_name='product_history')
+    op.create_index(
+        'ix_product_history_price_changes', 'product_history', ['ts', 'nm_id'], unique=False,
+        postgresql_where=sa.text('price_prev IS DISTINCT FROM price'),
+        sqlite_where=sa.text('price_prev IS NOT price'),
+    )
@@ -0,0 +1,32 @@
+"""stock nullable: NULL = unknown
+
+Revision ID: e5d2a7c91f38
+Revises: c94d17e0b2a5
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5d2a7c91f38'
+down_revision: Union[str, Sequence[str], None] = 'c94d17e0b2a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('products', 'stock', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('product_history', 'stock', existing_type=sa.Integer(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("UPDATE product_history SET stock = 0 WHERE stock IS NULL")
+    op.execute("UPDATE products SET stock = 0 WHERE stock IS NULL")
+    op.alter_column('product_history', 'stock', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('products', 'stock', existing_type=sa.Integer(), nullable=False)
@@ -0,0 +1,37 @@
+"""add product_stocks
+
+Revision ID: f7a3c1d8e2b4
+Revises: e5d2a7c91f38
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a3c1d8e2b4'
+down_revision: Union[str, Sequence[str], None] = 'e5d2a7c91f38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_stocks',
+    sa.Column('nm_id', sa.BigInteger(), nullable=False),
+    sa.Column('wh', sa.BigInteger(), nullable=False),
+    sa.Column('size', sa.Text(), nullable=False),
+    sa.Column('qty', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('nm_id', 'wh', 'size')
+    )
+    op.create_index('ix_product_stocks_wh_nm_id', 'product_stocks', ['wh', 'nm_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_stocks_wh_nm_id', table_name='product_stocks')
+    op.drop_table('product_stocks')
@@ -1,34 +1,859 @@
+import csv
+import io
+import math
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, exists, func, literal, or_, select, text, update
 from sqlalchemy.orm import Session
-from app.models import Product
+from app.models import Product, ProductHistory, ProductRegion, ProductStock, SearchPosition
+from parser import metrics
+from parser.records import ProductColumns
 
-def upsert_products(db: Session, items: list[dict]) -> int:
-    """
-    Вставка/обновление только нужных полей.
-    Ключ — nm_id.
-    """
-    n = 0
+# Поля, которые перезаписываются при upsert (ключ — nm_id).
+# fingerprint — отпечаток поисковой выдачи для инкрементального режима (WBApiParser.fingerprint).
+UPSERT_FIELDS = ("name", "price", "rating", "review_count", "stock", "fingerprint")
+
+# Поля, изменение которых попадает в product_history.
+HISTORY_FIELDS = ("price", "rating", "review_count", "stock")
+
+# Поля, где None значит «не знаем» (detail по товару не ответил): сохранённое значение не трогаем.
+KEEP_IF_UNKNOWN = ("stock",)
+
+# 8 колонок * 1000 строк укладываются в лимит bind-параметров и Postgres, и SQLite.
+CHUNK_SIZE = 1000
+# С какого размера партии на Postgres грузим через COPY во временную таблицу.
+COPY_THRESHOLD = 20000
+# Параметры COPY в products_stage: пустые поля — NULL (stock, fingerprint), кроме name.
+COPY_OPTIONS = "FORMAT csv, FORCE_NOT_NULL (name)"
+
+
+@dataclass
+class UpsertResult:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # неизменённые строки, у которых только сдвинули refreshed_at (touch_unchanged=True)
+    touched: int = 0
+    # строк дописано в product_history
+    history: int = 0
+    # строк записано в product_stocks (у товаров, где разбивка по складам изменилась)
+    stocks: int = 0
+    # строк записано в product_regions (цена/остаток по доп. регионам изменились)
+    regions: int = 0
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated
+
+    @property
+    def total(self) -> int:
+        return self.inserted + self.updated + self.unchanged
+
+    def __iadd__(self, other: "UpsertResult") -> "UpsertResult":
+        """Суммируем результаты нескольких партий (потоковая запись в /parse)."""
+        for f in ("inserted", "updated", "unchanged", "touched", "history", "stocks", "regions"):
+            setattr(self, f, getattr(self, f) + getattr(other, f))
+        return self
+
+
+def _prepare_rows(items: List[dict]) -> List[dict]:
+    """Нормализуем типы и схлопываем дубли nm_id (побеждает последний)."""
+    rows: Dict[int, dict] = {}
     for p in items:
         nm_id = p.get("nm_id")
         if nm_id is None:
             continue
+        rows[int(nm_id)] = {
+            "nm_id": int(nm_id),
+            "name": p.get("name", ""),
+            "price": int(p.get("price") or 0),
+            "rating": float(p.get("rating") or 0.0),
+            "review_count": int(p.get("review_count") or 0),
+            "stock": int(p["stock"]) if p.get("stock") is not None else None,
+            "fingerprint": p.get("fingerprint"),
+            "stocks": p.get("stocks"),
+            "regions": p.get("regions"),
+        }
+    return list(rows.values())
+
+
+def _fill_unknown(rows: List[dict], before: Dict[int, tuple]) -> None:
+    """None в KEEP_IF_UNKNOWN заменяем прежним значением из БД (before — значения HISTORY_FIELDS)."""
+    idx = [(f, HISTORY_FIELDS.index(f)) for f in KEEP_IF_UNKNOWN]
+    for r in rows:
+        old = before.get(r["nm_id"])
+        if old is None:
+            continue
+        for f, i in idx:
+            if r[f] is None:
+                r[f] = old[i]
+
+
+def _same(a, b) -> bool:
+    # rating в Postgres — real: 4.7 возвращается как 4.699999809..., сравниваем с допуском
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, rel_tol=1e-6)
+    return a == b
+
+
+def _history_rows(rows: List[dict], before: Dict[int, tuple], ts: datetime) -> List[dict]:
+    """Строки истории для товаров, у которых изменилось хоть одно из HISTORY_FIELDS (или которые новые)."""
+    out = []
+    for r in rows:
+        old = before.get(r["nm_id"])
+        if old is not None and all(_same(o, r[f]) for o, f in zip(old, HISTORY_FIELDS)):
+            continue
+        out.append({
+            "nm_id": r["nm_id"],
+            "ts": ts,
+            "price_prev": old[0] if old is not None else None,
+            **{f: r[f] for f in HISTORY_FIELDS},
+        })
+    return out
+
+
+def _dialect_insert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def upsert_products(
+    db: Session,
+    items,
+    chunk_size: int = CHUNK_SIZE,
+    use_copy: Optional[bool] = None,
+    touch_unchanged: bool = False,
+    history: bool = True,
+) -> UpsertResult:
+    """
+    Вставка/обновление только нужных полей.
+    Ключ — nm_id. stock=None (остаток неизвестен) не затирает сохранённый остаток.
+
+    Postgres и SQLite: пачками INSERT ... ON CONFLICT (nm_id) DO UPDATE ... WHERE <что-то изменилось>,
+    неизменённые строки не переписываются. На Postgres большие партии
+    (use_copy=True или >= COPY_THRESHOLD строк) идут через COPY во временную таблицу.
+    Остальные СУБД — старый построчный путь через ORM.
+
+    refreshed_at ставится всем записанным строкам. touch_unchanged=True — сдвинуть его
+    и у неизменённых (одним UPDATE на партию): так инкрементальный режим знает,
+    что detail по товару недавно перепроверяли.
+
+    history=True — в той же транзакции дописываем в product_history строки
+    по товарам, у которых поменялись цена/рейтинг/отзывы/остатки.
+
+    "stocks": [(wh, size, qty), ...] в строке — разбивка остатка по складам: в той же
+    транзакции заменяет строки товара в product_stocks (None — не трогаем).
+    "regions": [(dest, price, stock), ...] — цена и остаток по регионам, в той же транзакции
+    пишутся в product_regions (upsert_region_prices).
+
+    items — список строк или parser.records.ProductColumns (результат parse(columnar=True)).
+    Колонки на пути COPY пишутся в CSV напрямую, без словаря на строку.
+
+    С WB_METRICS=1 время попадает в wb_stage_seconds{stage="upsert"}, строки — в wb_upsert_rows_total.
+    """
+    with metrics.stage("upsert"):
+        res = _upsert_products(db, items, chunk_size, use_copy, touch_unchanged, history)
+    if metrics.ENABLED:
+        for f in ("inserted", "updated", "unchanged", "history", "stocks", "regions"):
+            metrics.UPSERT_ROWS.inc(f, n=getattr(res, f))
+    return res
+
+
+async def upsert_products_async(
+    db,
+    items,
+    chunk_size: int = CHUNK_SIZE,
+    touch_unchanged: bool = False,
+    history: bool = True,
+) -> UpsertResult:
+    """
+    upsert_products для AsyncSession (DB_ASYNC=1): тот же код через run_sync, поток не блокируется.
+    Без COPY — у asyncpg нет copy_expert, большие партии идут пачками ON CONFLICT.
+    """
+    return await db.run_sync(
+        lambda s: upsert_products(s, items, chunk_size, use_copy=False, touch_unchanged=touch_unchanged, history=history)
+    )
+
+
+def _upsert_products(
+    db: Session,
+    items,
+    chunk_size: int,
+    use_copy: Optional[bool],
+    touch_unchanged: bool,
+    history: bool,
+) -> UpsertResult:
+    res = UpsertResult()
+    now = datetime.now(timezone.utc)
+    dialect = db.get_bind().dialect.name
+    unchanged: List[int] = []
+
+    if isinstance(items, ProductColumns):
+        ids = items.upsert_ids()
+        if dialect == "postgresql" and (use_copy or (use_copy is None and len(ids) >= COPY_THRESHOLD)) \
+                and len(set(ids)) == len(ids):
+            unchanged = _copy_and_merge(
+                db, ids, lambda buf: items.write_upsert_csv(buf, now.isoformat()), res, history,
+            )
+            res.stocks += replace_stocks(db, items.upsert_stocks(), now)
+            res.regions += upsert_region_prices(db, items.upsert_regions(), now)
+            return _finish_upsert(db, res, unchanged, now, chunk_size, touch_unchanged)
+        items = items.upsert_rows()
+
+    rows = _prepare_rows(items)
+    if not rows:
+        return res
+    stocks: Dict[int, list] = {}
+    regions: Dict[int, list] = {}
+    for r in rows:
+        r["refreshed_at"] = now
+        wh = r.pop("stocks")
+        if wh is not None:
+            stocks[r["nm_id"]] = wh
+        reg = r.pop("regions")
+        if reg is not None:
+            regions[r["nm_id"]] = reg
+
+    if dialect == "postgresql" and (use_copy or (use_copy is None and len(rows) >= COPY_THRESHOLD)):
+        unchanged = _upsert_via_copy(db, rows, res, history)
+    elif dialect in ("postgresql", "sqlite"):
+        insert = _dialect_insert(dialect)
+        for i in range(0, len(rows), chunk_size):
+            unchanged += _upsert_chunk(db, insert, rows[i:i + chunk_size], res, history)
+    else:
+        unchanged = _upsert_products_orm(db, rows, res, history)
+    res.stocks += replace_stocks(db, stocks, now)
+    res.regions += upsert_region_prices(db, regions, now)
+    return _finish_upsert(db, res, unchanged, now, chunk_size, touch_unchanged)
+
+
+def _finish_upsert(
+    db: Session,
+    res: UpsertResult,
+    unchanged: List[int],
+    now: datetime,
+    chunk_size: int,
+    touch_unchanged: bool,
+) -> UpsertResult:
+    if touch_unchanged and unchanged:
+        for i in range(0, len(unchanged), chunk_size):
+            db.execute(
+                update(Product.__table__)
+                .where(Product.__table__.c.nm_id.in_(unchanged[i:i + chunk_size]))
+                .values(refreshed_at=now)
+            )
+        res.touched = len(unchanged)
+
+    db.commit()
+    return res
+
+
+def replace_stocks(db: Session, stocks: Dict[int, list], now: datetime, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Заменяем разбивку по складам у товаров из stocks (nm_id -> [(wh, size, qty), ...]).
+    Товары, у которых разбивка не изменилась, не трогаем; у остальных — DELETE по nm_id
+    пачками и один executemany INSERT. Коммит — на стороне вызывающего. Возвращает число вставленных строк.
+    Разбивки сравниваются отсортированными в Python: порядок ORDER BY size зависит от collation БД.
+    """
+    if not stocks:
+        return 0
+    table = ProductStock.__table__
+    ids = list(stocks)
+    before: Dict[int, list] = {}
+    for i in range(0, len(ids), chunk_size):
+        for nm_id, wh, size, qty in db.execute(
+            select(table.c.nm_id, table.c.wh, table.c.size, table.c.qty)
+            .where(table.c.nm_id.in_(ids[i:i + chunk_size]))
+        ):
+            before.setdefault(nm_id, []).append((wh, size, qty))
+    changed = [i for i in ids if sorted(before.get(i, [])) != sorted(map(tuple, stocks[i]))]
+    if not changed:
+        return 0
+    for i in range(0, len(changed), chunk_size):
+        db.execute(delete(table).where(table.c.nm_id.in_(changed[i:i + chunk_size])))
+    values = [
+        {"nm_id": nm_id, "wh": wh, "size": size, "qty": qty, "updated_at": now}
+        for nm_id in changed
+        for wh, size, qty in stocks[nm_id]
+    ]
+    if values:
+        db.execute(table.insert(), values)
+    return len(values)
+
+
+def upsert_region_prices(db: Session, regions: Dict[int, list], now: datetime, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Цена и остаток по регионам (nm_id -> [(dest, price, stock), ...]) в product_regions, ключ (nm_id, dest).
+    Как и products, переписываются только изменившиеся строки. Коммит — на стороне вызывающего.
+    Возвращает число записанных строк.
+    """
+    values = [
+        {"nm_id": nm_id, "dest": dest, "price": price, "stock": stock, "updated_at": now}
+        for nm_id, rows in regions.items()
+        for dest, price, stock in rows
+    ]
+    if not values:
+        return 0
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        for v in values:
+            db.merge(ProductRegion(**v))
+        return len(values)
+
+    insert = _dialect_insert(dialect)
+    table = ProductRegion.__table__
+    written = 0
+    for i in range(0, len(values), chunk_size):
+        stmt = insert(table).values(values[i:i + chunk_size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.nm_id, table.c.dest],
+            set_={f: stmt.excluded[f] for f in ("price", "stock", "updated_at")},
+            where=or_(*(table.c[f].is_distinct_from(stmt.excluded[f]) for f in ("price", "stock"))),
+        )
+        written += db.execute(stmt).rowcount
+    return written
+
+
+def _upsert_chunk(db: Session, insert, chunk: List[dict], res: UpsertResult, history: bool = False) -> List[int]:
+    table = Product.__table__
+    ids = [r["nm_id"] for r in chunk]
+    before = {
+        nm_id: tuple(vals)
+        for nm_id, *vals in db.execute(
+            select(table.c.nm_id, *(table.c[f] for f in HISTORY_FIELDS)).where(table.c.nm_id.in_(ids))
+        )
+    }
+    existing = set(before)
+    _fill_unknown(chunk, before)
+    if history:
+        hist = _history_rows(chunk, before, chunk[0]["refreshed_at"])
+        if hist:
+            db.execute(ProductHistory.__table__.insert(), hist)
+            res.history += len(hist)
+
+    stmt = insert(table)
+    changed = or_(*(table.c[f].is_distinct_from(stmt.excluded[f]) for f in UPSERT_FIELDS))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.nm_id],
+        set_={f: stmt.excluded[f] for f in UPSERT_FIELDS + ("refreshed_at",)},
+        where=changed,
+    ).returning(table.c.nm_id)
+    written = set(db.execute(stmt, chunk).scalars())
+
+    res.inserted += len(written - existing)
+    res.updated += len(written & existing)
+    res.unchanged += len(chunk) - len(written)
+    return [i for i in ids if i not in written]
+
+
+def _upsert_via_copy(db: Session, rows: List[dict], res: UpsertResult, history: bool = False) -> List[int]:
+    """COPY во временную таблицу и один INSERT ... SELECT ... ON CONFLICT (только Postgres/psycopg2)."""
+    cols = ("nm_id",) + UPSERT_FIELDS + ("refreshed_at",)
+
+    def write(buf) -> None:
+        w = csv.writer(buf)
+        for r in rows:
+            w.writerow([r["refreshed_at"].isoformat() if c == "refreshed_at" else r[c] for c in cols])
+
+    return _copy_and_merge(db, [r["nm_id"] for r in rows], write, res, history)
+
+
+def _copy_and_merge(db: Session, ids: List[int], write, res: UpsertResult, history: bool = False) -> List[int]:
+    """
+    Общая часть COPY-пути: write(buf) пишет CSV в колонках ("nm_id",) + UPSERT_FIELDS + ("refreshed_at",),
+    ids — nm_id этих строк (уникальные). Возвращает nm_id неизменённых строк.
+    """
+    cols = ("nm_id",) + UPSERT_FIELDS + ("refreshed_at",)
+    buf = io.StringIO()
+    write(buf)
+    buf.seek(0)
+
+    db.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS products_stage "
+        "(nm_id bigint, name text, price integer, rating real, review_count integer, stock integer, "
+        "fingerprint text, refreshed_at timestamptz) "
+        "ON COMMIT DROP"
+    ))
+    db.execute(text("TRUNCATE products_stage"))
+    cur = db.connection().connection.cursor()
+    try:
+        # csv.writer пишет "" без кавычек, а COPY читает такое поле как NULL:
+        # пустое имя должно остаться пустой строкой (products.name NOT NULL)
+        cur.copy_expert(f"COPY products_stage ({', '.join(cols)}) FROM STDIN WITH ({COPY_OPTIONS})", buf)
+    finally:
+        cur.close()
+
+    def new(alias: str, cur: str, f: str) -> str:
+        # неизвестное (NULL) значение KEEP_IF_UNKNOWN-поля не затирает сохранённое
+        return f"COALESCE({alias}.{f}, {cur}.{f})" if f in KEEP_IF_UNKNOWN else f"{alias}.{f}"
+
+    if history:
+        hist_cols = ", ".join(HISTORY_FIELDS)
+        hist_new = ", ".join(new("s", "p", f) for f in HISTORY_FIELDS)
+        res.history += db.execute(text(
+            f"INSERT INTO product_history (nm_id, ts, price_prev, {hist_cols}) "
+            f"SELECT s.nm_id, s.refreshed_at, p.price, {hist_new} "
+            f"FROM products_stage s LEFT JOIN products p ON p.nm_id = s.nm_id "
+            f"WHERE p.nm_id IS NULL OR ({', '.join('p.' + f for f in HISTORY_FIELDS)}) "
+            f"IS DISTINCT FROM ({hist_new})"
+        )).rowcount
+
+    set_clause = ", ".join(
+        f"{f} = {new('EXCLUDED', 'products', f)}" for f in UPSERT_FIELDS + ("refreshed_at",)
+    )
+    cur_vals = ", ".join(f"products.{f}" for f in UPSERT_FIELDS)
+    new_vals = ", ".join(new("EXCLUDED", "products", f) for f in UPSERT_FIELDS)
+    written = db.execute(text(
+        f"INSERT INTO products ({', '.join(cols)}) "
+        f"SELECT {', '.join(cols)} FROM products_stage "
+        f"ON CONFLICT (nm_id) DO UPDATE SET {set_clause} "
+        f"WHERE ({cur_vals}) IS DISTINCT FROM ({new_vals}) "
+        f"RETURNING nm_id, (xmax = 0) AS inserted"
+    )).all()
+
+    inserted = sum(1 for _, f in written if f)
+    res.inserted += inserted
+    res.updated += len(written) - inserted
+    res.unchanged += len(ids) - len(written)
+    written_ids = {nm_id for nm_id, _ in written}
+    return [i for i in ids if i not in written_ids]
+
 
-        row = db.query(Product).filter(Product.nm_id == nm_id).one_or_none()
+def _upsert_products_orm(db: Session, rows: List[dict], res: UpsertResult, history: bool = False) -> List[int]:
+    """Построчный путь (один SELECT на товар). Запасной вариант и точка отсчёта для bench/upsert.py."""
+    unchanged: List[int] = []
+    for p in rows:
+        row = db.query(Product).filter(Product.nm_id == p["nm_id"]).one_or_none()
         if row:
-            row.name = p.get("name", row.name)
-            row.price = int(p.get("price") or 0)
-            row.rating = float(p.get("rating") or 0.0)
-            row.review_count = int(p.get("review_count") or 0)
-            row.stock = int(p.get("stock") or 0)
+            _fill_unknown([p], {p["nm_id"]: tuple(getattr(row, f) for f in HISTORY_FIELDS)})
+        if history:
+            before = {p["nm_id"]: tuple(getattr(row, f) for f in HISTORY_FIELDS)} if row else {}
+            for h in _history_rows([p], before, p["refreshed_at"]):
+                db.add(ProductHistory(**h))
+                res.history += 1
+        if row:
+            if all(_same(getattr(row, f), p[f]) for f in UPSERT_FIELDS):
+                res.unchanged += 1
+                unchanged.append(p["nm_id"])
+                continue
+            for f in UPSERT_FIELDS + ("refreshed_at",):
+                setattr(row, f, p[f])
+            res.updated += 1
         else:
-            db.add(Product(
-                nm_id=nm_id,
-                name=p.get("name", ""),
-                price=int(p.get("price") or 0),
-                rating=float(p.get("rating") or 0.0),
-                review_count=int(p.get("review_count") or 0),
-                stock=int(p.get("stock") or 0),
+            db.add(Product(**p))
+            res.inserted += 1
+    return unchanged
+
+
+def load_fingerprints(db: Session) -> Dict[int, Tuple[str, Optional[float]]]:
+    """nm_id -> (fingerprint, refreshed_at в секундах epoch) для WBApiParser.parse(known=...)."""
+    table = Product.__table__
+    out: Dict[int, Tuple[str, Optional[float]]] = {}
+    stmt = select(table.c.nm_id, table.c.fingerprint, table.c.refreshed_at).where(table.c.fingerprint.is_not(None))
+    for nm_id, fp, refreshed_at in db.execute(stmt.execution_options(yield_per=10000)):
+        if refreshed_at is not None and refreshed_at.tzinfo is None:
+            refreshed_at = refreshed_at.replace(tzinfo=timezone.utc)
+        out[nm_id] = (fp, refreshed_at.timestamp() if refreshed_at is not None else None)
+    return out
+
+
+def upsert_positions(db: Session, rows: List[dict], chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    rows — строки WBApiParser.parse_many() с ключом "queries".
+    Для каждой пары (query, nm_id) храним последнюю позицию и время обхода.
+    """
+    values = [
+        {"query": q["query"], "nm_id": int(r["nm_id"]), "position": int(q["position"])}
+        for r in rows
+        for q in (r.get("queries") or [])
+    ]
+    if not values:
+        return 0
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = _dialect_insert(dialect)
+        table = SearchPosition.__table__
+        for i in range(0, len(values), chunk_size):
+            stmt = insert(table).values(values[i:i + chunk_size])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.query, table.c.nm_id],
+                set_={"position": stmt.excluded.position, "seen_at": func.now()},
             ))
-        n += 1
+    else:
+        for v in values:
+            db.merge(SearchPosition(**v))
+    db.commit()
+    return len(values)
+
+
+HISTORY_RAW_DAYS = 30
+HISTORY_KEEP_DAYS = 365
+
+
+def product_history(
+    db: Session,
+    nm_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 1000,
+) -> List[dict]:
+    """Точки истории одного товара, новые сначала (идёт по первичному ключу (nm_id, ts))."""
+    t = ProductHistory.__table__
+    stmt = select(t.c.ts, t.c.price, t.c.price_prev, t.c.rating, t.c.review_count, t.c.stock).where(t.c.nm_id == nm_id)
+    if since is not None:
+        stmt = stmt.where(t.c.ts >= since)
+    if until is not None:
+        stmt = stmt.where(t.c.ts < until)
+    return [dict(r) for r in db.execute(stmt.order_by(t.c.ts.desc()).limit(limit)).mappings()]
+
+
+def price_changes(
+    db: Session,
+    since: datetime,
+    after: Optional[Tuple[datetime, int]] = None,
+    limit: int = 1000,
+) -> List[dict]:
+    """
+    Изменения цены с момента since по всем товарам, по возрастанию (ts, nm_id).
+    after — курсор (ts, nm_id) последней строки предыдущей страницы.
+    Первая строка товара (price_prev IS NULL) изменением не считается.
+    Условие совпадает с частичным индексом ix_product_history_price_changes.
+    """
+    t = ProductHistory.__table__
+    stmt = select(t.c.nm_id, t.c.ts, t.c.price_prev, t.c.price).where(
+        t.c.ts >= since,
+        t.c.price_prev.is_not(None),
+        t.c.price_prev != t.c.price,
+    )
+    if after is not None:
+        stmt = stmt.where(or_(t.c.ts > after[0], and_(t.c.ts == after[0], t.c.nm_id > after[1])))
+    stmt = stmt.order_by(t.c.ts, t.c.nm_id).limit(limit)
+    return [dict(r) for r in db.execute(stmt).mappings()]
+
+
+def compact_history(db: Session, raw_days: int = HISTORY_RAW_DAYS, keep_days: int = HISTORY_KEEP_DAYS) -> Dict[str, int]:
+    """
+    Политика хранения product_history:
+      - старше keep_days — удаляем;
+      - старше raw_days — прореживаем до одной (последней за сутки) точки на товар.
+    """
+    t = ProductHistory.__table__
+    now = datetime.now(timezone.utc)
+    dropped = db.execute(delete(t).where(t.c.ts < now - timedelta(days=keep_days))).rowcount
 
+    cutoff = now - timedelta(days=raw_days)
+    if db.get_bind().dialect.name == "postgresql":
+        day = func.date_trunc("day", t.c.ts)
+    else:
+        day = func.date(t.c.ts)
+    keep = (
+        select(t.c.nm_id, func.max(t.c.ts).label("ts"))
+        .where(t.c.ts < cutoff)
+        .group_by(t.c.nm_id, day)
+        .subquery()
+    )
+    downsampled = db.execute(
+        delete(t).where(
+            t.c.ts < cutoff,
+            ~exists().where(keep.c.nm_id == t.c.nm_id, keep.c.ts == t.c.ts),
+        )
+    ).rowcount
     db.commit()
-    return n
+    return {"dropped": dropped, "downsampled": downsampled}
+
+
+def product_stocks(db: Session, nm_id: int) -> List[dict]:
+    """Остатки товара по складам и размерам (по первичному ключу (nm_id, wh, size))."""
+    t = ProductStock.__table__
+    stmt = select(t.c.wh, t.c.size, t.c.qty, t.c.updated_at).where(t.c.nm_id == nm_id).order_by(t.c.wh, t.c.size)
+    return [dict(r) for r in db.execute(stmt).mappings()]
+
+
+def stocks_by_warehouse(
+    db: Session,
+    whs: List[int],
+    nm_ids: Optional[List[int]] = None,
+    qty_min: Optional[int] = None,
+    after: Optional[Tuple[int, int, str]] = None,
+    limit: int = 1000,
+) -> List[dict]:
+    """
+    Строки product_stocks на складах whs по возрастанию (wh, nm_id, size) — идёт по индексу
+    ix_product_stocks_wh_nm_id. after — курсор (wh, nm_id, size) последней строки предыдущей страницы.
+    """
+    t = ProductStock.__table__
+    stmt = select(t.c.wh, t.c.nm_id, t.c.size, t.c.qty, t.c.updated_at).where(t.c.wh.in_(whs))
+    if nm_ids:
+        stmt = stmt.where(t.c.nm_id.in_(nm_ids))
+    if qty_min is not None:
+        stmt = stmt.where(t.c.qty >= qty_min)
+    if after is not None:
+        wh, nm_id, size = after
+        stmt = stmt.where(or_(
+            t.c.wh > wh,
+            and_(t.c.wh == wh, t.c.nm_id > nm_id),
+            and_(t.c.wh == wh, t.c.nm_id == nm_id, t.c.size > size),
+        ))
+    stmt = stmt.order_by(t.c.wh, t.c.nm_id, t.c.size).limit(limit)
+    return [dict(r) for r in db.execute(stmt).mappings()]
+
+
+def product_regions(db: Session, nm_id: int) -> List[dict]:
+    """Цена и остаток товара по регионам (по первичному ключу (nm_id, dest))."""
+    t = ProductRegion.__table__
+    stmt = select(t.c.dest, t.c.price, t.c.stock, t.c.updated_at).where(t.c.nm_id == nm_id).order_by(t.c.dest)
+    return [dict(r) for r in db.execute(stmt).mappings()]
+
+
+def region_prices(
+    db: Session,
+    dests: Optional[List[int]] = None,
+    nm_ids: Optional[List[int]] = None,
+    after: Optional[Tuple[int, int]] = None,
+    limit: int = 1000,
+) -> List[dict]:
+    """
+    Строки product_regions по возрастанию (nm_id, dest) — регионы одного товара идут подряд,
+    для сравнения цен. after — курсор (nm_id, dest) последней строки предыдущей страницы.
+    """
+    t = ProductRegion.__table__
+    stmt = select(t.c.nm_id, t.c.dest, t.c.price, t.c.stock, t.c.updated_at)
+    if dests:
+        stmt = stmt.where(t.c.dest.in_(dests))
+    if nm_ids:
+        stmt = stmt.where(t.c.nm_id.in_(nm_ids))
+    if after is not None:
+        stmt = stmt.where(or_(t.c.nm_id > after[0], and_(t.c.nm_id == after[0], t.c.dest > after[1])))
+    stmt = stmt.order_by(t.c.nm_id, t.c.dest).limit(limit)
+    return [dict(r) for r in db.execute(stmt).mappings()]
+
+
+PRODUCT_COLUMNS = tuple(c.name for c in Product.__table__.columns)
+
+
+def products_select(
+    fields: Optional[List[str]] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    price_min: Optional[int] = None,
+    price_max: Optional[int] = None,
+    rating_min: Optional[float] = None,
+    rating_max: Optional[float] = None,
+    stock_min: Optional[int] = None,
+    stock_max: Optional[int] = None,
+    nm_ids: Optional[List[int]] = None,
+):
+    """
+    SELECT по products с keyset-пагинацией: id по убыванию, cursor — id последней
+    строки предыдущей страницы. id всегда попадает в выборку (нужен для курсора).
+    """
+    table = Product.__table__
+    names = [f for f in (fields or PRODUCT_COLUMNS) if f in PRODUCT_COLUMNS]
+    if "id" not in names:
+        names.insert(0, "id")
+    stmt = select(*(table.c[f] for f in names))
+
+    conds = []
+    if cursor is not None:
+        conds.append(table.c.id < cursor)
+    for col, lo, hi in (
+        (table.c.price, price_min, price_max),
+        (table.c.rating, rating_min, rating_max),
+        (table.c.stock, stock_min, stock_max),
+    ):
+        if lo is not None:
+            conds.append(col >= lo)
+        if hi is not None:
+            conds.append(col <= hi)
+    if nm_ids:
+        conds.append(table.c.nm_id.in_(nm_ids))
+    if conds:
+        stmt = stmt.where(*conds)
+
+    stmt = stmt.order_by(table.c.id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+# Поиск по названию (GET /products/search).
+SEARCH_COLUMNS = ("id", "nm_id", "name", "price", "rating", "review_count", "stock")
+# auto — полнотекстовый, а если он ничего не нашёл (опечатка, кусок слова) — по триграммам
+SEARCH_MODES = ("auto", "fts", "trgm")
+# конфигурация морфологии Postgres; должна совпадать с индексом ix_products_name_fts
+FTS_CONFIG = "russian"
+# Ранжируются только столько самых новых совпадений: у широкого запроса («кабель») их десятки
+# тысяч, и ранг по всем стоит дороже самого поиска по индексу. Должно быть больше
+# MAX_SEARCH_OFFSET + MAX_SEARCH_PAGE_SIZE из app.main.
+SEARCH_CANDIDATES = 5000
+_WORD = re.compile(r"\w+")
+
+# SQLite: FTS5-индексы по products.name, триггеры держат их в согласии с таблицей.
+# products_fts — слова (unicode61, без морфологии: ищем по префиксам), products_trgm — триграммы (подстроки).
+SQLITE_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "name, content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_trgm USING fts5("
+    "name, content='products', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS products_search_ai AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name); "
+    "INSERT INTO products_trgm(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS products_search_ad AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO products_trgm(products_trgm, rowid, name) VALUES ('delete', old.id, old.name); END",
+    # upsert переписывает name и без изменений — индекс трогаем, только если название другое
+    "CREATE TRIGGER IF NOT EXISTS products_search_au AFTER UPDATE OF name ON products "
+    "WHEN old.name IS NOT new.name BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO products_trgm(products_trgm, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name); "
+    "INSERT INTO products_trgm(rowid, name) VALUES (new.id, new.name); END",
+)
+_sqlite_search_ready: set = set()
+
+
+def ensure_search_index(db: Session) -> bool:
+    """
+    SQLite: создаёт FTS5-индексы и триггеры, если их ещё нет, и один раз заполняет их
+    из products (rebuild). False — SQLite собран без FTS5, поиск пойдёт через LIKE.
+    На Postgres индексы создаёт миграция (alembic upgrade head) — здесь ничего не делается.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "sqlite":
+        return True
+    key = str(bind.url)
+    if key in _sqlite_search_ready:
+        return True
+    exists_ = db.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'products_trgm'")).first() is not None
+    if not exists_:
+        try:
+            for ddl in SQLITE_SEARCH_DDL:
+                db.execute(text(ddl))
+            db.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+            db.execute(text("INSERT INTO products_trgm(products_trgm) VALUES ('rebuild')"))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            if "fts5" not in str(e):
+                raise
+            return False
+    _sqlite_search_ready.add(key)
+    return True
+
+
+def search_products(db: Session, q: str, mode: str = "auto", limit: int = 20, offset: int = 0) -> Tuple[str, List[dict]]:
+    """
+    Товары, чьё название подходит под q, по убыванию релевантности (score), при равенстве — новые сначала.
+    Ранжируются SEARCH_CANDIDATES самых новых совпадений.
+    Возвращает (режим, которым искали на деле, строки SEARCH_COLUMNS + score).
+
+    Postgres: fts — to_tsvector('russian') @@ префиксный tsquery, ранг ts_rank_cd;
+    trgm — word_similarity (q <% name), оба по GIN-индексам миграции b2e8f4a1c7d3.
+    SQLite: FTS5 — слова по префиксам (ранг bm25) и триграммы (подстроки от 3 символов).
+    Прочие СУБД — LIKE по всем словам (полный просмотр).
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"unknown search mode: {mode!r}")
+    terms = [w.lower() for w in _WORD.findall(q)]
+    if not terms:
+        return (mode if mode != "auto" else "fts"), []
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        fts, trgm = _search_pg_fts, _search_pg_trgm
+    elif dialect == "sqlite" and ensure_search_index(db):
+        fts, trgm = _search_sqlite_fts, _search_sqlite_trgm
+    else:
+        fts = trgm = _search_like
+    if mode == "trgm":
+        return mode, trgm(db, q, terms, limit, offset)
+    rows = fts(db, q, terms, limit, offset)
+    if rows or mode == "fts":
+        return "fts", rows
+    if offset and fts(db, q, terms, 1, 0):
+        # страница за концом выдачи fts, а не повод переключаться на триграммы
+        return "fts", rows
+    return "trgm", trgm(db, q, terms, limit, offset)
+
+
+def _search_sql(candidates: str, score: str, join: str = "") -> str:
+    """
+    candidates — подзапрос совпадений по индексу (он сам добавляет ORDER BY ... DESC LIMIT :candidates),
+    score — ранг над ним; join — откуда брать колонки товара, если подзапрос даёт только rowid (FTS5).
+    """
+    prefix = "p." if join else ""
+    cols = ", ".join(f"{prefix}{c}" for c in SEARCH_COLUMNS)
+    return (
+        f"SELECT {cols}, {score} AS score FROM ({candidates}) c {join} "
+        f"ORDER BY score DESC, {prefix}id DESC LIMIT :limit OFFSET :offset"
+    )
+
+
+def _rows(db: Session, sql: str, **params) -> List[dict]:
+    return [dict(r) for r in db.execute(text(sql), {"candidates": SEARCH_CANDIDATES, **params}).mappings()]
+
+
+_PG_COLUMNS = ", ".join(SEARCH_COLUMNS)
+
+
+def _search_pg_fts(db: Session, q: str, terms: List[str], limit: int, offset: int) -> List[dict]:
+    # слова — только \w, так что собрать tsquery строкой безопасно; :* — префикс (набор ещё не закончен)
+    tsv, tsq = f"to_tsvector('{FTS_CONFIG}', name)", f"to_tsquery('{FTS_CONFIG}', :tsq)"
+    sql = _search_sql(
+        f"SELECT {_PG_COLUMNS} FROM products WHERE {tsv} @@ {tsq} ORDER BY id DESC LIMIT :candidates",
+        f"ts_rank_cd({tsv}, {tsq})",
+    )
+    return _rows(db, sql, tsq=" & ".join(f"{t}:*" for t in terms), limit=limit, offset=offset)
+
+
+def _search_pg_trgm(db: Session, q: str, terms: List[str], limit: int, offset: int) -> List[dict]:
+    sql = _search_sql(
+        f"SELECT {_PG_COLUMNS} FROM products WHERE :q <% name ORDER BY id DESC LIMIT :candidates",
+        "word_similarity(:q, name)",
+    )
+    return _rows(db, sql, q=" ".join(terms), limit=limit, offset=offset)
+
+
+def _search_fts5(db: Session, table: str, match: str, limit: int, offset: int) -> List[dict]:
+    sql = _search_sql(
+        f"SELECT rowid, bm25({table}) AS rank FROM {table} WHERE {table} MATCH :m "
+        f"ORDER BY rowid DESC LIMIT :candidates",
+        "-c.rank",
+        join="JOIN products p ON p.id = c.rowid",
+    )
+    return _rows(db, sql, m=match, limit=limit, offset=offset)
+
+
+def _search_sqlite_fts(db: Session, q: str, terms: List[str], limit: int, offset: int) -> List[dict]:
+    return _search_fts5(db, "products_fts", " ".join(f'"{t}"*' for t in terms), limit, offset)
+
+
+def _search_sqlite_trgm(db: Session, q: str, terms: List[str], limit: int, offset: int) -> List[dict]:
+    # триграммный токенизатор не находит слова короче 3 символов — их просто не учитываем
+    long_terms = [t for t in terms if len(t) >= 3]
+    if not long_terms:
+        return []
+    return _search_fts5(db, "products_trgm", " ".join(f'"{t}"' for t in long_terms), limit, offset)
+
+
+def _search_like(db: Session, q: str, terms: List[str], limit: int, offset: int) -> List[dict]:
+    """
+    Без индекса: все слова подстроками в названии, без ранжирования (score = 0), новые сначала.
+    SQLite приводит к нижнему регистру только латиницу — кириллица здесь ищется с учётом регистра.
+    """
+    table = Product.__table__
+    name = func.lower(table.c.name)
+    stmt = (
+        select(*(table.c[c] for c in SEARCH_COLUMNS), literal(0.0).label("score"))
+        .where(*(name.contains(t, autoescape=True) for t in terms))
+        .order_by(table.c.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    return [dict(r) for r in db.execute(stmt).mappings()]
@@ -9,8 +9,78 @@ DB_NAME = os.getenv("DB_NAME", "ваша_база")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# DATABASE_URL целиком перекрывает DB_* (например, sqlite:///wb.db для локального запуска)
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL)
+# Пул соединений (на процесс; у async-движка — свой такой же). Под нагрузкой API держите
+# DB_POOL_SIZE + DB_MAX_OVERFLOW не меньше числа одновременных запросов к БД — иначе
+# запрос ждёт свободное соединение до DB_POOL_TIMEOUT секунд.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# проверять соединение перед выдачей из пула (после рестарта Postgres или обрыва по простою)
+DB_POOL_PRE_PING = bool(int(os.getenv("DB_POOL_PRE_PING", "0")))
+# секунд до пересоздания соединения, -1 — не пересоздавать
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+# statement_timeout Postgres, мс (0 — без ограничения); в SQLite не действует
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+# DB_ASYNC=1 — чтение /products через async-движок (asyncpg / aiosqlite), поток на запрос не занимается
+DB_ASYNC = bool(int(os.getenv("DB_ASYNC", "0")))
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _pool_args(url: str) -> dict:
+    # SQLite в памяти живёт на одном соединении (SingletonThreadPool) — размеры пула к нему не относятся
+    if _is_sqlite(url) and (":memory:" in url or url.rstrip("/").endswith(":")):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+def _connect_args(url: str) -> dict:
+    if _is_sqlite(url):
+        return {"check_same_thread": False}
+    if DB_STATEMENT_TIMEOUT and url.startswith("postgresql"):
+        if "+asyncpg" in url:
+            return {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}}
+        return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"}
+    return {}
+
+
+def async_url(url: str) -> str:
+    """URL синхронного движка -> тот же для async-драйвера: postgresql+asyncpg, sqlite+aiosqlite."""
+    scheme, sep, rest = url.partition("://")
+    base = scheme.split("+", 1)[0]
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}.get(base)
+    if driver is None:
+        raise ValueError(f"DB_ASYNC=1: нет async-драйвера для {base!r} (ожидается postgresql или sqlite)")
+    return f"{base}+{driver}{sep}{rest}"
+
+
+engine = create_engine(DATABASE_URL, connect_args=_connect_args(DATABASE_URL), **_pool_args(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+# ASYNC_DATABASE_URL — если async-URL надо задать явно (иначе выводится из DATABASE_URL)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (async_url(DATABASE_URL) if DB_ASYNC else None)
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    try:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL, connect_args=_connect_args(ASYNC_DATABASE_URL), **_pool_args(ASYNC_DATABASE_URL),
+        )
+    except ImportError as e:
+        driver = "asyncpg" if "asyncpg" in ASYNC_DATABASE_URL else "aiosqlite"
+        raise ImportError(f"DB_ASYNC=1 требует {driver} и greenlet: pip install {driver} greenlet") from e
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
@@ -0,0 +1,316 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("app.jobs")
+
+JOBS_DB = os.getenv("WB_JOBS_DB", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "wb_jobs.db")))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Сколько секунд running-задача живёт без heartbeat, прежде чем её заберёт другой процесс.
+JOB_LEASE = float(os.getenv("WB_JOB_LEASE", "60"))
+
+# Владелец running-задачи: хост и pid процесса. После рестарта с тем же pid (pid 1 в контейнере)
+# свои running-задачи заведомо осиротели.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Очередь задач парсинга в одной SQLite-таблице.
+    Пока задача с тем же dedup_key в статусе queued/running, повторная
+    отправка возвращает её же (уникальный частичный индекс гарантирует это атомарно).
+    Взятая задача помечается владельцем (owner) и heartbeat; другие процессы
+    (uvicorn --workers N, перекатный рестарт) возвращают её в очередь, только если
+    heartbeat старше lease секунд.
+    """
+
+    def __init__(self, path: str = JOBS_DB, owner: str = WORKER_ID, lease: float = JOB_LEASE):
+        self.path = path
+        self.owner = owner
+        self.lease = lease
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS parse_jobs (
+                id          TEXT PRIMARY KEY,
+                dedup_key   TEXT NOT NULL,
+                params      TEXT NOT NULL,
+                status      TEXT NOT NULL,
+                progress    TEXT NOT NULL DEFAULT '{}',
+                result      TEXT,
+                error       TEXT,
+                created_at  REAL NOT NULL,
+                started_at  REAL,
+                finished_at REAL,
+                owner       TEXT,
+                heartbeat   REAL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_parse_jobs_active
+                ON parse_jobs (dedup_key) WHERE status IN ('queued', 'running');
+            CREATE INDEX IF NOT EXISTS ix_parse_jobs_status ON parse_jobs (status, created_at);
+            """
+        )
+        # файл очереди от версии без владельца задач
+        cols = {r["name"] for r in conn.execute("PRAGMA table_info(parse_jobs)")}
+        for col, typ in (("owner", "TEXT"), ("heartbeat", "REAL")):
+            if col not in cols:
+                conn.execute(f"ALTER TABLE parse_jobs ADD COLUMN {col} {typ}")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        d = dict(row)
+        d["params"] = json.loads(d["params"])
+        d["progress"] = json.loads(d["progress"] or "{}")
+        d["result"] = json.loads(d["result"]) if d["result"] else None
+        return d
+
+    def submit(self, dedup_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Ставит задачу в очередь. Возвращает задачу и флаг deduplicated."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM parse_jobs WHERE dedup_key = ? AND status IN ('queued', 'running')",
+                (dedup_key,),
+            ).fetchone()
+            if row is None:
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO parse_jobs (id, dedup_key, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                    (job_id, dedup_key, json.dumps(params, ensure_ascii=False), time.time()),
+                )
+                row = conn.execute("SELECT * FROM parse_jobs WHERE id = ?", (job_id,)).fetchone()
+                deduplicated = False
+            else:
+                deduplicated = True
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._row(row)
+        job["deduplicated"] = deduplicated
+        return job
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Забираем самую старую queued-задачу и переводим её в running."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM parse_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE parse_jobs SET status = 'running', started_at = ?, owner = ?, heartbeat = ? WHERE id = ?",
+                (now, self.owner, now, row["id"]),
+            )
+            job = conn.execute("SELECT * FROM parse_jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self._row(job)
+
+    def set_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        self._conn().execute(
+            "UPDATE parse_jobs SET progress = ?, heartbeat = ? WHERE id = ?",
+            (json.dumps(progress, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def heartbeat(self) -> int:
+        """Продлеваем lease всех running-задач этого владельца."""
+        cur = self._conn().execute(
+            "UPDATE parse_jobs SET heartbeat = ? WHERE status = 'running' AND owner = ?",
+            (time.time(), self.owner),
+        )
+        return cur.rowcount
+
+    def finish(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._conn().execute(
+            "UPDATE parse_jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._conn().execute(
+            "UPDATE parse_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (error, time.time(), job_id),
+        )
+
+    def requeue_running(self, own: bool = True) -> int:
+        """
+        Возвращаем в очередь осиротевшие running-задачи: с истёкшим lease (владелец
+        не продлевал heartbeat), без владельца и — при own=True, на старте процесса — свои.
+        Задачи живых соседних процессов не трогаем.
+        """
+        sql = (
+            "UPDATE parse_jobs SET status = 'queued', started_at = NULL, owner = NULL, heartbeat = NULL "
+            "WHERE status = 'running' AND (owner IS NULL OR heartbeat IS NULL OR heartbeat < ?"
+        )
+        params: List[Any] = [time.time() - self.lease]
+        if own:
+            sql += " OR owner = ?"
+            params.append(self.owner)
+        cur = self._conn().execute(sql + ")", params)
+        return cur.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._row(self._conn().execute("SELECT * FROM parse_jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        if status:
+            rows = self._conn().execute(
+                "SELECT * FROM parse_jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                "SELECT * FROM parse_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+
+class JobProgress:
+    """
+    Счётчики прогресса одной задачи. Вызывается из парсера на каждую страницу/партию;
+    в БД пишет не чаще раза в flush_every секунд. Если задача вышла за timeout —
+    бросает JobTimeout прямо в парсер, и обход прерывается.
+    """
+
+    def __init__(self, queue: JobQueue, job_id: str, timeout: Optional[float] = None, flush_every: float = 0.5):
+        self.queue = queue
+        self.job_id = job_id
+        self.timeout = timeout
+        self.flush_every = flush_every
+        self.started = time.monotonic()
+        self.counters: Dict[str, int] = {}
+        self._flushed = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, stage: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[stage] = self.counters.get(stage, 0) + n
+            now = time.monotonic()
+            if now - self._flushed >= self.flush_every:
+                self._flushed = now
+                self.queue.set_progress(self.job_id, self.counters)
+        if self.timeout and time.monotonic() - self.started > self.timeout:
+            raise JobTimeout(f"задача не уложилась в {self.timeout:.0f} с")
+
+    def set(self, stage: str, value: int) -> None:
+        """Итоговые счётчики (например, rows_upserted) — без проверки таймаута."""
+        with self._lock:
+            self.counters[stage] = value
+
+    def flush(self) -> None:
+        with self._lock:
+            self.queue.set_progress(self.job_id, self.counters)
+
+
+class JobWorkerPool:
+    """
+    Пул потоков, разбирающих очередь. handler(job, progress) -> dict с результатом.
+    Отдельный поток раз в lease/3 секунд продлевает heartbeat своих задач
+    и возвращает в очередь задачи умерших процессов.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[Dict[str, Any], JobProgress], Dict[str, Any]],
+        workers: int = 1,
+        timeout: Optional[float] = None,
+        poll_interval: float = 1.0,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        requeued = self.queue.requeue_running()
+        if requeued:
+            logger.info("requeued %d unfinished parse jobs", requeued)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"parse-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat_loop, name="parse-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads.clear()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(max(0.1, self.queue.lease / 3)):
+            try:
+                self.queue.heartbeat()
+                requeued = self.queue.requeue_running(own=False)
+            except sqlite3.Error as e:
+                logger.warning("parse jobs heartbeat failed: %s", e)
+                continue
+            if requeued:
+                logger.info("requeued %d parse jobs with expired lease", requeued)
+                self._wake.set()
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        progress = JobProgress(self.queue, job["id"], timeout=self.timeout)
+        try:
+            result = self.handler(job, progress)
+            progress.flush()
+            self.queue.finish(job["id"], result)
+        except JobTimeout as e:
+            progress.flush()
+            self.queue.fail(job["id"], str(e))
+        except Exception as e:
+            logger.warning("parse job %s failed: %s", job["id"], e)
+            progress.flush()
+            self.queue.fail(job["id"], "".join(traceback.format_exception_only(type(e), e)).strip())
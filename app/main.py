@@ -1,10 +1,53 @@
-from fastapi import FastAPI, Depends
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+from urllib.parse import quote, unquote
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
-from app import models, schemas, database, crud
+from app import models, database, crud, jobs
+from parser import metrics
+from parser.health import get_default_health
+from parser.pool import ParserPool
 from parser.wb_api import WBApiParser
 
-app = FastAPI(title="WB Parser API — минимальная версия")
-models.Base.metadata.create_all(bind=database.engine)
+logger = logging.getLogger("app.main")
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    """
+    Схема БД, воркеры задач и прогрев пула парсеров — при старте приложения, а не при импорте модуля
+    (импорт app.main не ходит ни в БД, ни в сеть).
+    """
+    models.Base.metadata.create_all(bind=database.engine)
+    job_workers.start()
+    if PARSER_POOL_WARM:
+        # geo и рукопожатия с WB — в фоне: API отвечает сразу, первая задача берёт готовый экземпляр
+        threading.Thread(target=_warm_parser_pool, name="parser-pool-warm", daemon=True).start()
+    yield
+    job_workers.stop()
+    parser_pool.close()
+
+app = FastAPI(title="WB Parser API — минимальная версия", lifespan=_lifespan)
+
+if metrics.ENABLED:
+    # без WB_METRICS middleware не ставится вовсе — запросы API ничего не платят
+    @app.middleware("http")
+    async def _api_metrics(request: Request, call_next):
+        t = time.perf_counter()
+        response = await call_next(request)
+        # шаблон маршрута (/products/{nm_id}/stocks), а не сам путь — чтобы меток было конечное число
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.API_REQUESTS.inc(request.method, route, str(response.status_code))
+        metrics.API_SECONDS.observe(request.method, route, value=time.perf_counter() - t)
+        return response
 
 def get_db():
     db = database.SessionLocal()
@@ -13,32 +56,467 @@ def get_db():
     finally:
         db.close()
 
-@app.post("/parse", summary="Спарсить и сохранить все товары по запросу 'термопаста'")
-def parse_products(db: Session = Depends(get_db)):
+DEFAULT_QUERY = "термопаста"
+# Сколько товаров поиска обогащается и пишется в БД за раз (WBApiParser.iter_parse).
+PARSE_BATCH_SIZE = int(os.getenv("WB_PARSE_BATCH", "500"))
+# Сколько запросов задачи обходится одновременно (общий бюджет запросов к WB — через лимитер).
+PARSE_QUERY_CONCURRENCY = int(os.getenv("WB_QUERY_CONCURRENCY", "4"))
+INCREMENTAL_MAX_AGE = float(os.getenv("WB_INCREMENTAL_MAX_AGE", str(24 * 3600)))
+HISTORY_RAW_DAYS = int(os.getenv("WB_HISTORY_RAW_DAYS", str(crud.HISTORY_RAW_DAYS)))
+HISTORY_KEEP_DAYS = int(os.getenv("WB_HISTORY_KEEP_DAYS", str(crud.HISTORY_KEEP_DAYS)))
+HISTORY_COMPACT_EVERY = 24 * 3600
+# Пул WBApiParser для задач /parse: свободных экземпляров на набор доп. регионов
+# (по умолчанию — по числу воркеров) и сколько создать и прогреть при старте.
+PARSER_POOL_SIZE = int(os.getenv("WB_PARSER_POOL", os.getenv("WB_PARSE_WORKERS", "1")))
+PARSER_POOL_WARM = int(os.getenv("WB_PARSER_POOL_WARM", "1"))
+parser_pool = ParserPool(size=PARSER_POOL_SIZE)
+_last_history_compaction = 0.0
+
+def _prepare_rows(rows: list[dict]) -> list[dict]:
     """
-    Собирает ВСЕ страницы по запросу 'термопаста' и сохраняет в БД.
+    Строки парсера -> строки для crud.upsert_products (неизменённые в инкрементальном режиме
+    и повторы товара по другому запросу пропускаем).
     """
-    parser = WBApiParser()
-    rows = parser.parse(query="термопаста", max_products=None, max_pages=None)
-
     prepared = []
     for p in rows:
+        if p.get("unchanged") or p.get("duplicate"):
+            continue
         prepared.append({
             "nm_id": int(p.get("nm_id") or p.get("id")),
             "name": (p.get("name") or "").strip(),
             "price": int(p.get("price_final") or p.get("price_api") or 0),
             "rating": float(p.get("rating") or 0.0),
             "review_count": int(p.get("review_count") or 0),
-            "stock": int(p.get("stock") or 0),
+            "stock": int(p["stock"]) if p.get("stock") is not None else None,
+            "stocks": p.get("stocks"),
+            "regions": p.get("regions"),
+            "fingerprint": p.get("fingerprint"),
         })
+    return prepared
+
+def run_parse_job(job: dict, progress: jobs.JobProgress) -> dict:
+    """
+    Тело фоновой задачи: обход WB по всем запросам (до WB_QUERY_CONCURRENCY одновременно).
+    Партии iter_parse пишутся в БД сразу, так что память ограничена несколькими партиями,
+    а не всей выдачей.
+    """
+    queries = job["params"].get("queries") or [job["params"]["query"]]
+    incremental = bool(job["params"].get("incremental"))
+    # без regions в задаче — доп. регионы из WB_REGIONS (или никаких)
+    t = time.perf_counter()
+    with parser_pool.acquire(job["params"].get("regions")) as parser:
+        setup_s = time.perf_counter() - t
+        parser.on_progress = progress
+        # чекпоинт продолжает только эта же задача (после рестарта) или её повтор через /retry
+        parser.run_id = job["params"].get("retry_of") or job["id"]
+
+        res = crud.UpsertResult()
+        per_query = {q: 0 for q in queries}
+        fetched = 0
+        db = database.SessionLocal()
+        try:
+            known = crud.load_fingerprints(db) if incremental else None
+            for rows in parser.iter_parse(
+                queries, max_products=None, max_pages=None,
+                known=known, max_age=INCREMENTAL_MAX_AGE, batch_size=PARSE_BATCH_SIZE,
+                concurrency=PARSE_QUERY_CONCURRENCY,
+            ):
+                res += crud.upsert_products(db, _prepare_rows(rows), touch_unchanged=incremental)
+                crud.upsert_positions(db, rows)
+                progress.set("rows_upserted", res.written)
+                progress.set("history_rows", res.history)
+                progress.set("stock_rows", res.stocks)
+                progress.set("region_rows", res.regions)
+                for r in rows:
+                    if not r.get("duplicate"):
+                        fetched += 1
+                    for q in r["queries"]:
+                        per_query[q["query"]] = per_query.get(q["query"], 0) + 1
+        finally:
+            db.close()
+        _maybe_compact_history()
+
+        return {
+            "inserted_or_updated": res.written,
+            "inserted": res.inserted,
+            "updated": res.updated,
+            "unchanged": res.unchanged,
+            "stock_rows": res.stocks,
+            "region_rows": res.regions,
+            "regions": [parser.geo.get("dest")] + [g["dest"] for g in parser.regions] if parser.regions else None,
+            "total_fetched": fetched,
+            "queries": per_query,
+            "incremental": incremental,
+            "saved": {
+                "detail_requests": parser.last_stats.get("detail_requests_saved", 0),
+                "html_requests": parser.last_stats.get("html_requests_saved", 0),
+                "writes": parser.last_stats.get("writes_saved", 0) + res.unchanged,
+            },
+            "html_requests": {
+                "made": parser.last_stats.get("html_requests", 0),
+                "cache_hits": parser.last_stats.get("html_cache_hits", 0),
+                "legacy_walk": parser.last_stats.get("html_requests_legacy", 0),
+                "failed": parser.last_stats.get("html_failed", 0),
+            },
+            "http_cache": parser.http_cache.stats() if parser.http_cache is not None else None,
+            "endpoints": parser.health.snapshot(),
+            "resumed": bool(parser.last_stats.get("resumed")),
+            "incomplete": parser.last_stats.get("incomplete", 0),
+            # сколько ушло на получение парсера: создание (cookies, geo) или выдача из пула (refresh)
+            "setup_ms": round(setup_s * 1000, 1),
+        }
+
+def _maybe_compact_history():
+    """Прореживание product_history — не чаще раза в сутки, после очередного обхода."""
+    global _last_history_compaction
+    if time.monotonic() - _last_history_compaction < HISTORY_COMPACT_EVERY and _last_history_compaction:
+        return
+    _last_history_compaction = time.monotonic()
+    db = database.SessionLocal()
+    try:
+        crud.compact_history(db, raw_days=HISTORY_RAW_DAYS, keep_days=HISTORY_KEEP_DAYS)
+    finally:
+        db.close()
+
+job_queue = jobs.JobQueue()
+job_workers = jobs.JobWorkerPool(
+    job_queue,
+    run_parse_job,
+    workers=int(os.getenv("WB_PARSE_WORKERS", "1")),
+    timeout=float(os.getenv("WB_PARSE_JOB_TIMEOUT", "0")) or None,
+)
+
+def _warm_parser_pool():
+    try:
+        parser_pool.warm(PARSER_POOL_WARM)
+    except Exception:
+        logger.exception("Не удалось прогреть пул парсеров")
+
+def _job_view(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "params": job["params"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+@app.post("/parse", status_code=202, summary="Поставить в очередь парсинг всех товаров по одному или нескольким запросам")
+def parse_products(
+    query: Optional[list[str]] = Query(None, description="Поисковый запрос; можно несколько (?query=a&query=b)"),
+    incremental: bool = Query(False, description="Перепроверять только товары, у которых изменилась выдача или устарели данные"),
+    region: Optional[list[str]] = Query(None, description="Доп. регионы: адрес или dest (?region=Казань&region=-1281648)"),
+):
+    """
+    Ставит задачу в очередь и сразу возвращает job_id.
+    Без query берётся 'термопаста'. Запросы обходятся параллельно, detail по общим
+    товарам запрашивается один раз; позиции товаров по запросам пишутся в search_positions.
+    Пока по тому же набору запросов идёт обход, повторный вызов возвращает ту же задачу.
+    incremental=true — detail/HTML только для изменившихся товаров (или старше WB_INCREMENTAL_MAX_AGE),
+    в result.saved — сколько запросов и записей сэкономлено против полного обхода.
+    region — цены и остатки ещё и по этим регионам (тем же обходом, detail по всем регионам
+    качается одновременно); пишутся в product_regions, см. GET /regions.
+    Статус и прогресс — GET /parse/jobs/{job_id}.
+    """
+    queries = WBApiParser._normalize_queries(query or [DEFAULT_QUERY])
+    if not queries:
+        raise HTTPException(status_code=422, detail="Пустой запрос")
+    regions = sorted({r.strip() for r in region or [] if r.strip()})
+    dedup_key = ("inc:" if incremental else "") + "\n".join(sorted(q.lower() for q in queries))
+    params = {"queries": queries, "incremental": incremental}
+    if regions:
+        dedup_key += "\nregions:" + ";".join(regions)
+        params["regions"] = regions
+    job = job_queue.submit(dedup_key, params)
+    job_workers.notify()
+    return {"job_id": job["id"], "status": job["status"], "deduplicated": job["deduplicated"]}
+
+@app.get("/parse/jobs", summary="Последние задачи парсинга")
+def list_parse_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    return [_job_view(j) for j in job_queue.list(status=status, limit=limit)]
+
+@app.get("/parse/jobs/{job_id}", summary="Статус и прогресс задачи парсинга")
+def get_parse_job(job_id: str):
+    """
+    progress: search_pages, detail_batches, html_pages, rows_upserted.
+    result (когда status=done): inserted/updated/unchanged, total_fetched.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return _job_view(job)
+
+@app.post("/parse/jobs/{job_id}/retry", status_code=202, summary="Повторить задачу парсинга с места остановки")
+def retry_parse_job(job_id: str):
+    """
+    Новая задача с теми же параметрами. С WB_CHECKPOINT_DB она продолжает чекпоинт
+    исходной задачи (result.resumed): уже скачанные страницы и detail не запрашиваются.
+    Обычный POST /parse чужой чекпоинт не продолжает.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job["status"] in jobs.ACTIVE_STATUSES:
+        raise HTTPException(status_code=409, detail="Задача ещё выполняется")
+    params = {**job["params"], "retry_of": job["params"].get("retry_of") or job["id"]}
+    new = job_queue.submit(job["dedup_key"], params)
+    job_workers.notify()
+    return {"job_id": new["id"], "status": new["status"], "deduplicated": new["deduplicated"]}
+
+@app.get("/parse/endpoints", summary="Живость эндпоинтов WB: доля успехов, задержка, выключенные")
+def parse_endpoints():
+    """state: up — рабочий, open — выключен на open_for секунд, probe — ждёт пробного запроса."""
+    return get_default_health().snapshot()
+
+@app.get("/metrics", summary="Метрики Prometheus (WB_METRICS=1)")
+def prometheus_metrics():
+    """
+    Запросы к WB (по эндпоинтам, статусам, время ответа), этапы обхода и записи
+    (wb_stage_seconds), строки upsert и запросы к API. Счётчики — на процесс.
+    """
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Метрики выключены (WB_METRICS=1)")
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK = 1000
+
+def _json_default(value):
+    """datetime (refreshed_at) — строкой ISO 8601: стандартный json.dumps его не кодирует."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _stream_ndjson(stmt):
+    """
+    Построчная выгрузка через серверный курсор (stream_results): в памяти
+    одновременно не больше STREAM_CHUNK строк. Сессия своя — она должна жить,
+    пока отдаётся ответ, а не только пока работает обработчик.
+    """
+    db = database.SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=STREAM_CHUNK))
+        for part in result.mappings().partitions():
+            yield "".join(json.dumps(dict(row), ensure_ascii=False, default=_json_default) + "\n" for row in part)
+    finally:
+        db.close()
+
+async def _astream_ndjson(stmt):
+    """_stream_ndjson через async-движок (DB_ASYNC=1)."""
+    async with database.AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=STREAM_CHUNK))
+        async for part in result.mappings().partitions():
+            yield "".join(json.dumps(dict(row), ensure_ascii=False, default=_json_default) + "\n" for row in part)
+
+async def _products_query(
+    limit: Optional[int] = Query(None, ge=1, description=f"Размер страницы; для json по умолчанию {PAGE_SIZE}, максимум {MAX_PAGE_SIZE}"),
+    cursor: Optional[int] = Query(None, description="Значение X-Next-Cursor из предыдущего ответа"),
+    price_min: Optional[int] = None,
+    price_max: Optional[int] = None,
+    rating_min: Optional[float] = None,
+    rating_max: Optional[float] = None,
+    stock_min: Optional[int] = None,
+    stock_max: Optional[int] = None,
+    nm_id: Optional[list[int]] = Query(None, description="Один или несколько nm_id"),
+    fields: Optional[str] = Query(None, description="Колонки через запятую, например nm_id,price,stock"),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+) -> dict:
+    """
+    Параметры GET /products -> запрос crud.products_select: для ndjson — вся выборка (limit необязателен),
+    для json — страница с лишней строкой (по ней видно, есть ли следующая).
+    async — чтобы разбор параметров не занимал поток из пула.
+    """
+    cols = None
+    if fields:
+        cols = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in cols if f not in crud.PRODUCT_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=422, detail=f"Неизвестные поля: {', '.join(unknown)}")
+
+    filters = dict(
+        fields=cols, cursor=cursor,
+        price_min=price_min, price_max=price_max,
+        rating_min=rating_min, rating_max=rating_max,
+        stock_min=stock_min, stock_max=stock_max,
+        nm_ids=nm_id,
+    )
+    if format == "ndjson":
+        return {"format": format, "stmt": crud.products_select(limit=limit, **filters)}
+    page_size = min(limit or PAGE_SIZE, MAX_PAGE_SIZE)
+    return {"format": format, "page_size": page_size, "stmt": crud.products_select(limit=page_size + 1, **filters)}
+
+def _products_page(rows: list[dict], page_size: int) -> Response:
+    headers = {}
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return Response(
+        json.dumps(rows, ensure_ascii=False, default=_json_default), media_type="application/json", headers=headers,
+    )
 
-    inserted = crud.upsert_products(db, prepared)
-    return {"inserted_or_updated": inserted, "total_fetched": len(prepared), "query": "термопаста"}
+def get_products(query: dict = Depends(_products_query), db: Session = Depends(get_db)):
+    """
+    Товары по убыванию id, keyset-пагинация: следующую страницу берём
+    с cursor = X-Next-Cursor (заголовок пуст — страниц больше нет).
+    format=ndjson — потоковая выгрузка всей выборки (limit необязателен),
+    по строке JSON на товар; память сервера не растёт с размером таблицы.
+    """
+    if query["format"] == "ndjson":
+        return StreamingResponse(_stream_ndjson(query["stmt"]), media_type="application/x-ndjson")
+    return _products_page([dict(r) for r in db.execute(query["stmt"]).mappings()], query["page_size"])
+
+async def get_products_async(query: dict = Depends(_products_query)):
+    """get_products через async-движок: ожидание БД не держит поток из пула."""
+    if query["format"] == "ndjson":
+        return StreamingResponse(_astream_ndjson(query["stmt"]), media_type="application/x-ndjson")
+    async with database.AsyncSessionLocal() as db:
+        rows = [dict(r) for r in (await db.execute(query["stmt"])).mappings()]
+    return _products_page(rows, query["page_size"])
+
+# Один маршрут, обработчик по DB_ASYNC; описание в OpenAPI — от синхронного.
+app.get(
+    "/products",
+    summary="Получить сохранённые товары (постранично, с фильтрами)",
+    description=inspect.cleandoc(get_products.__doc__),
+)(get_products_async if database.DB_ASYNC else get_products)
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+# глубже по релевантности листать незачем, а OFFSET на Postgres стоит пропорционально
+MAX_SEARCH_OFFSET = 1000
+
+@app.get("/products/search", summary="Поиск сохранённых товаров по названию")
+def search_products(
+    q: str = Query(..., min_length=1, max_length=200, description="Слова из названия, можно начало слова"),
+    mode: str = Query("auto", pattern="^(auto|fts|trgm)$", description="fts — по словам, trgm — по триграммам (опечатки, подстроки), auto — fts, а если пусто — trgm"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET, description="Значение X-Next-Offset из предыдущего ответа"),
+    db: Session = Depends(get_db),
+):
+    """
+    Товары по убыванию релевантности (score). X-Search-Mode — каким режимом искали на деле;
+    для следующих страниц его стоит передать в mode вместе с offset = X-Next-Offset
+    (заголовок пуст — результатов больше нет).
+    """
+    used, rows = crud.search_products(db, q, mode=mode, limit=limit + 1, offset=offset)
+    headers = {"X-Search-Mode": used}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if offset + limit <= MAX_SEARCH_OFFSET:
+            headers["X-Next-Offset"] = str(offset + limit)
+    return JSONResponse(rows, headers=headers)
+
+@app.get("/products/{nm_id}/history", summary="История цены/рейтинга/остатков товара")
+def get_product_history(
+    nm_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    """Точки истории, новые сначала. Точка появляется только когда что-то из price/rating/review_count/stock изменилось."""
+    return crud.product_history(db, nm_id, since=since, until=until, limit=limit)
+
+@app.get("/products/{nm_id}/stocks", summary="Остатки товара по складам и размерам")
+def get_product_stocks(nm_id: int, db: Session = Depends(get_db)):
+    """Строки wh, size, qty из последнего detail; сумма qty = products.stock."""
+    return JSONResponse([{**r, "updated_at": r["updated_at"].isoformat()} for r in crud.product_stocks(db, nm_id)])
+
+@app.get("/products/{nm_id}/regions", summary="Цена и остаток товара по регионам")
+def get_product_regions(nm_id: int, db: Session = Depends(get_db)):
+    """Строки dest, price, stock из последнего обхода с доп. регионами (POST /parse?region=...)."""
+    return JSONResponse([{**r, "updated_at": r["updated_at"].isoformat()} for r in crud.product_regions(db, nm_id)])
+
+@app.get("/regions", summary="Цены и остатки по регионам для многих товаров")
+def get_regions(
+    dest: Optional[list[int]] = Query(None, description="Регионы для сравнения (?dest=-1257786&dest=-1281648)"),
+    nm_id: Optional[list[int]] = Query(None, description="Ограничить товарами"),
+    cursor: Optional[str] = Query(None, description="Значение X-Next-Cursor из предыдущего ответа"),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    """
+    Строки nm_id, dest, price, stock по возрастанию (nm_id, dest): регионы товара идут подряд.
+    Следующая страница — cursor = X-Next-Cursor (пустой заголовок — всё).
+    """
+    after = None
+    if cursor:
+        try:
+            nm, d = cursor.split("|", 1)
+            after = (int(nm), int(d))
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Некорректный cursor")
+    rows = crud.region_prices(db, dests=dest, nm_ids=nm_id, after=after, limit=limit + 1)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = f"{rows[-1]['nm_id']}|{rows[-1]['dest']}"
+    return JSONResponse(
+        [{**r, "updated_at": r["updated_at"].isoformat()} for r in rows],
+        headers=headers,
+    )
+
+@app.get("/stocks", summary="Остатки на складах по многим товарам")
+def get_stocks(
+    wh: list[int] = Query(..., description="Один или несколько складов (?wh=117986&wh=507)"),
+    nm_id: Optional[list[int]] = Query(None, description="Ограничить товарами"),
+    qty_min: Optional[int] = Query(None, ge=0),
+    cursor: Optional[str] = Query(None, description="Значение X-Next-Cursor из предыдущего ответа"),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    """
+    Строки wh, nm_id, size, qty по возрастанию (wh, nm_id, size), по индексу (wh, nm_id).
+    Следующая страница — cursor = X-Next-Cursor (пустой заголовок — всё).
+    """
+    after = None
+    if cursor:
+        try:
+            w, nm, size = cursor.split("|", 2)
+            after = (int(w), int(nm), unquote(size))
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Некорректный cursor")
+    rows = crud.stocks_by_warehouse(db, wh, nm_ids=nm_id, qty_min=qty_min, after=after, limit=limit + 1)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        # размер бывает кириллицей, а заголовок — только latin-1
+        headers["X-Next-Cursor"] = f"{last['wh']}|{last['nm_id']}|{quote(last['size'])}"
+    return JSONResponse(
+        [{**r, "updated_at": r["updated_at"].isoformat()} for r in rows],
+        headers=headers,
+    )
 
-@app.get("/products", response_model=list[schemas.ProductSchema], summary="Получить все сохранённые товары")
-def get_products(db: Session = Depends(get_db)):
+@app.get("/history/price-changes", summary="Изменения цены по всем товарам начиная с момента since")
+def get_price_changes(
+    since: datetime,
+    cursor: Optional[str] = Query(None, description="Значение X-Next-Cursor из предыдущего ответа"),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
     """
-    ВАЖНО: отдаёт весь массив целиком.
-    Если записей 5k+, Swagger/браузер может подвисать — это ожидаемо.
+    Строки nm_id, ts, price_prev, price по возрастанию времени; первое появление товара сюда не попадает.
+    Следующая страница — cursor = X-Next-Cursor (пустой заголовок — всё).
     """
-    return db.query(models.Product).order_by(models.Product.id.desc()).all()
+    after = None
+    if cursor:
+        try:
+            ts, nm = cursor.rsplit("|", 1)
+            after = (datetime.fromisoformat(ts), int(nm))
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Некорректный cursor")
+    rows = crud.price_changes(db, since, after=after, limit=limit + 1)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = f"{rows[-1]['ts'].isoformat()}|{rows[-1]['nm_id']}"
+    return JSONResponse(
+        [{**r, "ts": r["ts"].isoformat()} for r in rows],
+        headers=headers,
+    )
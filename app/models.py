@@ -1,14 +1,95 @@
-from sqlalchemy import Column, Integer, BigInteger, Text, Float
+from sqlalchemy import Column, Integer, BigInteger, Text, Float, DateTime, Index, and_, func
 from app.database import Base
 
 class Product(Base):
     __tablename__ = "products"
 
-    id = Column(BigInteger, primary_key=True, index=True, autoincrement=True)
+    # BIGINT PRIMARY KEY в SQLite не автоинкрементный (rowid даёт только INTEGER PRIMARY KEY)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True, autoincrement=True)
     nm_id = Column(BigInteger, unique=True, index=True, nullable=False)
 
     name = Column(Text, nullable=False)
     price = Column(Integer, nullable=False)                
     rating = Column(Float, nullable=False, default=0.0)
     review_count = Column(Integer, nullable=False, default=0)
-    stock = Column(Integer, nullable=False, default=0)
+    # NULL — остаток неизвестен (detail по товару не ответил)
+    stock = Column(Integer, nullable=True, default=0)
+
+    # отпечаток полей поисковой выдачи и время последней проверки detail (инкрементальный режим)
+    fingerprint = Column(Text, nullable=True)
+    refreshed_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class ProductStock(Base):
+    """
+    Остатки товара по складам и размерам из последнего detail (products.stock — их сумма).
+    Набор строк товара заменяется целиком при каждом upsert, где detail ответил.
+    wh = -1 — склад в ответе не указан, size = '' — товар без размеров.
+    """
+    __tablename__ = "product_stocks"
+
+    nm_id = Column(BigInteger, primary_key=True)
+    wh = Column(BigInteger, primary_key=True)
+    size = Column(Text, primary_key=True, default="")
+    qty = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+    # «что есть на складе X»: поиск по wh, внутри — по nm_id
+    __table_args__ = (Index("ix_product_stocks_wh_nm_id", "wh", "nm_id"),)
+
+
+class ProductRegion(Base):
+    """
+    Цена и остаток товара по регионам доставки (dest) из обхода с доп. регионами
+    (WBApiParser(regions=...) / WB_REGIONS); основной регион пишется сюда же — для сравнения.
+    updated_at — когда цена или остаток в регионе последний раз изменились.
+    """
+    __tablename__ = "product_regions"
+
+    nm_id = Column(BigInteger, primary_key=True)
+    dest = Column(BigInteger, primary_key=True)
+    # NULL — detail региона не дал цены
+    price = Column(Integer, nullable=True)
+    stock = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+    # «все товары в регионе X»: поиск по dest, внутри — по nm_id
+    __table_args__ = (Index("ix_product_regions_dest_nm_id", "dest", "nm_id"),)
+
+
+class SearchPosition(Base):
+    """Под каким запросом и на какой позиции товар был в выдаче при последнем обходе."""
+    __tablename__ = "search_positions"
+
+    query = Column(Text, primary_key=True)
+    nm_id = Column(BigInteger, primary_key=True, index=True)
+    position = Column(Integer, nullable=False)
+    seen_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class ProductHistory(Base):
+    """
+    Append-only история цены/рейтинга/отзывов/остатков: строка пишется только
+    когда хоть одно из этих полей изменилось (crud.upsert_products).
+    price_prev — цена до изменения, чтобы «изменения цены с T» не требовали оконных функций.
+    """
+    __tablename__ = "product_history"
+
+    nm_id = Column(BigInteger, primary_key=True)
+    ts = Column(DateTime(timezone=True), primary_key=True)
+
+    price = Column(Integer, nullable=False)
+    price_prev = Column(Integer, nullable=True)
+    rating = Column(Float, nullable=False, default=0.0)
+    review_count = Column(Integer, nullable=False, default=0)
+    stock = Column(Integer, nullable=True, default=0)
+
+    __table_args__ = (
+        Index("ix_product_history_ts", "ts", postgresql_using="brin"),
+        Index(
+            "ix_product_history_price_changes", "ts", "nm_id",
+            # первая строка товара (price_prev IS NULL) — не изменение цены
+            postgresql_where=and_(price_prev.is_not(None), price_prev != price),
+            sqlite_where=and_(price_prev.is_not(None), price_prev != price),
+        ),
+    )
@@ -0,0 +1,152 @@
+"""
+Холодный старт API и подготовка парсера к задаче /parse на локальном моке WB (bench.mockwb).
+
+    python -m bench.coldstart [--latency-ms 50] [--repeat 10] [--json results.json]
+
+Каждый замер — в отдельном процессе (импорт с нуля):
+  - import      — import app.main (раньше там же создавались таблицы);
+  - startup     — вход в TestClient: lifespan (create_all, воркеры, прогрев пула в фоне);
+  - first job   — setup_ms первой задачи /parse: экземпляр из прогретого пула или новый;
+  - new parser  — WBApiParser() на каждую задачу, как было: cookies, UA, сессия, get-geo-info;
+  - new cached  — то же, но geo/X-Info уже в кэше процесса (WB_GEO_CACHE_TTL);
+  - pool        — ParserPool.acquire(): готовый экземпляр и refresh().
+latency-ms — задержка мока, то есть цена одного запроса get-geo-info к WB.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from bench.mockwb import COUNTERS, MockWB
+
+QUERY = "термопаста"
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+def _geo_requests(counters) -> int:
+    with counters.get_lock():
+        return counters[COUNTERS.index("geo")]
+
+
+def _child(name: str, env: Dict[str, str], repeat: int, counters, out) -> None:
+    """Тело дочернего процесса: env ставится до импорта parser/app."""
+    os.environ.update(env)
+    res: Dict[str, Any] = {}
+    geo_before = _geo_requests(counters)
+    if name == "api":
+        # этот процесс уже импортировал parser (через bench.mockwb) — импорт меряем в чистом интерпретаторе
+        code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+        res["import_ms"] = _ms(float(subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]))
+
+        from app import main
+        from fastapi.testclient import TestClient
+        client = TestClient(main.app)
+        t = time.perf_counter()
+        client.__enter__()
+        res["startup_ms"] = _ms(time.perf_counter() - t)
+        try:
+            # пусть фоновый прогрев закончится — иначе первая задача создаёт экземпляр сама
+            deadline = time.monotonic() + 30
+            while main.PARSER_POOL_WARM and not main.parser_pool.stats()["idle"] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            job_id = client.post("/parse", params={"query": QUERY}).json()["job_id"]
+            while True:
+                job = client.get(f"/parse/jobs/{job_id}").json()
+                if job["status"] not in ("queued", "running"):
+                    break
+                time.sleep(0.02)
+            res["first_job_setup_ms"] = job["result"]["setup_ms"] if job["status"] == "done" else None
+        finally:
+            client.__exit__(None, None, None)
+    else:
+        from parser import wb_api
+        from parser.pool import ParserPool
+        from parser.wb_api import WBApiParser
+
+        times: List[float] = []
+        if name == "pool":
+            pool = ParserPool(size=1)
+            pool.warm(1)
+            geo_before = _geo_requests(counters)
+            for _ in range(repeat):
+                t = time.perf_counter()
+                with pool.acquire():
+                    times.append(time.perf_counter() - t)
+            pool.close()
+        else:
+            if name == "new cached":
+                WBApiParser().close()  # geo попадает в кэш процесса
+                geo_before = _geo_requests(counters)
+            for _ in range(repeat):
+                if name == "new parser":
+                    wb_api._geo_cache.clear()  # как до кэша: get-geo-info на каждый экземпляр
+                t = time.perf_counter()
+                parser = WBApiParser()
+                times.append(time.perf_counter() - t)
+                parser.close()
+        res["setup_ms"] = _ms(statistics.mean(times))
+        res["setup_max_ms"] = _ms(max(times))
+    res["geo_requests"] = _geo_requests(counters) - geo_before
+    out.put(res)
+
+
+def run(name: str, env: Dict[str, str], repeat: int, srv: MockWB) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(name, env, repeat, srv.counters, out))
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError(f"{name} failed (exit {proc.exitcode})")
+    return out.get()
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--size", type=int, default=300, help="товаров в каталоге мока (для первой задачи)")
+    ap.add_argument("--json", help="куда записать результаты")
+    args = ap.parse_args(argv)
+
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp, MockWB(size=args.size, latency=args.latency_ms / 1000) as srv:
+        base_env = {
+            "WB_API_BASE": srv.base_url,
+            "WB_HOST_RATES": "127.0.0.1=1000",
+            "WB_JOBS_DB": os.path.join(tmp, "jobs.db"),
+            "DATABASE_URL": os.getenv("DATABASE_URL") or "sqlite:///" + os.path.join(tmp, "coldstart.db"),
+        }
+        results["api"] = run("api", base_env, args.repeat, srv)
+        results["new parser"] = run("new parser", base_env, args.repeat, srv)
+        results["new cached"] = run("new cached", base_env, args.repeat, srv)
+        results["pool"] = run("pool", base_env, args.repeat, srv)
+
+    api = results["api"]
+    print(f"mock latency {args.latency_ms:g} ms")
+    print(f"import app.main      {api['import_ms']:>9.1f} ms")
+    print(f"startup (lifespan)   {api['startup_ms']:>9.1f} ms")
+    print(f"first job setup      {api['first_job_setup_ms'] or 0:>9.1f} ms")
+    print(f"\n{'setup per job':<14} {'mean, ms':>9} {'max, ms':>9} {'geo req':>8}")
+    for name in ("new parser", "new cached", "pool"):
+        r = results[name]
+        print(f"{name:<14} {r['setup_ms']:>9.2f} {r['setup_max_ms']:>9.2f} {r['geo_requests']:>8}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,146 @@
+"""
+Нагрузка на GET /products: синхронный движок (поток из пула на запрос) против DB_ASYNC=1.
+
+    python -m bench.dbload [--rows 100000] [--concurrency 10 --concurrency 50] [--duration 10]
+    DATABASE_URL=postgresql://... python -m bench.dbload     # async — через asyncpg
+    DB_POOL_SIZE=20 DB_MAX_OVERFLOW=20 python -m bench.dbload
+
+Сервер — uvicorn app.main:app в отдельном процессе на каждый режим, с тем же окружением
+(DB_POOL_*, DB_STATEMENT_TIMEOUT и т.д.) плюс DB_ASYNC. Клиент — httpx.AsyncClient: concurrency
+запросов в полёте, страницы по 100 строк со случайным cursor и фильтром по цене.
+Меряются запросов в секунду, p50/p95/p99 и ошибки. На SQLite ожидание БД — это CPU,
+и разница меньше, чем на Postgres по сети. ВНИМАНИЕ: products в указанной базе очищается.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+from sqlalchemy import create_engine, delete, insert
+
+from app.models import Base, Product
+from bench.search import FILL_CHUNK, make_rows
+
+MODES = ("sync", "async")
+CONCURRENCY = (10, 50)
+PAGE = 100
+
+
+def fill(url: str, n: int) -> None:
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(delete(Product))
+        for start in range(0, n, FILL_CHUNK):
+            conn.execute(insert(Product), make_rows(min(FILL_CHUNK, n - start), start))
+    engine.dispose()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, env: Dict[str, str]) -> tuple:
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env, "DB_ASYNC": "1" if mode == "async" else "0"},
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn ({mode}) exited with {proc.returncode}")
+        try:
+            httpx.get(f"{base}/products", params={"limit": 1}, timeout=1)
+            return proc, base
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"uvicorn ({mode}) did not start")
+
+
+async def load(base: str, rows: int, concurrency: int, duration: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    rnd = random.Random(0)
+    stop = time.monotonic() + duration
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        while time.monotonic() < stop:
+            params = {"limit": PAGE, "cursor": rnd.randint(PAGE, rows), "price_min": rnd.randint(100, 4000)}
+            t = time.perf_counter()
+            try:
+                r = await client.get(f"{base}/products", params=params)
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - t)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        t = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - t
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 1),
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--concurrency", type=int, action="append", help="запросов в полёте (можно несколько)")
+    ap.add_argument("--duration", type=float, default=10.0, help="секунд на каждый замер")
+    ap.add_argument("--mode", action="append", choices=MODES)
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    env = {"WB_JOBS_DB": os.path.join(tmp, "jobs.db")}
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        url = env["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "dbload.db")
+    fill(url, args.rows)
+    print(f"db: {url.split(':', 1)[0]}, {args.rows} строк, пул {os.getenv('DB_POOL_SIZE', '5')}+{os.getenv('DB_MAX_OVERFLOW', '10')}")
+    print(f"{'mode':<6} {'conc':>5} {'req/s':>8} {'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8} {'errors':>7}")
+    for mode in args.mode or list(MODES):
+        proc, base = start_server(mode, env)
+        try:
+            for c in args.concurrency or list(CONCURRENCY):
+                asyncio.run(load(base, args.rows, c, min(2.0, args.duration)))  # прогрев
+                r = asyncio.run(load(base, args.rows, c, args.duration))
+                print(
+                    f"{mode:<6} {c:>5} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f}"
+                    f" {r['p99_ms']:>8.1f} {r['errors']:>7}"
+                )
+        finally:
+            proc.terminate()
+            proc.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
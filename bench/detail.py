@@ -0,0 +1,101 @@
+"""
+Сверка и время агрегации ответов card.wb.ru: чистый Python против NumPy (WB_DETAIL_NUMPY=1).
+
+    python -m bench.detail [ответы.json ...]
+
+По умолчанию берёт bench/fixtures/detail_*.json (сохранённые ответы detail кладите туда)
+и добавляет сгенерированные: 100 товаров с 1/10/40 размерами по 30 складов, плюс
+«грязный» ответ (qty не число, bool, нет wh, повтор id, товар без цен).
+Заодно сверяется разбивка по складам: та же у обоих путей, сумма по ней = остаток.
+Код возврата 1, если результаты разошлись.
+"""
+import glob
+import json
+import os
+import random
+import sys
+import timeit
+
+from parser.detail import HAS_NUMPY, apply_detail_payload, apply_detail_payload_np
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+GENERATED = ((100, 1, 30), (100, 10, 30), (100, 40, 30))
+
+
+def make_payload(n: int, sizes: int, warehouses: int, seed: int = 0) -> dict:
+    rnd = random.Random(seed)
+    products = []
+    for i in range(n):
+        basic = rnd.randint(100, 5000) * 100
+        products.append({
+            "id": 300_000_000 + i,
+            "priceU": basic,
+            "salePriceU": basic - rnd.randint(0, 50) * 100,
+            "sizes": [
+                {
+                    "name": str(s),
+                    "price": {"basic": basic, "product": basic - rnd.randint(0, 90) * 100, "total": basic - 100},
+                    "stocks": [{"wh": 100_000 + w, "qty": rnd.randint(0, 40)} for w in range(warehouses)],
+                }
+                for s in range(sizes)
+            ],
+        })
+    return {"data": {"products": products}}
+
+
+def make_dirty_payload() -> dict:
+    products = [
+        {"id": 1, "priceU": 12_300, "sizes": [{"stocks": [{"wh": 1, "qty": 5}, {"qty": 2}, {"wh": "x", "qty": "7"}]}]},
+        {"id": 2, "sizes": [{"price": {"basic": 0, "product": None}, "stocks": [{"wh": 3, "qty": True}]}]},
+        {"id": 3, "promoPriceU": 900, "sizes": []},
+        {"id": 0, "priceU": 100, "sizes": [{"stocks": [{"wh": 4, "qty": 1}]}]},
+        {"id": 1, "sizes": [{"stocks": [{"wh": 1, "qty": 1}]}]},
+        {"id": 4, "salePriceU": True, "sizes": [{"stocks": None, "price": {"total": 45_600}}]},
+        {"id": 5},
+    ]
+    return {"data": products}
+
+
+def aggregate(fn, payload, warehouses: bool = False):
+    id2stock, id2price = {}, {}
+    id2wh = {} if warehouses else None
+    fn(payload, id2stock, id2price, id2wh)
+    return id2stock, id2price, id2wh
+
+
+def main(argv: list[str]) -> int:
+    if not HAS_NUMPY:
+        print("нужен numpy: pip install numpy")
+        return 1
+    cases = []
+    for path in argv or sorted(glob.glob(os.path.join(FIXTURES, "detail_*.json"))):
+        with open(path, encoding="utf-8") as f:
+            cases.append((os.path.basename(path), json.load(f)))
+    for n, sizes, wh in GENERATED:
+        cases.append((f"gen {n}x{sizes}x{wh}", make_payload(n, sizes, wh)))
+    cases.append(("dirty", make_dirty_payload()))
+
+    ok = True
+    print(f"{'payload':<24} {'stocks':>8} {'python, ms':>11} {'numpy, ms':>10} {'speedup':>8}")
+    for name, payload in cases:
+        ref = aggregate(apply_detail_payload, payload, warehouses=True)
+        got = aggregate(apply_detail_payload_np, payload, warehouses=True)
+        wh_total = {pid: sum(q for _, _, q in rows) for pid, rows in ref[2].items()}
+        if got != ref or wh_total != ref[0] or aggregate(apply_detail_payload, payload)[:2] != ref[:2]:
+            ok = False
+            print(f"{name:<24} MISMATCH")
+            continue
+        n_stocks = sum(
+            len(s.get("stocks") or ())
+            for p in (payload["data"]["products"] if isinstance(payload["data"], dict) else payload["data"])
+            for s in (p.get("sizes") or ())
+        )
+        reps = max(3, 20_000 // max(n_stocks, 1))
+        a = min(timeit.repeat(lambda: aggregate(apply_detail_payload, payload), number=reps, repeat=3)) / reps
+        b = min(timeit.repeat(lambda: aggregate(apply_detail_payload_np, payload), number=reps, repeat=3)) / reps
+        print(f"{name:<24} {n_stocks:>8} {a * 1000:>11.3f} {b * 1000:>10.3f} {a / b if b else 0:>7.2f}x")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
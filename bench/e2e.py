@@ -0,0 +1,218 @@
+"""
+Сквозной бенчмарк на локальном моке WB (bench.mockwb): парсер и /parse целиком, без сети.
+
+    python -m bench.e2e [--size 1000 --size 10000] [--scenario parse ...] [--latency-ms 5]
+                        [--throttle 0.01] [--unavailable 0.005] [--cassette bench/fixtures/wb.jsonl]
+                        [--json results.json] [--baseline old.json --tolerance 0.2]
+
+Сценарии (каждый — в отдельном процессе, чтобы пик RSS был его собственным):
+  - parse       — WBApiParser.parse(), engine="sync";
+  - parse-async — то же, engine="async";
+  - api         — POST /parse -> задача в фоне -> товары в БД (DATABASE_URL или временный SQLite);
+  - api-rerun   — второй такой же POST /parse поверх заполненной БД (путь «ничего не поменялось»).
+Меряются: время, строк в секунду, запросов к моку по эндпоинтам и в секунду, пик RSS.
+--json пишет результаты (и версию кода) в файл; с --baseline сравнивает с прошлым файлом
+и возвращает 1, если время или память какого-то сценария выросли больше чем на tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bench.mockwb import COUNTERS, MockWB, ROUTES
+
+SCENARIOS = ("parse", "parse-async", "api", "api-rerun")
+SIZES = (1_000, 10_000)
+QUERY = "термопаста"
+# что сравнивается с --baseline: больше — хуже
+COMPARED = ("wall_s", "peak_rss_mb")
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _run_api(client, query: str) -> Dict[str, Any]:
+    job_id = client.post("/parse", params={"query": query}).json()["job_id"]
+    while True:
+        job = client.get(f"/parse/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+    if job["status"] != "done":
+        raise RuntimeError(f"job {job_id}: {job['status']} {job['error']}")
+    return job["result"]
+
+
+def _counts(counters) -> Dict[str, int]:
+    with counters.get_lock():
+        return dict(zip(COUNTERS, counters[:]))
+
+
+def _measure(counters, fn) -> Dict[str, Any]:
+    baseline = _peak_rss_mb()
+    before = _counts(counters)
+    t = time.perf_counter()
+    res = fn()
+    res["wall_s"] = round(time.perf_counter() - t, 3)
+    after = _counts(counters)
+    res["requests"] = {k: after[k] - before[k] for k in COUNTERS}
+    res["baseline_rss_mb"] = baseline
+    res["peak_rss_mb"] = _peak_rss_mb()
+    return res
+
+
+def _scenario(name: str, env: Dict[str, str], counters, out) -> None:
+    """Тело дочернего процесса: env ставится до импорта parser/app (DATABASE_URL, WB_*)."""
+    os.environ.update(env)
+    if not name.startswith("api"):
+        from parser.wb_api import WBApiParser
+
+        def crawl() -> Dict[str, Any]:
+            parser = WBApiParser()
+            rows = parser.parse(QUERY, engine="async" if name == "parse-async" else "sync")
+            return {"rows": len(rows), "incomplete": parser.last_stats.get("incomplete", 0)}
+
+        out.put(_measure(counters, crawl))
+        return
+
+    from fastapi.testclient import TestClient
+    from app import main  # таблицы создаются на входе в TestClient (lifespan) — в замер не входит
+
+    def load() -> Dict[str, Any]:
+        result = _run_api(client, QUERY)
+        return {
+            "rows": result["total_fetched"],
+            "written": result["inserted"] + result["updated"],
+            "unchanged": result["unchanged"],
+            "incomplete": result["incomplete"],
+        }
+
+    with TestClient(main.app) as client:
+        if name == "api-rerun":
+            _run_api(client, QUERY)
+        out.put(_measure(counters, load))
+
+
+def run_scenario(name: str, size: int, srv: MockWB, rate: float, tmp: str) -> Dict[str, Any]:
+    env = {
+        "WB_API_BASE": srv.base_url,
+        "WB_HOST_RATES": f"127.0.0.1={rate}",
+        "WB_JOBS_DB": os.path.join(tmp, f"{name}-{size}-jobs.db"),
+    }
+    if not os.getenv("DATABASE_URL"):
+        env["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, f"{name}-{size}.db")
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    proc = ctx.Process(target=_scenario, args=(name, env, srv.counters, out))
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError(f"scenario {name} failed (exit {proc.exitcode})")
+    res = out.get()
+    total = sum(res["requests"][k] for k in ROUTES)
+    res["req_per_s"] = round(total / res["wall_s"], 1) if res["wall_s"] else None
+    res["rows_per_s"] = round(res["rows"] / res["wall_s"], 1) if res["wall_s"] else None
+    return res
+
+
+def _git_version() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> bool:
+    """Печатает изменения против прошлого файла; False — есть регрессия больше tolerance."""
+    with open(baseline_path, encoding="utf-8") as f:
+        old = {(r["scenario"], r["size"]): r for r in json.load(f)["results"]}
+    ok = True
+    print(f"\nпротив {baseline_path} (допуск {tolerance:.0%}):")
+    for r in results:
+        prev = old.get((r["scenario"], r["size"]))
+        if prev is None:
+            continue
+        for key in COMPARED:
+            a, b = prev.get(key), r.get(key)
+            if not a or b is None:
+                continue
+            change = b / a - 1
+            bad = change > tolerance
+            ok = ok and not bad
+            mark = "  РЕГРЕССИЯ" if bad else ""
+            print(f"  {r['scenario']:<12} {r['size']:>7} {key:<12} {a:>9} -> {b:<9} {change:+.1%}{mark}")
+    return ok
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", type=int, action="append", help="товаров в каталоге мока (можно несколько)")
+    ap.add_argument("--scenario", action="append", choices=SCENARIOS)
+    ap.add_argument("--latency-ms", type=float, default=5.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--throttle", type=float, default=0.0, help="доля ответов 429")
+    ap.add_argument("--unavailable", type=float, default=0.0, help="доля ответов 503")
+    ap.add_argument("--dead", action="append", default=[], help="путь (часть), всегда 404")
+    ap.add_argument("--cassette", help="записанные ответы WB (bench.mockwb record); size тогда не важен")
+    ap.add_argument("--rate", type=float, default=1000.0, help="скорость лимитера на мок, запросов/сек")
+    ap.add_argument("--json", help="куда записать результаты")
+    ap.add_argument("--baseline", help="прошлый --json для сравнения")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    sizes = args.size or list(SIZES)
+    scenarios = args.scenario or list(SCENARIOS)
+    results: List[Dict[str, Any]] = []
+    print(f"{'scenario':<12} {'size':>7} {'rows':>7} {'time, s':>8} {'rows/s':>8} {'req':>6} {'req/s':>7} {'RSS, MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            with MockWB(
+                size=size, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                throttle=args.throttle, unavailable=args.unavailable, dead=args.dead, cassette=args.cassette,
+            ) as srv:
+                for name in scenarios:
+                    res = {"scenario": name, "size": size, **run_scenario(name, size, srv, args.rate, tmp)}
+                    results.append(res)
+                    total = sum(res["requests"][k] for k in ROUTES)
+                    print(
+                        f"{name:<12} {size:>7} {res['rows']:>7} {res['wall_s']:>8.2f} {res['rows_per_s']:>8.0f}"
+                        f" {total:>6} {res['req_per_s']:>7.0f} {res['peak_rss_mb'] or '-':>8}"
+                    )
+
+    report = {
+        "meta": {
+            "version": _git_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "args": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    ok = compare(results, args.baseline, args.tolerance) if args.baseline else True
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
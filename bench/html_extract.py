@@ -0,0 +1,127 @@
+"""
+Микробенчмарк и сверка разбора карточек search.aspx.
+
+    python -m bench.html_extract [файлы.html ...]
+
+По умолчанию берёт все bench/fixtures/*.html (сохранённые страницы WB кладите туда же).
+Для каждой страницы сравнивает WBApiParser._extract_cards_from_html с прежней
+реализацией (legacy_extract_cards ниже) и печатает время на страницу.
+Код возврата 1, если результаты разошлись.
+"""
+import glob
+import os
+import re
+import sys
+import timeit
+from html import unescape
+
+from parser.wb_api import WBApiParser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def legacy_extract_cards(parser: WBApiParser, html: str):
+    """Реализация до однопроходного разбора — эталон для сверки."""
+    out = {}
+
+    article_re = re.compile(
+        r'<article\b([^>]*)>(.*?)</article>',
+        flags=re.S | re.I
+    )
+
+    for m in article_re.finditer(html):
+        attrs_str = m.group(1) or ""
+        block = m.group(2) or ""
+
+        nm_id = None
+        for pat in (
+            r'(?:\s|^)data-nm-id\s*=\s*"(\d+)"',
+            r'(?:\s|^)data-id\s*=\s*"(\d+)"',
+            r'(?:\s|^)id\s*=\s*"c(\d+)"',
+        ):
+            mi = re.search(pat, attrs_str, flags=re.I)
+            if mi:
+                try:
+                    nm_id = int(mi.group(1))
+                    break
+                except Exception:
+                    pass
+        if not nm_id:
+            continue
+
+        idx = None
+        for pat in (
+            r'(?:\s|^)data-card-index\s*=\s*"(\d+)"',
+            r'(?:\s|^)data-card-idx\s*=\s*"(\d+)"',
+            r'(?:\s|^)data-index\s*=\s*"(\d+)"',
+        ):
+            mi = re.search(pat, attrs_str, flags=re.I)
+            if mi:
+                try:
+                    idx = int(mi.group(1))
+                    break
+                except Exception:
+                    pass
+
+        price = None
+        m_price = re.search(
+            r'<(?:ins|span)\b[^>]*class="[^"]*price__lower-price[^"]*"[^>]*>([\s\S]*?)</(?:ins|span)>',
+            block, flags=re.I
+        )
+        if not m_price:
+            m_price = re.search(
+                r'class="[^"]*price[^"]*"[\s\S]*?>([\s\S]*?)(?:₽|руб)',
+                block, flags=re.I
+            )
+        if m_price:
+            raw = unescape(m_price.group(1))
+            raw_digits = re.sub(r'[^\d]', '', raw)
+            if raw_digits.isdigit():
+                try:
+                    price = int(raw_digits)
+                except Exception:
+                    price = None
+
+        out[nm_id] = {"wallet_price": price, "index": idx}
+
+    if not out or any(v.get("wallet_price") is None and v.get("index") is None for v in out.values()):
+        from_state = parser._extract_from_wbstate(html)
+        for nid, meta in from_state.items():
+            if nid not in out:
+                out[nid] = meta
+            else:
+                if out[nid].get("wallet_price") is None and meta.get("wallet_price") is not None:
+                    out[nid]["wallet_price"] = meta["wallet_price"]
+                if out[nid].get("index") is None and meta.get("index") is not None:
+                    out[nid]["index"] = meta["index"]
+
+    return out
+
+
+def main(paths):
+    paths = paths or sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+    # разбор не трогает сеть и настройки — __init__ (cookies, geo) не нужен
+    parser = WBApiParser.__new__(WBApiParser)
+    failed = False
+    print(f"{'page':<32} {'cards':>5} {'legacy, ms':>11} {'new, ms':>9} {'speedup':>8}  parity")
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        old = legacy_extract_cards(parser, html)
+        new = parser._extract_cards_from_html(html)
+        ok = old == new
+        failed |= not ok
+
+        n = 50
+        t_old = timeit.timeit(lambda: legacy_extract_cards(parser, html), number=n) / n * 1000
+        t_new = timeit.timeit(lambda: parser._extract_cards_from_html(html), number=n) / n * 1000
+        print(f"{os.path.basename(path):<32} {len(new):>5} {t_old:>11.2f} {t_new:>9.2f} {t_old / t_new:>7.1f}x  {'ok' if ok else 'MISMATCH'}")
+        if not ok:
+            for k in sorted(set(old) | set(new)):
+                if old.get(k) != new.get(k):
+                    print(f"    {k}: legacy={old.get(k)} new={new.get(k)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
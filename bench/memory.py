@@ -0,0 +1,117 @@
+"""
+Память под результат парсинга: список словарей против parser.records.ProductColumns.
+
+    python -m bench.memory [число товаров ...]     # по умолчанию 5000 и 50000
+
+Выдача search.wb.ru генерируется здесь же, постранично по 100 товаров, с вложенными
+sizes/colors/... как у настоящего ответа. Сравниваются:
+  - dicts   — прежний путь: сырые товары живут до конца, итог — список словарей;
+  - columns — товар ужимается до нужных полей сразу после страницы, итог — ProductColumns.
+Меряется пик tracemalloc за прогон и сколько занимает сам результат.
+Код возврата 1, если строки двух путей разошлись.
+"""
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from parser.wb_api import WBApiParser
+
+SIZES = (5_000, 50_000)
+PER_PAGE = 100
+BRANDS = ("Arctic", "Noctua", "Thermal Grizzly", "Cooler Master", "DeepCool", "КПТ")
+
+
+def make_page(page: int, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed * 100_003 + page)
+    out = []
+    for i in range(PER_PAGE):
+        n = (page - 1) * PER_PAGE + i
+        price = rnd.randint(100, 5000) * 100
+        out.append({
+            "id": 100_000_000 + n,
+            "root": 90_000_000 + n,
+            "kindId": 0,
+            "subjectId": 3390,
+            "name": f"Термопаста {BRANDS[n % len(BRANDS)]} {n % 40} г",
+            "brand": BRANDS[n % len(BRANDS)],
+            "brandId": 1000 + n % len(BRANDS),
+            "supplierId": 500_000 + n % 300,
+            "supplierRating": 4.8,
+            "reviewRating": round(rnd.uniform(3, 5), 1),
+            "feedbacks": rnd.randint(0, 10_000),
+            "priceU": price,
+            "salePriceU": price - 1000,
+            "totalQuantity": rnd.randint(0, 500),
+            "colors": [{"name": "серый", "id": 8421504}],
+            "sizes": [
+                {
+                    "name": "", "origName": "0", "optionId": 300_000_000 + n,
+                    "price": {"basic": price, "product": price - 1000, "total": price - 1000, "logistics": 0},
+                    "stocks": [{"wh": 117986 + w, "qty": rnd.randint(0, 50)} for w in range(4)],
+                }
+            ],
+            "pics": 5,
+            "time1": 2,
+            "time2": 40,
+        })
+    return out
+
+
+def crawl(parser: WBApiParser, n: int, columnar: bool):
+    """Поиск + сборка строк, как parse() без сети: detail и HTML-мета берутся из выдачи."""
+    items, id2stock = [], {}
+    for page in range(1, n // PER_PAGE + 1):
+        raw = make_page(page)
+        for p in raw:
+            id2stock[p["id"]] = p["totalQuantity"]
+        if columnar:
+            items.extend(parser._slim_product(p) for p in raw)
+        else:
+            items.extend(raw)
+    return parser._result_rows(items, [], id2stock, {}, {}, columnar)
+
+
+def measure(parser: WBApiParser, n: int, columnar: bool):
+    gc.collect()
+    tracemalloc.start()
+    t = time.perf_counter()
+    rows = crawl(parser, n, columnar)
+    elapsed = time.perf_counter() - t
+    gc.collect()
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, kept, peak, elapsed
+
+
+def main(argv: list[str]) -> int:
+    sizes = [int(a) for a in argv] or list(SIZES)
+    parser = WBApiParser.__new__(WBApiParser)
+    parser._wh_stocks = {}
+    parser._region_detail = {}
+    parser.regions = []
+    mb = 1024 * 1024
+    ok = True
+    print(f"{'rows':>7} {'mode':<8} {'peak, MB':>9} {'result, MB':>11} {'B/row':>7} {'time, s':>8}")
+    for n in sizes:
+        results = {}
+        for mode, columnar in (("dicts", False), ("columns", True)):
+            rows, kept, peak, elapsed = measure(parser, n, columnar)
+            results[mode] = rows
+            print(f"{n:>7} {mode:<8} {peak / mb:>9.1f} {kept / mb:>11.1f} {kept / n:>7.0f} {elapsed:>8.2f}")
+        same = list(results["columns"]) == results["dicts"]
+        ok = ok and same
+        if not same:
+            print(f"{n:>7} MISMATCH: строки columns и dicts разошлись")
+        try:
+            t = time.perf_counter()
+            table = results["columns"].to_arrow()
+            print(f"{n:>7} to_arrow {table.nbytes / mb:>9.1f} MB  {time.perf_counter() - t:.3f} s")
+        except ImportError:
+            pass
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,358 @@
+"""
+Локальный мок WB: search.wb.ru, card.wb.ru, search.aspx и get-geo-info на одном порту.
+
+    python -m bench.mockwb serve [--size 10000] [--latency-ms 20] [--throttle 0.02] [--unavailable 0.01]
+                                 [--dead v5/search] [--cassette bench/fixtures/wb.jsonl] [--port 8800]
+    python -m bench.mockwb record термопаста [ещё запросы ...] --out bench/fixtures/wb.jsonl [--max-products 500]
+
+Парсер ходит в мок, если задан WB_API_BASE=http://127.0.0.1:8800 (пути те же, что у WB);
+лимитер на этот хост поднимается через WB_HOST_RATES=127.0.0.1=1000.
+
+Каталог:
+  - синтетический: на любой запрос size товаров (как в bench.memory), detail и HTML-страницы
+    генерируются из тех же товаров, так что цены и остатки сходятся между эндпоинтами;
+  - записанный (--cassette): ответы настоящего WB, снятые командой record. Выдача поиска
+    и товары detail индексируются по запросу и nm_id, поэтому мок отвечает и на другие
+    limit/партии, чем были при записи; HTML-страницы отдаются как записаны.
+Задержка — latency-ms на ответ (и jitter-ms сверху, равномерно). throttle и unavailable — доля
+ответов 429 и 503 (с Retry-After: 0); dead — пути, которые всегда отвечают 404.
+Сервер работает в дочернем процессе и считает запросы по эндпоинтам (MockWB.counts()).
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from bench.memory import PER_PAGE, make_page
+
+ROUTES = ("search", "detail", "html", "geo")
+# Счётчики сервера: запросы по ROUTES, затем отданные 429, 503 и 404.
+COUNTERS = ROUTES + ("throttled", "unavailable", "dead")
+XINFO = "appType=1&curr=rub&dest=-1257786&spp=30"
+FIRST_ID = 100_000_000
+HTML_PER_PAGE = 100
+
+
+def route(path: str) -> Optional[str]:
+    if path.endswith("/search"):
+        return "search"
+    if path.startswith("/cards/") and path.endswith("/detail"):
+        return "detail"
+    if path.endswith("/search.aspx"):
+        return "html"
+    if path.endswith("/get-geo-info"):
+        return "geo"
+    return None
+
+
+@lru_cache(maxsize=256)
+def _page(page: int, seed: int) -> List[Dict[str, Any]]:
+    return make_page(page, seed)
+
+
+def _html_page(query: str, cards: Sequence[Dict[str, Any]], start: int) -> str:
+    """Страница search.aspx в разметке, которую разбирает WBApiParser._extract_cards_from_html."""
+    out = [f"<!DOCTYPE html><html><head><title>{query} — купить</title></head><body><div class=\"product-card-list\">"]
+    for k, p in enumerate(cards):
+        price = (p.get("salePriceU") or p.get("priceU") or 0) // 100
+        wallet = price * 97 // 100
+        out.append(
+            f'<article class="product-card" data-nm-id="{p["id"]}" data-card-index="{start + k}">'
+            f'<div class="product-card__wrapper"><div class="product-card__price price">'
+            f'<ins class="price__lower-price wallet-price">{wallet}&nbsp;₽</ins>'
+            f'<del>{price}&nbsp;₽</del></div>'
+            f'<h2 class="product-card__brand-wrap"><span class="product-card__brand">{p.get("brand", "")}</span>'
+            f'<span class="product-card__name"> / {p.get("name", "")}</span></h2></div></article>'
+        )
+    out.append("</div></body></html>")
+    return "\n".join(out)
+
+
+class SyntheticCatalog:
+    """На любой запрос — одни и те же size товаров; товар n строится bench.memory.make_page."""
+
+    def __init__(self, size: int, seed: int = 0):
+        self.size = size
+        self.seed = seed
+
+    def _product(self, n: int) -> Dict[str, Any]:
+        return _page(n // PER_PAGE + 1, self.seed)[n % PER_PAGE]
+
+    def _range(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        return [self._product(n) for n in range(max(0, start), min(stop, self.size))]
+
+    def search(self, query: str, page: int, limit: int) -> List[Dict[str, Any]]:
+        return self._range((page - 1) * limit, page * limit)
+
+    def detail(self, ids: Sequence[int]) -> List[Dict[str, Any]]:
+        return [self._product(i - FIRST_ID) for i in ids if 0 <= i - FIRST_ID < self.size]
+
+    def html(self, query: str, page: int) -> str:
+        start = (page - 1) * HTML_PER_PAGE
+        return _html_page(query, self._range(start, start + HTML_PER_PAGE), start)
+
+
+class RecordedCatalog:
+    """Ответы, записанные `record`: выдача по запросу, товары detail по nm_id, HTML по (запрос, страница)."""
+
+    def __init__(self, path: str):
+        self.search_items: Dict[str, List[Dict[str, Any]]] = {}
+        self.products: Dict[int, Dict[str, Any]] = {}
+        self.pages: Dict[Tuple[str, int], str] = {}
+        self.xinfo = XINFO
+        search_pages: Dict[str, Dict[Tuple[int, int], List[Dict[str, Any]]]] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                if rec["status"] != 200:
+                    continue
+                params = rec["params"]
+                kind = route(urlsplit(rec["url"]).path)
+                if kind == "search":
+                    products = ((json.loads(rec["body"]) or {}).get("data") or {}).get("products") or []
+                    page, limit = int(params["page"]), int(params["limit"])
+                    search_pages.setdefault(params["query"], {})[(page, limit)] = products
+                elif kind == "detail":
+                    for p in ((json.loads(rec["body"]) or {}).get("data") or {}).get("products") or []:
+                        self.products[p["id"]] = p
+                elif kind == "html":
+                    self.pages[(params["search"], int(params["page"]))] = rec["body"]
+                elif kind == "geo":
+                    self.xinfo = (json.loads(rec["body"]) or {}).get("xinfo") or XINFO
+        # страницы поиска склеиваются в одну выдачу: дальше её можно резать любым limit
+        for query, pages in search_pages.items():
+            seen, items = set(), []
+            for (page, limit) in sorted(pages):
+                for p in pages[(page, limit)]:
+                    if p["id"] not in seen:
+                        seen.add(p["id"])
+                        items.append(p)
+            self.search_items[query] = items
+
+    def search(self, query: str, page: int, limit: int) -> List[Dict[str, Any]]:
+        return self.search_items.get(query, [])[(page - 1) * limit:page * limit]
+
+    def detail(self, ids: Sequence[int]) -> List[Dict[str, Any]]:
+        return [self.products[i] for i in ids if i in self.products]
+
+    def html(self, query: str, page: int) -> str:
+        html = self.pages.get((query, page))
+        if html is None:
+            start = (page - 1) * HTML_PER_PAGE
+            html = _html_page(query, self.search_items.get(query, [])[start:start + HTML_PER_PAGE], start)
+        return html
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        srv = self.server
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        kind = route(parts.path)
+        if kind is None:
+            return self._send(404, b"{}")
+        srv.count(kind)
+        delay = srv.latency + (srv.rnd.uniform(0, srv.jitter) if srv.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if any(d in parts.path for d in srv.dead):
+            srv.count("dead")
+            return self._send(404, b"{}")
+        roll = srv.rnd.random()
+        if kind != "geo" and roll < srv.throttle:
+            srv.count("throttled")
+            return self._send(429, b"{}", {"Retry-After": "0"})
+        if kind != "geo" and roll < srv.throttle + srv.unavailable:
+            srv.count("unavailable")
+            return self._send(503, b"{}", {"Retry-After": "0"})
+
+        catalog = srv.catalog
+        if kind == "search":
+            products = catalog.search(params.get("query", ""), int(params.get("page", 1)), int(params.get("limit", 100)))
+            body = {"data": {"products": products}}
+        elif kind == "detail":
+            ids = [int(x) for x in params.get("nm", "").split(";") if x.strip().isdigit()]
+            body = {"data": {"products": catalog.detail(ids)}}
+        elif kind == "geo":
+            body = {"xinfo": getattr(catalog, "xinfo", XINFO)}
+        else:
+            html = catalog.html(params.get("search", ""), int(params.get("page", 1)))
+            return self._send(200, html.encode(), {"Content-Type": "text/html; charset=utf-8"})
+        self._send(200, json.dumps(body, ensure_ascii=False).encode())
+
+    def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        headers = {"Content-Type": "application/json; charset=utf-8", **(headers or {})}
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(port, counters, options: Dict[str, Any]) -> None:
+    srv = ThreadingHTTPServer(("127.0.0.1", options["port"]), _Handler)
+    srv.daemon_threads = True
+    srv.request_queue_size = 128
+    cassette = options.get("cassette")
+    srv.catalog = RecordedCatalog(cassette) if cassette else SyntheticCatalog(options["size"], options["seed"])
+    srv.latency = options["latency"]
+    srv.jitter = options["jitter"]
+    srv.throttle = options["throttle"]
+    srv.unavailable = options["unavailable"]
+    srv.dead = tuple(options["dead"])
+    srv.rnd = random.Random(options["seed"])
+
+    def count(name: str) -> None:
+        with counters.get_lock():
+            counters[COUNTERS.index(name)] += 1
+
+    srv.count = count
+    port.value = srv.server_address[1]
+    srv.serve_forever()
+
+
+class MockWB:
+    """
+    Мок WB в дочернем процессе (его потоки не делят GIL с парсером).
+    base_url — значение для WB_API_BASE; counts() — запросы по эндпоинтам с момента запуска.
+    """
+
+    def __init__(
+        self,
+        size: int = 1000,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        throttle: float = 0.0,
+        unavailable: float = 0.0,
+        dead: Sequence[str] = (),
+        cassette: Optional[str] = None,
+        seed: int = 0,
+        port: int = 0,
+    ):
+        # spawn — как на Windows; счётчики тогда можно отдать и в процессы bench.e2e
+        ctx = multiprocessing.get_context("spawn")
+        self.port = ctx.Value("i", 0)
+        self.counters = ctx.Array("i", len(COUNTERS))
+        options = {
+            "size": size, "latency": latency, "jitter": jitter, "throttle": throttle,
+            "unavailable": unavailable, "dead": list(dead), "cassette": cassette, "seed": seed, "port": port,
+        }
+        self.proc = ctx.Process(target=_serve, args=(self.port, self.counters, options), daemon=True)
+        self.proc.start()
+        while not self.port.value:
+            if not self.proc.is_alive():
+                raise RuntimeError("mock WB server failed to start")
+            time.sleep(0.01)
+        self.base_url = f"http://127.0.0.1:{self.port.value}"
+
+    def counts(self) -> Dict[str, int]:
+        with self.counters.get_lock():
+            return dict(zip(COUNTERS, self.counters[:]))
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        self.proc.join()
+
+    def __enter__(self) -> "MockWB":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class RecordingTransport:
+    """Обёртка над транспортом парсера: каждый ответ дописывается строкой JSON в файл."""
+
+    def __init__(self, transport, path: str):
+        self.transport = transport
+        self.file = open(path, "a", encoding="utf-8")
+        self.recorded = 0
+
+    def get(self, url: str, params=None, **kwargs):
+        r = self.transport.get(url, params=params, **kwargs)
+        rec = {
+            "url": url,
+            "params": {k: str(v) for k, v in (params or {}).items()},
+            "status": r.status_code,
+            "body": r.text,
+        }
+        self.file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.recorded += 1
+        return r
+
+    def close(self) -> None:
+        self.file.close()
+        self.transport.close()
+
+
+def record(queries: List[str], out: str, max_products: Optional[int]) -> int:
+    """Обход настоящего WB с записью ответов: нужны рабочие cookies/X-Info, как для обычного parse()."""
+    from parser.wb_api import WBApiParser
+
+    parser = WBApiParser()
+    parser.transport = RecordingTransport(parser.transport, out)
+    # ответ get-geo-info пришёл ещё до подмены транспорта — пишем его отдельно
+    parser.transport.file.write(json.dumps({
+        "url": parser.GEO_URL, "params": {}, "status": 200, "body": json.dumps({"xinfo": parser.xinfo_raw or XINFO}),
+    }) + "\n")
+    for query in queries:
+        rows = parser.parse(query, max_products=max_products)
+        print(f"{query!r}: {len(rows)} товаров")
+    print(f"записано ответов: {parser.transport.recorded} -> {out}")
+    parser.transport.close()
+    return 0
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sp = sub.add_parser("serve", help="поднять мок и ждать Ctrl+C")
+    sp.add_argument("--size", type=int, default=10_000)
+    sp.add_argument("--latency-ms", type=float, default=0.0)
+    sp.add_argument("--jitter-ms", type=float, default=0.0)
+    sp.add_argument("--throttle", type=float, default=0.0, help="доля ответов 429")
+    sp.add_argument("--unavailable", type=float, default=0.0, help="доля ответов 503")
+    sp.add_argument("--dead", action="append", default=[], help="путь (часть), всегда 404: v5/search, cards/v2")
+    sp.add_argument("--cassette", help="файл из record вместо синтетического каталога")
+    sp.add_argument("--seed", type=int, default=0)
+    sp.add_argument("--port", type=int, default=8800)
+    rp = sub.add_parser("record", help="записать ответы настоящего WB")
+    rp.add_argument("queries", nargs="+")
+    rp.add_argument("--out", required=True)
+    rp.add_argument("--max-products", type=int, default=500)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "record":
+        return record(args.queries, args.out, args.max_products)
+    srv = MockWB(
+        size=args.size, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        throttle=args.throttle, unavailable=args.unavailable, dead=args.dead,
+        cassette=args.cassette, seed=args.seed, port=args.port,
+    )
+    print(f"WB_API_BASE={srv.base_url}  WB_HOST_RATES=127.0.0.1=1000")
+    try:
+        while srv.proc.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(srv.counts()))
+    srv.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,179 @@
+"""
+Задержка GET /products/search (crud.search_products) на больших таблицах.
+
+    python -m bench.search                             # SQLite во временном файле, 100k и 1M строк
+    python -m bench.search --size 1000000 --check      # 1 — если p95 хуже TARGETS_MS
+    DATABASE_URL=postgresql://... python -m bench.search
+
+Таблица products заполняется синтетическими названиями (категория, бренд, модель, свойство);
+на Postgres индексы — те же, что в миграции b2e8f4a1c7d3 (создаются, если их нет).
+Для каждого режима (fts, trgm и like — полный просмотр для сравнения) и вида запроса
+меряются p50/p95 по --repeat повторам и сколько строк нашлось. ВНИМАНИЕ: products
+в указанной базе очищается.
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from sqlalchemy import create_engine, delete, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.models import Base, Product
+
+SIZES = (100_000, 1_000_000)
+# p95 на 1M строк, мс: выше — --check возвращает 1
+TARGETS_MS = {"fts": 50.0, "trgm": 150.0}
+MODES = ("fts", "trgm", "like")
+PAGE = 20
+FILL_CHUNK = 50_000
+
+CATEGORIES = (
+    "Термопаста", "Термопрокладка", "Кабель", "Переходник", "Зарядное устройство", "Наушники", "Клавиатура",
+    "Мышь", "Коврик", "Кулер", "Вентилятор", "Блок питания", "Видеокарта", "Процессор", "Материнская плата",
+    "Оперативная память", "Накопитель", "Корпус", "Монитор", "Веб-камера", "Микрофон", "Колонки", "Роутер",
+    "Удлинитель", "Сетевой фильтр", "Батарейки", "Аккумулятор", "Флешка", "Карта памяти", "Чехол",
+    "Защитное стекло", "Держатель", "Подставка", "Лампа", "Смарт-часы", "Фитнес-браслет", "Геймпад",
+    "Паяльник", "Отвёртка", "Изолента",
+)
+BRANDS = (
+    "Arctic", "Noctua", "Thermal Grizzly", "Cooler Master", "Deepcool", "Be Quiet", "Ugreen", "Baseus",
+    "Anker", "Xiaomi", "Samsung", "Logitech", "Razer", "HyperX", "Defender", "Sven", "Gembird", "Kingston",
+    "Crucial", "Transcend", "Asus", "MSI", "Gigabyte", "Palit", "Zalman", "Aerocool", "TP-Link", "Keenetic",
+    "Duracell", "GP", "Philips", "Hoco", "Borofone", "Remax", "Rexant", "Pro'sKit", "Jakemy", "Cablexpert",
+    "Exegate", "Ritmix",
+)
+ATTRS = (
+    "4 г", "8 г", "1 м", "2 м", "черный", "белый", "серый", "USB Type-C", "Lightning", "HDMI", "120 мм",
+    "140 мм", "RGB", "беспроводной", "игровой", "для ноутбука", "для компьютера", "набор", "2 шт", "10 шт",
+)
+# вид запроса -> примеры; {model} подставляется из сгенерированной таблицы
+QUERIES = {
+    "broad": ("термопаста", "кабель", "наушники"),
+    "two words": ("термопаста arctic", "кабель ugreen", "мышь logitech"),
+    "prefix": ("термоп", "переход", "видеок"),
+    "model": ("{model}",),
+    "typo": ("термапаста", "клавиатра"),
+}
+
+
+def _model(rnd: random.Random) -> str:
+    return f"{rnd.choice('ABCDEFGHKMNPRSTX')}{rnd.choice('ABCDEFGHKMNPRSTX')}-{rnd.randint(1, 9999)}"
+
+
+def make_rows(n: int, start: int = 0, seed: int = 0) -> List[dict]:
+    rnd = random.Random(seed * 1_000_003 + start)
+    return [
+        {
+            "id": start + i + 1,
+            "nm_id": 10_000_000 + start + i,
+            "name": f"{rnd.choice(CATEGORIES)} {rnd.choice(BRANDS)} {_model(rnd)} {rnd.choice(ATTRS)}",
+            "price": rnd.randint(100, 5000),
+            "rating": round(rnd.uniform(3, 5), 1),
+            "review_count": rnd.randint(0, 10_000),
+            "stock": rnd.randint(0, 500),
+        }
+        for i in range(n)
+    ]
+
+
+def fill(engine, n: int) -> float:
+    """Чистая products на n строк; индексы поиска строятся после вставки (так быстрее). Секунды."""
+    t = time.perf_counter()
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            for name in ("products_search_ai", "products_search_ad", "products_search_au"):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+            for name in ("products_fts", "products_trgm"):
+                conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            crud._sqlite_search_ready.clear()
+        conn.execute(delete(Product))
+        for start in range(0, n, FILL_CHUNK):
+            conn.execute(insert(Product), make_rows(min(FILL_CHUNK, n - start), start))
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)"
+            ))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_products_name_fts ON products "
+                f"USING gin (to_tsvector('{crud.FTS_CONFIG}', name))"
+            ))
+            conn.execute(text("ANALYZE products"))
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        crud.ensure_search_index(db)
+    return time.perf_counter() - t
+
+
+def _search(db, mode: str, q: str) -> int:
+    if mode == "like":
+        terms = [w.lower() for w in crud._WORD.findall(q)]
+        return len(crud._search_like(db, q, terms, PAGE, 0))
+    return len(crud.search_products(db, q, mode=mode, limit=PAGE)[1])
+
+
+def measure(engine, repeat: int) -> Dict[str, Dict[str, dict]]:
+    model = re.search(r"[A-Z]{2}-\d+", make_rows(1)[0]["name"]).group()
+    Session = sessionmaker(bind=engine)
+    out: Dict[str, Dict[str, dict]] = {}
+    with Session() as db:
+        for mode in MODES:
+            out[mode] = {}
+            for kind, queries in QUERIES.items():
+                times: List[float] = []
+                found = 0
+                for q in queries:
+                    q = q.format(model=model)
+                    found += _search(db, mode, q)  # прогрев кэша страниц
+                    for _ in range(repeat if mode != "like" else max(1, repeat // 10)):
+                        t = time.perf_counter()
+                        _search(db, mode, q)
+                        times.append((time.perf_counter() - t) * 1000)
+                times.sort()
+                out[mode][kind] = {
+                    "p50": statistics.median(times),
+                    "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+                    "rows": found / len(queries),
+                }
+    return out
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", type=int, action="append", help="строк в products (можно несколько)")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--check", action="store_true", help="сравнить p95 с TARGETS_MS на самом большом размере")
+    args = ap.parse_args(argv)
+
+    url = os.getenv("DATABASE_URL") or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    print(f"db: {engine.dialect.name}")
+
+    ok = True
+    sizes = sorted(args.size or SIZES)
+    for n in sizes:
+        print(f"\n{n} строк: заполнение и индексы {fill(engine, n):.1f} s")
+        print(f"{'mode':<6} {'query':<10} {'p50, ms':>9} {'p95, ms':>9} {'rows':>6}")
+        res = measure(engine, args.repeat)
+        for mode, kinds in res.items():
+            for kind, r in kinds.items():
+                print(f"{mode:<6} {kind:<10} {r['p50']:>9.2f} {r['p95']:>9.2f} {r['rows']:>6.0f}")
+        if args.check and n == sizes[-1]:
+            for mode, target in TARGETS_MS.items():
+                worst = max(r["p95"] for r in res[mode].values())
+                passed = worst <= target
+                ok = ok and passed
+                print(f"{mode}: худший p95 {worst:.1f} ms, цель {target:.0f} ms — {'ok' if passed else 'ПРЕВЫШЕНО'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,180 @@
+"""
+Транспорты WBApiParser на локальном сервере: запросов в секунду и задержка p50/p95.
+
+    python -m bench.transport [--threads 32] [--requests 3000] [--latency-ms 5] [--connect-ms 30]
+    python -m bench.transport --url https://... # свой сервер (HTTP/2 — только по TLS)
+
+Сервер поднимается в отдельном процессе (HTTP/1.1 keep-alive, ответ ~20 КБ JSON, как detail
+на 100 товаров, с задержкой latency-ms). Новое соединение он принимает через connect-ms —
+так на localhost видна цена TCP+TLS рукопожатия. Считает, сколько соединений к нему открыли.
+Сравниваются:
+  - session  — голая requests.Session (пул 10 на хост, как было);
+  - requests — RequestsTransport: пул на хост по числу потоков, кэш DNS;
+  - httpx    — HttpxTransport (HTTP/1.1);
+  - http2    — HttpxTransport(http2=True); нужен h2 и сервер с HTTP/2, на локальном не меряется.
+"""
+import argparse
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+from parser.transport import HttpxTransport, RequestsTransport
+
+BODY = json.dumps({
+    "data": {"products": [
+        {"id": 100_000_000 + i, "salePriceU": 150_000, "sizes": [
+            {"name": "", "stocks": [{"wh": 117986 + w, "qty": 5} for w in range(4)], "price": {"product": 149_000}},
+        ]}
+        for i in range(100)
+    ]},
+}).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.connections.get_lock():
+            self.server.connections.value += 1
+        time.sleep(self.server.connect_delay)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(port, connections, latency: float, connect_delay: float) -> None:
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.daemon_threads = True
+    srv.request_queue_size = 128
+    srv.latency = latency
+    srv.connect_delay = connect_delay
+    srv.connections = connections
+    port.value = srv.server_address[1]
+    srv.serve_forever()
+
+
+class MockServer:
+    """Сервер в дочернем процессе: его потоки не делят GIL с клиентом."""
+
+    def __init__(self, latency: float, connect_delay: float):
+        self.port = multiprocessing.Value("i", 0)
+        self.connections = multiprocessing.Value("i", 0)
+        self.proc = multiprocessing.Process(
+            target=_serve, args=(self.port, self.connections, latency, connect_delay), daemon=True,
+        )
+        self.proc.start()
+        while not self.port.value:
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        self.proc.join()
+
+
+def run(transport, url: str, threads: int, total: int):
+    """(запросов в секунду, список задержек в секундах)"""
+    lat = []
+
+    def one(i: int) -> None:
+        t = time.perf_counter()
+        r = transport.get(url, params={"nm": i}, timeout=15)
+        r.raise_for_status()
+        _ = r.content
+        lat.append(time.perf_counter() - t)
+
+    # прогрев: соединения и DNS — как у долгоживущего парсера
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(one, range(threads)))
+    lat.clear()
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(one, range(total)))
+    return total / (time.perf_counter() - t), lat
+
+
+class _SessionTransport:
+    """requests.Session как есть — точка отсчёта."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def make(name: str, host: str, threads: int):
+    session = requests.Session()
+    pools = {host: threads}
+    if name == "session":
+        return _SessionTransport(session)
+    if name == "requests":
+        return RequestsTransport(session, pools)
+    return HttpxTransport(session, pools, http2=name == "http2")
+
+
+def main(argv: list[str]) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=3000)
+    ap.add_argument("--latency-ms", type=float, default=5.0)
+    ap.add_argument("--connect-ms", type=float, default=30.0)
+    ap.add_argument("--url", help="мерить на своём сервере вместо локального")
+    args = ap.parse_args(argv)
+
+    srv = None
+    url = args.url
+    if url is None:
+        srv = MockServer(args.latency_ms / 1000, args.connect_ms / 1000)
+        # localhost, а не 127.0.0.1 — чтобы было что резолвить
+        url = f"http://localhost:{srv.port.value}/cards/v2/detail"
+    # пул монтируется по префиксу URL: хост вместе с портом
+    host = urlsplit(url).netloc
+
+    print(f"{url}  threads={args.threads} requests={args.requests}")
+    print(f"{'transport':<10} {'req/s':>8} {'p50, ms':>8} {'p95, ms':>8} {'conns':>6}")
+    for name in ("session", "requests", "httpx", "http2"):
+        try:
+            transport = make(name, host, args.threads)
+        except ImportError as e:
+            print(f"{name:<10} пропущен: {e}")
+            continue
+        if name == "http2" and srv is not None:
+            print(f"{name:<10} пропущен: локальный сервер без HTTP/2 (нужен --url https://...)")
+            transport.close()
+            continue
+        before = srv.connections.value if srv is not None else 0
+        try:
+            rps, lat = run(transport, url, args.threads, args.requests)
+        finally:
+            transport.close()
+        lat.sort()
+        p50 = statistics.median(lat) * 1000
+        p95 = lat[int(len(lat) * 0.95) - 1] * 1000
+        conns = f"{srv.connections.value - before:>6}" if srv is not None else f"{'-':>6}"
+        print(f"{name:<10} {rps:>8.0f} {p50:>8.1f} {p95:>8.1f} {conns}")
+    if srv is not None:
+        srv.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,87 @@
+"""
+Сравнение crud.upsert_products (пачки ON CONFLICT / COPY) со старым построчным циклом.
+
+    python -m bench.upsert                       # SQLite во временном файле
+    DATABASE_URL=postgresql://... python -m bench.upsert
+
+Для каждого размера (5k, 50k) меряются три прохода: первичная вставка,
+повтор без изменений и повтор, где поменялась каждая десятая цена.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.models import Base, Product
+
+SIZES = (5_000, 50_000)
+
+
+def make_items(n: int, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    return [
+        {
+            "nm_id": 10_000_000 + i,
+            "name": f"Термопаста {i}",
+            "price": rnd.randint(100, 5000),
+            "rating": round(rnd.uniform(3, 5), 1),
+            "review_count": rnd.randint(0, 10_000),
+            "stock": rnd.randint(0, 500),
+        }
+        for i in range(n)
+    ]
+
+
+def legacy_upsert(db, items) -> crud.UpsertResult:
+    res = crud.UpsertResult()
+    rows = crud._prepare_rows(items)
+    now = datetime.now(timezone.utc)
+    for r in rows:
+        r["refreshed_at"] = now
+    crud._upsert_products_orm(db, rows, res)
+    db.commit()
+    return res
+
+
+def run(Session, fn, items) -> float:
+    db = Session()
+    try:
+        t = time.perf_counter()
+        fn(db, items)
+        return time.perf_counter() - t
+    finally:
+        db.close()
+
+
+def main():
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    print(f"db: {engine.dialect.name}")
+    print(f"{'rows':>7} {'pass':<10} {'legacy, s':>10} {'bulk, s':>10} {'speedup':>8}")
+    for n in SIZES:
+        first = make_items(n)
+        changed = [dict(it, price=it["price"] + 1) if i % 10 == 0 else it for i, it in enumerate(first)]
+        timings = {}
+        for name, fn in (("legacy", legacy_upsert), ("bulk", crud.upsert_products)):
+            with engine.begin() as conn:
+                conn.execute(delete(Product))
+            timings[name] = [run(Session, fn, first), run(Session, fn, first), run(Session, fn, changed)]
+        for i, label in enumerate(("insert", "unchanged", "10% diff")):
+            a, b = timings["legacy"][i], timings["bulk"][i]
+            print(f"{n:>7} {label:<10} {a:>10.3f} {b:>10.3f} {a / b if b else 0:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Сверка и время разбора window.__WBSTATE__: JSON-декодер против прежних регэкспов.
+
+    python -m bench.wbstate
+
+Состояния генерируются здесь же, ответ известен заранее:
+  - json      — обычный JSON, 20/200/2000 товаров, цены в sizes[].price и в priceU;
+  - gaps      — у части товаров нет цены (регэксп отдаёт им цену соседа);
+  - js        — JS-литерал: ключи без кавычек, одинарные кавычки, undefined, висячие запятые.
+Код возврата 1, если декодер ошибся хотя бы на одном состоянии.
+"""
+import json
+import random
+import sys
+import timeit
+
+from parser.wb_api import WBApiParser
+
+SIZES = (20, 200, 2000)
+
+
+def make_state(n: int, gaps: bool = False, seed: int = 0):
+    rnd = random.Random(seed)
+    products, expected = [], {}
+    for i in range(n):
+        nm_id = 200_000_000 + i
+        p = {"id": nm_id, "index": i, "name": f"Товар {i} {{}}", "brand": "X", "colors": [{"id": i % 7, "name": "чёрный"}]}
+        if gaps and i % 3 == 1:
+            expected[nm_id] = None
+        else:
+            basic = rnd.randint(500, 9000) * 100
+            total = basic - rnd.randint(0, 400) * 100
+            p["sizes"] = [{"name": "", "price": {"basic": basic, "product": total, "total": total}}]
+            if i % 2:
+                p["priceU"] = basic
+            expected[nm_id] = {"wallet_price": total // 100, "index": i}
+        products.append(p)
+    return {"catalog": {"query": "термопаста", "products": products}, "user": {"dest": -1257786}}, expected
+
+
+def to_js(state) -> str:
+    """Грубый JS-литерал: ключи без кавычек, строки в одинарных кавычках, undefined и висячие запятые."""
+    def enc(v):
+        if isinstance(v, dict):
+            body = "".join(f"{k}:{enc(x)}," for k, x in v.items())
+            return "{" + body + "extra:undefined,}"
+        if isinstance(v, list):
+            return "[" + "".join(enc(x) + "," for x in v) + "]"
+        if isinstance(v, str):
+            return "'" + v.replace("'", "\\'") + "'"
+        return json.dumps(v)
+    return enc(state)
+
+
+def page(state_src: str) -> str:
+    return f"<html><body><script>window.__WBSTATE__ = {state_src};</script><div>ok</div></body></html>"
+
+
+def main():
+    parser = WBApiParser.__new__(WBApiParser)
+    failed = False
+    print(f"{'state':<12} {'items':>5} {'regex, ms':>10} {'json, ms':>9}  {'regex ok':>8}  json ok")
+    for n in SIZES:
+        for kind in ("json", "gaps", "js"):
+            state, expected = make_state(n, gaps=kind == "gaps")
+            html = page(to_js(state) if kind == "js" else json.dumps(state, ensure_ascii=False))
+            want = {k: v for k, v in expected.items() if v is not None}
+
+            new = parser._extract_from_wbstate(html)
+            old = parser._extract_from_wbstate_regex(html)
+            ok_new = new == want
+            ok_old = old == want
+            failed |= not ok_new
+
+            number = max(1, 2000 // n)
+            t_old = timeit.timeit(lambda: parser._extract_from_wbstate_regex(html), number=number) / number * 1000
+            t_new = timeit.timeit(lambda: parser._extract_from_wbstate(html), number=number) / number * 1000
+            print(f"{kind:<12} {n:>5} {t_old:>10.2f} {t_new:>9.2f}  {'ok' if ok_old else 'wrong':>8}  {'ok' if ok_new else 'WRONG'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Маленький потокобезопасный кэш в памяти: значение живёт ttl секунд,
+    при переполнении вытесняется самое давнее по использованию (LRU).
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires, value = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class FileCache:
+    """
+    Разобранное содержимое файлов (cookies.json, ua.txt): loader(path) вызывается заново,
+    только если у файла изменились mtime или размер. Общий на процесс — новые
+    экземпляры парсера не перечитывают и не разбирают неизменившийся файл.
+    """
+
+    def __init__(self, loader: Callable[[str], Any]):
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._data: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+
+    @staticmethod
+    def stamp(path: str) -> Optional[Tuple[int, int]]:
+        """(mtime_ns, размер) файла; None — файла нет."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path: str) -> Tuple[Optional[Tuple[int, int]], Any]:
+        """(stamp, значение); файла нет — (None, None). Ошибки loader пробрасываются."""
+        stamp = self.stamp(path)
+        if stamp is None:
+            return None, None
+        with self._lock:
+            item = self._data.get(path)
+        if item is not None and item[0] == stamp:
+            return item
+        value = self.loader(path)
+        with self._lock:
+            self._data[path] = (stamp, value)
+        return stamp, value
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Чекпоинт старше этого (секунды) не продолжаем: выдача и остатки успели уйти.
+CHECKPOINT_MAX_AGE = 6 * 3600
+
+
+class CrawlCheckpoint:
+    """
+    Состояние обхода в SQLite-файле: скачанные страницы поиска, готовые detail-партии
+    и страницы search.aspx. Пишется по мере обхода (append-only), поэтому упавший
+    или прерванный прогон с теми же параметрами продолжается с места остановки.
+    После успешного прогона его записи удаляются (CrawlRun.finish).
+    """
+
+    def __init__(self, path: str, max_age: float = CHECKPOINT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._local = threading.local()
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS crawl_runs (
+                run_key    TEXT PRIMARY KEY,
+                params     TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS crawl_search (
+                run_key  TEXT NOT NULL,
+                query    TEXT NOT NULL,
+                page     INTEGER NOT NULL,
+                products TEXT NOT NULL,
+                PRIMARY KEY (run_key, query, page)
+            );
+            CREATE TABLE IF NOT EXISTS crawl_detail (
+                run_key TEXT NOT NULL,
+                nm_id   INTEGER NOT NULL,
+                stock   INTEGER,
+                price   INTEGER,
+                stocks  TEXT,
+                regions TEXT,
+                PRIMARY KEY (run_key, nm_id)
+            );
+            CREATE TABLE IF NOT EXISTS crawl_html (
+                run_key TEXT NOT NULL,
+                query   TEXT NOT NULL,
+                page    INTEGER NOT NULL,
+                cards   TEXT NOT NULL,
+                PRIMARY KEY (run_key, query, page)
+            );
+            """
+        )
+        # файл чекпоинта из версии без разбивки по складам / без доп. регионов
+        have = {r[1] for r in self._conn().execute("PRAGMA table_info(crawl_detail)")}
+        for col in ("stocks", "regions"):
+            if col not in have:
+                self._conn().execute(f"ALTER TABLE crawl_detail ADD COLUMN {col} TEXT")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def run_key(params: Dict[str, Any]) -> str:
+        return hashlib.blake2b(json.dumps(params, sort_keys=True, ensure_ascii=False).encode(), digest_size=16).hexdigest()
+
+    def run(self, params: Dict[str, Any]) -> "CrawlRun":
+        """Прогон с такими параметрами: продолжение свежего чекпоинта или новый."""
+        key = self.run_key(params)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for (old,) in conn.execute(
+                "SELECT run_key FROM crawl_runs WHERE updated_at < ?", (now - self.max_age,)
+            ).fetchall():
+                self._drop(conn, old)
+            row = conn.execute("SELECT created_at FROM crawl_runs WHERE run_key = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO crawl_runs (run_key, params, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(params, ensure_ascii=False), now, now),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return CrawlRun(self, key, resumed=row is not None)
+
+    @staticmethod
+    def _drop(conn: sqlite3.Connection, key: str) -> None:
+        for table in ("crawl_search", "crawl_detail", "crawl_html", "crawl_runs"):
+            conn.execute(f"DELETE FROM {table} WHERE run_key = ?", (key,))
+
+
+class CrawlRun:
+    """Один прогон в CrawlCheckpoint. Методы вызываются из потоков и корутин парсера."""
+
+    def __init__(self, store: CrawlCheckpoint, key: str, resumed: bool):
+        self.store = store
+        self.key = key
+        self.resumed = resumed
+        self.replayed: Dict[str, int] = {"search_pages": 0, "detail_ids": 0, "html_pages": 0}
+        self._lock = threading.Lock()
+
+    def _replay(self, stage: str, n: int = 1) -> None:
+        with self._lock:
+            self.replayed[stage] += n
+
+    def _write(self, sql: str, rows: Iterable[tuple]) -> None:
+        conn = self.store._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(sql, rows)
+            conn.execute("UPDATE crawl_runs SET updated_at = ? WHERE run_key = ?", (time.time(), self.key))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def search_page(self, query: str, page: int) -> Optional[List[Dict]]:
+        row = self.store._conn().execute(
+            "SELECT products FROM crawl_search WHERE run_key = ? AND query = ? AND page = ?", (self.key, query, page)
+        ).fetchone()
+        if row is None:
+            return None
+        self._replay("search_pages")
+        return json.loads(row[0])
+
+    def save_search_page(self, query: str, page: int, products: List[Dict]) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO crawl_search (run_key, query, page, products) VALUES (?, ?, ?, ?)",
+            [(self.key, query, page, json.dumps(products, ensure_ascii=False))],
+        )
+
+    def detail(self, ids: List[int]) -> Dict[int, Tuple[Optional[int], Optional[int], Optional[list], Optional[list]]]:
+        """
+        nm_id -> (stock, price, [(wh, size, qty), ...] или None, [(dest, price, stock), ...] или None)
+        для id, чьи detail-партии уже пройдены.
+        """
+        out: Dict[int, Tuple[Optional[int], Optional[int], Optional[list], Optional[list]]] = {}
+        conn = self.store._conn()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for nm_id, stock, price, stocks, regions in conn.execute(
+                f"SELECT nm_id, stock, price, stocks, regions FROM crawl_detail "
+                f"WHERE run_key = ? AND nm_id IN ({marks})",
+                (self.key, *chunk),
+            ):
+                out[nm_id] = (
+                    stock, price,
+                    [tuple(r) for r in json.loads(stocks)] if stocks else None,
+                    [tuple(r) for r in json.loads(regions)] if regions else None,
+                )
+        if out:
+            self._replay("detail_ids", len(out))
+        return out
+
+    def save_detail(self, rows: List[Tuple[int, Optional[int], Optional[int], Optional[list], Optional[list]]]) -> None:
+        """rows: (nm_id, stock, price, разбивка по складам или None, данные доп. регионов или None)."""
+        self._write(
+            "INSERT OR REPLACE INTO crawl_detail (run_key, nm_id, stock, price, stocks, regions) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    self.key, nm_id, stock, price,
+                    json.dumps(stocks, ensure_ascii=False) if stocks is not None else None,
+                    json.dumps(regions) if regions is not None else None,
+                )
+                for nm_id, stock, price, stocks, regions in rows
+            ],
+        )
+
+    def html_page(self, query: str, page: int) -> Optional[Dict[int, Dict[str, Any]]]:
+        row = self.store._conn().execute(
+            "SELECT cards FROM crawl_html WHERE run_key = ? AND query = ? AND page = ?", (self.key, query, page)
+        ).fetchone()
+        if row is None:
+            return None
+        self._replay("html_pages")
+        return {int(k): v for k, v in json.loads(row[0]).items()}
+
+    def save_html_page(self, query: str, page: int, cards: Dict[int, Dict[str, Any]]) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO crawl_html (run_key, query, page, cards) VALUES (?, ?, ?, ?)",
+            [(self.key, query, page, json.dumps(cards))],
+        )
+
+    def finish(self) -> None:
+        """Прогон завершён полностью — чекпоинт больше не нужен."""
+        conn = self.store._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.store._drop(conn, self.key)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_default_checkpoint: Optional[CrawlCheckpoint] = None
+_default_lock = threading.Lock()
+
+
+def get_default_checkpoint() -> Optional[CrawlCheckpoint]:
+    """Общее хранилище чекпоинтов процесса, если задан WB_CHECKPOINT_DB (путь к SQLite-файлу)."""
+    global _default_checkpoint
+    path = os.getenv("WB_CHECKPOINT_DB")
+    if not path:
+        return None
+    with _default_lock:
+        if _default_checkpoint is None:
+            max_age = float(os.getenv("WB_CHECKPOINT_MAX_AGE", str(CHECKPOINT_MAX_AGE)))
+            _default_checkpoint = CrawlCheckpoint(path, max_age=max_age)
+        return _default_checkpoint
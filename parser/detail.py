@@ -0,0 +1,239 @@
+from array import array
+from itertools import repeat
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для WB_DETAIL_NUMPY=1
+    np = None
+
+HAS_NUMPY = np is not None
+
+# Кандидаты в цену (в копейках): на уровне товара и в sizes[].price.
+PRICE_KEYS = ("promoPriceU", "salePriceU", "priceU")
+SIZE_PRICE_KEYS = ("product", "basic", "total")
+# wh у остатка нет или он не число
+NO_WAREHOUSE = -1
+# Остатки товара по складам: [(wh, размер, qty), ...], отсортировано, нулевые отброшены.
+StockRows = List[Tuple[int, str, int]]
+_QTY = repeat("qty")
+_WH = repeat("wh")
+
+
+def detail_products(data: Dict) -> List[Dict]:
+    """Товары из ответа card.wb.ru: data.products (v2) или сразу список в data."""
+    d = (data or {}).get("data")
+    if isinstance(d, dict):
+        return d.get("products") or []
+    if isinstance(d, list):
+        return d
+    return []
+
+
+def size_name(size: Dict) -> str:
+    return str(size.get("name") or size.get("origName") or "")
+
+
+def warehouse_id(wh: Any) -> int:
+    return wh if isinstance(wh, int) else NO_WAREHOUSE
+
+
+def stock_rows(by_wh: Dict[Tuple[int, str], int]) -> StockRows:
+    """{(wh, размер): qty} -> отсортированный список без нулевых остатков."""
+    return [(wh, size, qty) for (wh, size), qty in sorted(by_wh.items()) if qty]
+
+
+def apply_detail_payload(
+    data: Dict,
+    id2stock: Dict[int, int],
+    id2price: Dict[int, int],
+    id2wh: Optional[Dict[int, StockRows]] = None,
+) -> None:
+    """
+    Эталонный путь: остаток — сумма qty по всем размерам и складам, цена — минимум кандидатов // 100.
+    id2wh — ещё и разбивка остатка по (склад, размер); сумма по ней равна id2stock.
+    """
+    for p in detail_products(data):
+        pid = p.get("id")
+        total_stock = 0
+        price_candidates_u: List[int] = []
+        by_wh: Optional[Dict[Tuple[int, str], int]] = {} if id2wh is not None else None
+
+        for key in PRICE_KEYS:
+            v = p.get(key)
+            if isinstance(v, int) and v > 0:
+                price_candidates_u.append(v)
+
+        for size in (p.get("sizes") or []):
+            sname = size_name(size) if by_wh is not None else ""
+            for st in (size.get("stocks") or []):
+                qty = st.get("qty")
+                if isinstance(qty, int):
+                    total_stock += qty
+                    if by_wh is not None:
+                        key = (warehouse_id(st.get("wh")), sname)
+                        by_wh[key] = by_wh.get(key, 0) + qty
+            po = size.get("price") or {}
+            for k in SIZE_PRICE_KEYS:
+                v = po.get(k)
+                if isinstance(v, int) and v > 0:
+                    price_candidates_u.append(v)
+
+        if pid:
+            id2stock[pid] = total_stock
+            if price_candidates_u:
+                id2price[pid] = min(price_candidates_u) // 100
+            if by_wh is not None:
+                id2wh[pid] = stock_rows(by_wh)
+
+
+class DetailArrays:
+    """
+    Ответ detail, развёрнутый в плоские массивы:
+      pids                      — id товаров в порядке ответа (индекс = номер товара);
+      stock_idx / wh / qty      — по строке на остаток склада: номер товара, склад, количество;
+      size                      — имя размера на ту же строку (список строк);
+      price_idx / price_u       — по строке на кандидата в цену: номер товара, цена в копейках.
+    """
+
+    __slots__ = ("pids", "stock_idx", "wh", "size", "qty", "price_idx", "price_u")
+
+    def __init__(self, pids: List[Any], stock_idx, wh, size, qty, price_idx, price_u):
+        self.pids = pids
+        self.stock_idx = stock_idx
+        self.wh = wh
+        self.size = size
+        self.qty = qty
+        self.price_idx = price_idx
+        self.price_u = price_u
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("WB_DETAIL_NUMPY=1 требует numpy: pip install numpy")
+
+
+def _int_array(values: List[Any]):
+    """
+    Значения -> (int64-массив, маска «было int» или None, если int все). Не int (None, строка, float)
+    дают 0 и False в маске — как isinstance(v, int) в эталонном пути (bool тоже int).
+    """
+    try:
+        # array('q') принимает только int (и bool) — заодно и проверка типов
+        return np.frombuffer(array("q", values), dtype=np.int64), None
+    except TypeError:
+        pass
+    mask = [isinstance(v, int) for v in values]
+    clean = array("q", [v if ok else 0 for v, ok in zip(values, mask)])
+    return np.frombuffer(clean, dtype=np.int64), np.array(mask, dtype=bool)
+
+
+def flatten_detail(products: List[Dict], warehouses: bool = False) -> DetailArrays:
+    """
+    Проход по JSON с теми же фильтрами, что в apply_detail_payload (qty — int, цена — int > 0).
+    qty (и wh при warehouses=True) собираются по размеру целиком, проверка типов
+    и номер товара на строку — уже в массивах. Без warehouses wh и size = None.
+    """
+    _require_numpy()
+    pids: List[Any] = []
+    counts: List[int] = []
+    qtys: List[Any] = []
+    whs: List[Any] = []
+    snames: List[str] = []
+    p_idx: List[int] = []
+    p_u: List[int] = []
+    for i, p in enumerate(products):
+        pids.append(p.get("id"))
+        before = len(qtys)
+        for key in PRICE_KEYS:
+            v = p.get(key)
+            if isinstance(v, int) and v > 0:
+                p_idx.append(i)
+                p_u.append(v)
+        for size in (p.get("sizes") or ()):
+            stocks = size.get("stocks")
+            if stocks:
+                # map(dict.get, ...) — без Python-кадра на каждый склад
+                qtys.extend(map(dict.get, stocks, _QTY))
+                if warehouses:
+                    whs.extend(map(dict.get, stocks, _WH))
+                    snames.extend(repeat(size_name(size), len(stocks)))
+            po = size.get("price")
+            if po:
+                for k in SIZE_PRICE_KEYS:
+                    v = po.get(k)
+                    if isinstance(v, int) and v > 0:
+                        p_idx.append(i)
+                        p_u.append(v)
+        counts.append(len(qtys) - before)
+
+    stock_idx = np.repeat(np.arange(len(pids), dtype=np.intp), counts)
+    qty, valid = _int_array(qtys)
+    wh = size = None
+    if warehouses:
+        wh, wh_ok = _int_array(whs)
+        if wh_ok is not None:
+            wh = np.where(wh_ok, wh, NO_WAREHOUSE)
+        size = snames
+    if valid is not None:
+        stock_idx, qty = stock_idx[valid], qty[valid]
+        if wh is not None:
+            wh = wh[valid]
+            size = [s for s, ok in zip(snames, valid.tolist()) if ok]
+    return DetailArrays(
+        pids, stock_idx, wh, size, qty, np.array(p_idx, dtype=np.intp), np.array(p_u, dtype=np.int64),
+    )
+
+
+def _segment_reduce(ufunc, idx, values, n: int, empty: int):
+    """
+    ufunc.reduceat по товарам: idx не убывает (строки идут в порядке товаров),
+    у товаров без строк остаётся empty.
+    """
+    out = np.full(n, empty, dtype=np.int64)
+    if len(idx):
+        starts = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+        out[idx[starts]] = ufunc.reduceat(values, starts)
+    return out
+
+
+def reduce_detail(arrays: DetailArrays):
+    """(остаток, минимальная цена в копейках или 0) на каждый товар — векторными редукциями."""
+    n = len(arrays.pids)
+    stock = _segment_reduce(np.add, arrays.stock_idx, arrays.qty, n, 0)
+    price_u = _segment_reduce(np.minimum, arrays.price_idx, arrays.price_u, n, 0)
+    return stock, price_u
+
+
+def warehouse_breakdown(arrays: DetailArrays) -> List[StockRows]:
+    """Разбивка по (склад, размер) на каждый товар из flatten_detail(..., warehouses=True)."""
+    acc: List[Dict[Tuple[int, str], int]] = [{} for _ in arrays.pids]
+    for i, wh, size, qty in zip(arrays.stock_idx.tolist(), arrays.wh.tolist(), arrays.size, arrays.qty.tolist()):
+        by_wh = acc[i]
+        by_wh[(wh, size)] = by_wh.get((wh, size), 0) + qty
+    return [stock_rows(by_wh) for by_wh in acc]
+
+
+def apply_detail_payload_np(
+    data: Dict,
+    id2stock: Dict[int, int],
+    id2price: Dict[int, int],
+    id2wh: Optional[Dict[int, StockRows]] = None,
+) -> None:
+    """То же, что apply_detail_payload, через NumPy: результат совпадает до единицы."""
+    products = detail_products(data)
+    try:
+        arrays = flatten_detail(products, warehouses=id2wh is not None)
+    except OverflowError:
+        # число больше int64 — такое посчитает только эталонный путь
+        apply_detail_payload(data, id2stock, id2price, id2wh)
+        return
+    stock, price_u = reduce_detail(arrays)
+    breakdown = warehouse_breakdown(arrays) if id2wh is not None else None
+    for i, (pid, s, pu) in enumerate(zip(arrays.pids, stock.tolist(), price_u.tolist())):
+        if pid:
+            id2stock[pid] = s
+            if pu:
+                id2price[pid] = pu // 100
+            if breakdown is not None:
+                id2wh[pid] = breakdown[i]
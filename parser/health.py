@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Столько неудач подряд — и эндпоинт выключается на cooldown секунд.
+FAILURE_THRESHOLD = 3
+COOLDOWN = 30.0
+# Проба после cooldown не удалась — следующий cooldown вдвое длиннее, но не больше этого.
+MAX_COOLDOWN = 600.0
+# Вес нового замера в скользящей средней задержки.
+LATENCY_ALPHA = 0.2
+
+
+class EndpointHealth:
+    """
+    Circuit breaker на эндпоинт (URL без параметров: search v5/v4, detail v2/v1/legacy).
+
+    order(urls) отдаёт запасные URL так, чтобы рабочие шли первыми (в исходном порядке),
+    а выключенные не пробовались вовсе. После FAILURE_THRESHOLD неудач подряд эндпоинт
+    выключается на cooldown; когда тот истёк, ровно один запрос идёт на него пробой:
+    удалась — эндпоинт снова рабочий, нет — cooldown удваивается (до MAX_COOLDOWN).
+    Если выключены все, order() отдаёт их, начиная с того, что раньше включится.
+
+    Неудача — сетевая ошибка, 4xx/5xx (в том числе 503) или пустой ответ там, где другой
+    URL дал данные. Троттлинг (429/498) — забота лимитера, здесь он не считается.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        cooldown: float = COOLDOWN,
+        max_cooldown: float = MAX_COOLDOWN,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+
+    def _state(self, url: str) -> Dict[str, Any]:
+        st = self._states.get(url)
+        if st is None:
+            st = self._states[url] = {
+                "ok": 0,
+                "failed": 0,
+                "skipped": 0,
+                "streak": 0,
+                "open_until": 0.0,
+                "cooldown": self.cooldown,
+                "latency": None,
+                "latency_sum": 0.0,
+                "latency_n": 0,
+                "last_error": None,
+            }
+        return st
+
+    def order(self, urls: List[str]) -> List[str]:
+        """URL в порядке попыток: рабочие, затем (если рабочих нет) выключенные — для пробы."""
+        now = time.monotonic()
+        ready: List[str] = []
+        closed: List[tuple] = []
+        with self._lock:
+            for url in urls:
+                st = self._state(url)
+                if st["open_until"] <= now:
+                    if st["streak"] >= self.failure_threshold:
+                        # cooldown истёк: пробуем один раз, остальные пока обходят его стороной
+                        st["open_until"] = now + st["cooldown"]
+                    ready.append(url)
+                else:
+                    st["skipped"] += 1
+                    closed.append((st["open_until"], url))
+        if ready:
+            return ready
+        return [url for _, url in sorted(closed)]
+
+    def available(self, url: str) -> bool:
+        """Эндпоинт не выключен (или это его проба) — можно повторять попытку."""
+        with self._lock:
+            st = self._state(url)
+            return st["streak"] < self.failure_threshold
+
+    def success(self, url: str) -> None:
+        with self._lock:
+            st = self._state(url)
+            st["ok"] += 1
+            st["streak"] = 0
+            st["open_until"] = 0.0
+            st["cooldown"] = self.cooldown
+
+    def failure(self, url: str, error: Any = None) -> None:
+        with self._lock:
+            st = self._state(url)
+            st["failed"] += 1
+            st["streak"] += 1
+            st["last_error"] = str(error)[:200] if error is not None else None
+            if st["streak"] == self.failure_threshold:
+                st["open_until"] = time.monotonic() + st["cooldown"]
+            elif st["streak"] > self.failure_threshold:
+                # неудачная проба
+                st["cooldown"] = min(self.max_cooldown, st["cooldown"] * 2)
+                st["open_until"] = time.monotonic() + st["cooldown"]
+
+    def latency(self, url: str, seconds: float) -> None:
+        """Время ответа (без ожидания лимитера) — из WBApiParser._get."""
+        with self._lock:
+            st = self._state(url)
+            prev = st["latency"]
+            st["latency"] = seconds if prev is None else prev + LATENCY_ALPHA * (seconds - prev)
+            st["latency_sum"] += seconds
+            st["latency_n"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние по эндпоинтам: up/open/probe, доля успехов, задержка, последняя ошибка."""
+        now = time.monotonic()
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for url, st in self._states.items():
+                total = st["ok"] + st["failed"]
+                if st["streak"] < self.failure_threshold:
+                    state = "up"
+                elif st["open_until"] > now:
+                    state = "open"
+                else:
+                    state = "probe"
+                out[url] = {
+                    "state": state,
+                    "ok": st["ok"],
+                    "failed": st["failed"],
+                    "skipped": st["skipped"],
+                    "success_rate": round(st["ok"] / total, 3) if total else None,
+                    "latency_ms": round(st["latency"] * 1000, 1) if st["latency"] is not None else None,
+                    "latency_avg_ms": round(st["latency_sum"] / st["latency_n"] * 1000, 1) if st["latency_n"] else None,
+                    "open_for": round(max(0.0, st["open_until"] - now), 3) if state != "up" else 0.0,
+                    "last_error": st["last_error"],
+                }
+        return out
+
+
+_default_health: Optional[EndpointHealth] = None
+_default_lock = threading.Lock()
+
+
+def get_default_health() -> EndpointHealth:
+    """
+    Общий реестр процесса: все парсеры узнают о мёртвом эндпоинте сразу.
+    Порог и cooldown — WB_HEALTH_THRESHOLD и WB_HEALTH_COOLDOWN (секунд).
+    """
+    global _default_health
+    with _default_lock:
+        if _default_health is None:
+            _default_health = EndpointHealth(
+                failure_threshold=int(os.getenv("WB_HEALTH_THRESHOLD", str(FAILURE_THRESHOLD))),
+                cooldown=float(os.getenv("WB_HEALTH_COOLDOWN", str(COOLDOWN))),
+            )
+        return _default_health
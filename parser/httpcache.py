@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+# TTL ответов (секунды) по хосту и началу пути; что не подошло — не кэшируется
+# (в т.ч. user-geo-data: от него зависит dest, он и так запрашивается раз на парсер).
+# Парсер с WB_API_BASE спрашивает TTL по исходному URL WB (WBApiParser._rebase).
+DEFAULT_TTLS: Dict[str, float] = {
+    "search.wb.ru": 300,
+    "card.wb.ru": 120,
+    "www.wildberries.ru/catalog/": 300,
+}
+
+# Заголовки ответа, которые имеет смысл хранить вместе с телом.
+_KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control")
+
+
+@dataclass
+class CachedResponse:
+    key: str
+    url: str
+    body: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+    expires_at: float = 0.0
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+    def validators(self) -> Dict[str, str]:
+        """Заголовки условного запроса: If-None-Match / If-Modified-Since."""
+        out: Dict[str, str] = {}
+        if self.headers.get("ETag"):
+            out["If-None-Match"] = self.headers["ETag"]
+        if self.headers.get("Last-Modified"):
+            out["If-Modified-Since"] = self.headers["Last-Modified"]
+        return out
+
+
+class ResponseCache:
+    """
+    Кэш ответов WB в SQLite-файле. Ключ — URL + отсортированные параметры + гео (dest и пр.).
+    Свежий ответ (моложе TTL эндпоинта) отдаётся без запроса; устаревший с ETag/Last-Modified
+    перепроверяется условным запросом, и на 304 продлевается. Когда тела занимают больше
+    max_bytes, вытесняются давно не читанные (LRU).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttls: Optional[Dict[str, float]] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "hits": 0, "misses": 0, "revalidated": 0, "stored": 0, "evicted": 0,
+            "bytes_served": 0, "bytes_stored": 0,
+        }
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS http_cache (
+                key        TEXT PRIMARY KEY,
+                url        TEXT NOT NULL,
+                body       BLOB NOT NULL,
+                headers    TEXT NOT NULL,
+                size       INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                used_at    REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_http_cache_used ON http_cache (used_at);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def ttl_for(self, url: str) -> Optional[float]:
+        """TTL эндпоинта: самый длинный подходящий префикс host/path; None — не кэшируем."""
+        parts = urlsplit(url)
+        target = (parts.hostname or "") + parts.path
+        best: Optional[Tuple[int, float]] = None
+        for prefix, ttl in self.ttls.items():
+            if target.startswith(prefix) and (best is None or len(prefix) > best[0]):
+                best = (len(prefix), ttl)
+        return best[1] if best and best[1] > 0 else None
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]], geo: Optional[Dict[str, Any]] = None) -> str:
+        norm = sorted((str(k), str(v)) for k, v in {**(geo or {}), **(params or {})}.items())
+        return hashlib.blake2b(json.dumps([url, norm]).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Свежий ответ (считается попаданием) или устаревший, но с валидаторами; иначе None."""
+        row = self._conn().execute(
+            "SELECT url, body, headers, expires_at FROM http_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = CachedResponse(key=key, url=row[0], body=row[1], headers=json.loads(row[2]), expires_at=row[3])
+        if entry.fresh:
+            self._count("hits")
+            self._count("bytes_served", len(entry.body))
+            self._conn().execute("UPDATE http_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+        elif not entry.validators():
+            return None
+        return entry
+
+    def miss(self) -> None:
+        """Ответа в кэше не было (или он устарел и сервер прислал новый)."""
+        self._count("misses")
+
+    def revalidated(self, entry: CachedResponse, ttl: float) -> None:
+        """Сервер ответил 304: тело прежнее, продлеваем срок."""
+        now = time.time()
+        entry.expires_at = now + ttl
+        self._count("revalidated")
+        self._count("bytes_served", len(entry.body))
+        self._conn().execute(
+            "UPDATE http_cache SET expires_at = ?, used_at = ? WHERE key = ?", (entry.expires_at, now, entry.key)
+        )
+
+    def put(self, key: str, url: str, body: bytes, headers, ttl: float) -> None:
+        kept = {h: headers[h] for h in _KEPT_HEADERS if headers.get(h)}
+        if "no-store" in kept.get("Cache-Control", ""):
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO http_cache (key, url, body, headers, size, expires_at, used_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET url = excluded.url, body = excluded.body, headers = excluded.headers, "
+                "size = excluded.size, expires_at = excluded.expires_at, used_at = excluded.used_at",
+                (key, url, body, json.dumps(kept), len(body), now + ttl, now),
+            )
+            evicted = self._evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("stored")
+        self._count("bytes_stored", len(body))
+        if evicted:
+            self._count("evicted", evicted)
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM http_cache ORDER BY used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM http_cache WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        return evicted
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM http_cache")
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики с момента создания + текущий размер кэша."""
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM http_cache").fetchone()
+        with self._lock:
+            return {**self.counters, "entries": entries, "bytes": size}
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[ResponseCache]:
+    """
+    Общий кэш процесса, если задан WB_HTTP_CACHE (путь к SQLite-файлу).
+    Размер — WB_HTTP_CACHE_MAX_MB (по умолчанию 256).
+    """
+    global _default_cache
+    path = os.getenv("WB_HTTP_CACHE")
+    if not path:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            max_mb = float(os.getenv("WB_HTTP_CACHE_MAX_MB", "256"))
+            _default_cache = ResponseCache(path, max_bytes=int(max_mb * 1024 * 1024))
+        return _default_cache
@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+# Метрики (WB_METRICS=1) и спаны OpenTelemetry (WB_TRACING=1). Выключено — каждая точка
+# замера стоит одну проверку флага: вызывающий код пишет `if metrics.ENABLED:`, а stage()
+# отдаёт общий nullcontext.
+ENABLED = bool(int(os.getenv("WB_METRICS", "0")))
+TRACING = bool(int(os.getenv("WB_TRACING", "0")))
+
+# Границы корзин гистограмм, секунды: от ответа из кэша до медленного detail и upsert.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, n: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + n
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            st = self._values.get(labels)
+            if st is None:
+                st = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            st[0][i] += 1
+            st[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        out = []
+        for k, (counts, total) in values:
+            acc = 0
+            for le, n in zip((*(f"{b:g}" for b in self.buckets), "+Inf"), counts):
+                acc += n
+                bucket = 'le="' + le + '"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, bucket)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {total:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {acc}")
+        return out
+
+
+class Registry:
+    """Метрики процесса; render() — текстовый формат Prometheus для GET /metrics."""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Counter:
+        m = Counter(name, doc, labelnames)
+        self._metrics.append(m)
+        return m
+
+    def histogram(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Histogram:
+        m = Histogram(name, doc, labelnames)
+        self._metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "wb_http_requests_total", "Запросы к WB по эндпоинтам; status — код, error или cache", ("endpoint", "status"),
+)
+HTTP_SECONDS = registry.histogram("wb_http_request_seconds", "Время ответа WB без ожидания лимитера", ("endpoint",))
+STAGE_SECONDS = registry.histogram(
+    "wb_stage_seconds",
+    "Этапы обхода и записи: run, search_page, detail_batch, html_page, html_extract, build_rows, upsert",
+    ("stage",),
+)
+UPSERT_ROWS = registry.counter(
+    "wb_upsert_rows_total", "Строки upsert_products: inserted/updated/unchanged/history/stocks/regions", ("result",),
+)
+API_REQUESTS = registry.counter("wb_api_requests_total", "Запросы к API сервиса", ("method", "route", "status"))
+API_SECONDS = registry.histogram("wb_api_request_seconds", "Время ответа API сервиса", ("method", "route"))
+
+_NULL = nullcontext()
+_tracer = None
+if TRACING:
+    try:
+        from opentelemetry import trace
+    except ImportError as e:
+        raise ImportError("WB_TRACING=1 требует opentelemetry: pip install opentelemetry-api opentelemetry-sdk") from e
+    _tracer = trace.get_tracer("wb-parser")
+
+
+@lru_cache(maxsize=256)
+def endpoint(url: str) -> str:
+    """Метка эндпоинта: хост и путь без параметров (card.wb.ru/cards/v2/detail)."""
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+def request(url: str, status: Any, seconds: Optional[float] = None) -> None:
+    """Ответ WB: status — HTTP-код, "error" (исключение) или "cache" (свежий ответ из кэша, без сети)."""
+    name = endpoint(url)
+    HTTP_REQUESTS.inc(name, str(status))
+    if seconds is not None:
+        HTTP_SECONDS.observe(name, value=seconds)
+
+
+def stage(name: str, **attrs: Any):
+    """Замер этапа: `with metrics.stage("detail_batch", ids=100): ...` — гистограмма и спан."""
+    if not (ENABLED or TRACING):
+        return _NULL
+    return _stage(name, attrs)
+
+
+@contextmanager
+def _stage(name: str, attrs: Dict[str, Any]) -> Iterator[None]:
+    span = _tracer.start_as_current_span(f"wb.{name}", attributes=attrs) if _tracer is not None else _NULL
+    t = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            if ENABLED:
+                STAGE_SECONDS.observe(name, value=time.perf_counter() - t)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """Этап, который не оборачивается в with (run — от _begin_run до _finish_run)."""
+    STAGE_SECONDS.observe(name, value=seconds)
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from parser.wb_api import WBApiParser
+
+logger = logging.getLogger("parser.wb_api")
+
+RegionsKey = Optional[Tuple[str, ...]]
+
+
+class ParserPool:
+    """
+    Долгоживущие WBApiParser для задач /parse: сессия с cookies, keep-alive соединения,
+    geo и доп. регионы создаются один раз, а не на каждую задачу.
+
+    acquire(regions) выдаёт свободный экземпляр с тем же набором доп. регионов
+    (None — из WB_REGIONS) или создаёт новый; перед выдачей refresh() подхватывает
+    изменившийся cookies.json и истёкший geo/X-Info. После задачи экземпляр
+    возвращается в пул — не больше size свободных на набор регионов, лишние закрываются.
+    Один экземпляр в каждый момент занят одной задачей.
+    """
+
+    def __init__(self, size: int = 2, factory: Callable[..., WBApiParser] = WBApiParser):
+        self.size = size
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._idle: Dict[RegionsKey, List[WBApiParser]] = {}
+        self._closed = False
+        self.created = 0
+        self.reused = 0
+        # секунд на создание экземпляра и на refresh() при выдаче из пула — последние значения
+        self.last_create_s: Optional[float] = None
+        self.last_refresh_s: Optional[float] = None
+
+    @staticmethod
+    def _key(regions: Optional[List[Union[str, int]]]) -> RegionsKey:
+        return tuple(str(r).strip() for r in regions) if regions is not None else None
+
+    def _create(self, regions: Optional[List[Union[str, int]]]) -> WBApiParser:
+        t = time.perf_counter()
+        parser = self.factory(regions=regions)
+        with self._lock:
+            self.created += 1
+            self.last_create_s = time.perf_counter() - t
+        return parser
+
+    def _put(self, key: RegionsKey, parser: WBApiParser) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if not self._closed and len(idle) < self.size:
+                idle.append(parser)
+                return
+        parser.close()
+
+    @contextmanager
+    def acquire(self, regions: Optional[List[Union[str, int]]] = None) -> Iterator[WBApiParser]:
+        key = self._key(regions)
+        with self._lock:
+            idle = self._idle.get(key)
+            parser = idle.pop() if idle else None
+        if parser is None:
+            parser = self._create(regions)
+        else:
+            t = time.perf_counter()
+            parser.refresh()
+            with self._lock:
+                self.reused += 1
+                self.last_refresh_s = time.perf_counter() - t
+        try:
+            yield parser
+        finally:
+            # колбэк прогресса и run_id чекпоинта принадлежат задаче, а не экземпляру
+            parser.on_progress = None
+            parser.run_id = None
+            self._put(key, parser)
+
+    def warm(self, n: int = 1, regions: Optional[List[Union[str, int]]] = None) -> int:
+        """Заранее создать n экземпляров (geo, cookies) и открыть их соединения; сколько соединений открылось."""
+        opened = 0
+        for _ in range(n):
+            parser = self._create(regions)
+            try:
+                opened += parser.warm()
+            finally:
+                self._put(self._key(regions), parser)
+        logger.info("Пул парсеров прогрет: %d экз., соединений %d", n, opened)
+        return opened
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "idle": sum(len(v) for v in self._idle.values()),
+                "created": self.created,
+                "reused": self.reused,
+                "last_create_ms": round(self.last_create_s * 1000, 1) if self.last_create_s is not None else None,
+                "last_refresh_ms": round(self.last_refresh_s * 1000, 1) if self.last_refresh_s is not None else None,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            parsers = [p for idle in self._idle.values() for p in idle]
+            self._idle.clear()
+        for p in parsers:
+            p.close()
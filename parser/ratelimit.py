@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+# Ответы, которыми WB говорит «слишком часто»: на них лимитер сбавляет скорость.
+THROTTLE_STATUSES = (429, 498, 503)
+# Из них чистый троттлинг — эндпоинт жив, просто просит реже. 503 бывает и у лежащего
+# эндпоинта, поэтому реестр живости (parser.health) считает его неудачей.
+RATE_LIMIT_STATUSES = (429, 498)
+
+# Стартовые скорости (запросов/сек) — соответствуют прежним паузам
+# 0.25 / 0.2 / 0.15 сек между запросами.
+DEFAULT_HOST_RATES: Dict[str, float] = {
+    "search.wb.ru": 4.0,
+    "card.wb.ru": 5.0,
+    "www.wildberries.ru": 6.5,
+    "user-geo-data.wildberries.ru": 2.0,
+}
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Retry-After бывает числом секунд или HTTP-датой. Возвращаем секунды или None."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt is None:
+        return None
+    return max(0.0, dt.timestamp() - (now if now is not None else time.time()))
+
+
+class MemoryBackend:
+    """Состояние в памяти процесса: общее для всех парсеров, которым передан один лимитер."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+
+    def transact(self, host: str, init: Callable[[], Dict[str, Any]], fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        with self._lock:
+            st = self._states.get(host)
+            if st is None:
+                st = self._states[host] = init()
+            return fn(st)
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {h: dict(st) for h, st in self._states.items()}
+
+
+class SQLiteBackend:
+    """
+    Состояние в SQLite-файле: несколько процессов с одним path делят бюджет хоста.
+    Каждое изменение — короткая транзакция BEGIN IMMEDIATE (read-modify-write).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limit_state (host TEXT PRIMARY KEY, state TEXT NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def transact(self, host: str, init: Callable[[], Dict[str, Any]], fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state FROM rate_limit_state WHERE host = ?", (host,)).fetchone()
+            st = json.loads(row[0]) if row else init()
+            res = fn(st)
+            conn.execute(
+                "INSERT INTO rate_limit_state (host, state) VALUES (?, ?) "
+                "ON CONFLICT(host) DO UPDATE SET state = excluded.state",
+                (host, json.dumps(st)),
+            )
+            conn.execute("COMMIT")
+            return res
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        rows = self._conn().execute("SELECT host, state FROM rate_limit_state").fetchall()
+        return {h: json.loads(s) for h, s in rows}
+
+
+class RateLimiter:
+    """
+    Token bucket на хост + AIMD:
+      - каждый успешный ответ поднимает скорость на increase (до max_rate);
+      - 429/498/503 умножают скорость на decrease (не ниже min_rate)
+        и блокируют хост на Retry-After (или на один интервал, если заголовка нет).
+
+    Токен резервируется сразу (баланс может уйти в минус), поэтому лимитер
+    корректно работает и из потоков, и из корутин, и из разных процессов (SQLiteBackend).
+    """
+
+    def __init__(
+        self,
+        host_rates: Optional[Dict[str, float]] = None,
+        default_rate: float = 4.0,
+        burst: float = 2.0,
+        min_rate: float = 0.25,
+        max_rate_factor: float = 4.0,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+        backend=None,
+    ):
+        self.host_rates = {**DEFAULT_HOST_RATES, **(host_rates or {})}
+        self.default_rate = default_rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate_factor = max_rate_factor
+        self.increase = increase
+        self.decrease = decrease
+        self.backend = backend or MemoryBackend()
+
+    def _base_rate(self, host: str) -> float:
+        return float(self.host_rates.get(host, self.default_rate))
+
+    def _init_state(self, host: str) -> Callable[[], Dict[str, Any]]:
+        def init() -> Dict[str, Any]:
+            return {
+                "rate": self._base_rate(host),
+                "tokens": self.burst,
+                "updated": time.time(),
+                "blocked_until": 0.0,
+                "ok": 0,
+                "throttled": 0,
+                "waited": 0.0,
+            }
+        return init
+
+    def reserve(self, host: str) -> float:
+        """Забираем токен и возвращаем, сколько секунд надо подождать перед запросом."""
+        def fn(st: Dict[str, Any]) -> float:
+            now = time.time()
+            rate = st["rate"]
+            st["tokens"] = min(self.burst, st["tokens"] + (now - st["updated"]) * rate)
+            st["updated"] = now
+            st["tokens"] -= 1.0
+            wait = -st["tokens"] / rate if st["tokens"] < 0 else 0.0
+            wait = max(wait, st["blocked_until"] - now)
+            st["waited"] += wait
+            return wait
+
+        return self.backend.transact(host, self._init_state(host), fn)
+
+    def acquire(self, host: str) -> None:
+        wait = self.reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, host: str) -> None:
+        wait = self.reserve(host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def feedback(self, host: str, status: Optional[int], retry_after: Optional[str] = None) -> None:
+        """Сообщаем лимитеру результат запроса (status=None — сетевая ошибка, не учитывается)."""
+        if status is None:
+            return
+        throttled = status in THROTTLE_STATUSES
+        delay = parse_retry_after(retry_after) if throttled else None
+        max_rate = self._base_rate(host) * self.max_rate_factor
+
+        def fn(st: Dict[str, Any]) -> None:
+            now = time.time()
+            if throttled:
+                st["throttled"] += 1
+                st["rate"] = max(self.min_rate, st["rate"] * self.decrease)
+                st["tokens"] = min(st["tokens"], 0.0)
+                pause = delay if delay is not None else 1.0 / st["rate"]
+                st["blocked_until"] = max(st["blocked_until"], now + pause)
+            elif status < 400:
+                st["ok"] += 1
+                st["rate"] = min(max_rate, st["rate"] + self.increase)
+
+        self.backend.transact(host, self._init_state(host), fn)
+
+    def penalty(self, host: str, seconds: float) -> None:
+        """
+        Пауза на хост после ошибки перед повтором: следующий reserve по хосту подождёт её
+        (во всех потоках и, с SQLiteBackend, процессах). Скорость не меняется — это не троттлинг.
+        """
+        if seconds <= 0:
+            return
+
+        def fn(st: Dict[str, Any]) -> None:
+            st["blocked_until"] = max(st["blocked_until"], time.time() + seconds)
+
+        self.backend.transact(host, self._init_state(host), fn)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Текущее состояние по хостам: скорость, токены, блокировка, счётчики."""
+        now = time.time()
+        out: Dict[str, Dict[str, Any]] = {}
+        for host, st in self.backend.states().items():
+            out[host] = {
+                "rate": round(st["rate"], 3),
+                "base_rate": self._base_rate(host),
+                "tokens": round(min(self.burst, st["tokens"] + (now - st["updated"]) * st["rate"]), 3),
+                "blocked_for": round(max(0.0, st["blocked_until"] - now), 3),
+                "ok": st["ok"],
+                "throttled": st["throttled"],
+                "waited": round(st["waited"], 3),
+            }
+        return out
+
+
+def parse_host_rates(value: Optional[str]) -> Dict[str, float]:
+    """"card.wb.ru=8,search.wb.ru=4" -> {"card.wb.ru": 8.0, "search.wb.ru": 4.0}."""
+    out: Dict[str, float] = {}
+    for part in (value or "").split(","):
+        host, sep, rate = part.partition("=")
+        if sep and host.strip() and rate.strip():
+            out[host.strip()] = float(rate)
+    return out
+
+
+_default_limiter: Optional[RateLimiter] = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter() -> RateLimiter:
+    """
+    Общий лимитер процесса. Если задан WB_RATE_LIMIT_DB — состояние хранится
+    в этом SQLite-файле и делится между процессами-воркерами.
+    WB_HOST_RATES=card.wb.ru=8,127.0.0.1=1000 — стартовые скорости поверх DEFAULT_HOST_RATES.
+    """
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            path = os.getenv("WB_RATE_LIMIT_DB")
+            _default_limiter = RateLimiter(
+                host_rates=parse_host_rates(os.getenv("WB_HOST_RATES")),
+                backend=SQLiteBackend(path) if path else None,
+            )
+        return _default_limiter
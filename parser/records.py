@@ -0,0 +1,247 @@
+import csv
+import math
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Целые колонки результата. None хранится как NULL (все эти значения неотрицательны).
+INT_FIELDS = ("nm_id", "price_api", "price_wallet", "price_final", "review_count", "stock", "data_card_index", "page")
+NULL = -1
+
+# Колонки products_stage в crud._upsert_via_copy — в том же порядке.
+UPSERT_CSV_FIELDS = ("nm_id", "name", "price", "rating", "review_count", "stock", "fingerprint", "refreshed_at")
+
+
+def _intern(s: Optional[str]) -> Optional[str]:
+    return sys.intern(s) if isinstance(s, str) else s
+
+
+def _fp_to_int(fp: Optional[str]) -> int:
+    # отпечаток — 8 байт blake2b в hex (WBApiParser.fingerprint); 0 — «нет отпечатка»
+    return int(fp, 16) if fp else 0
+
+
+def _fp_from_int(v: int) -> Optional[str]:
+    return format(v, "016x") if v else None
+
+
+class ProductColumns:
+    """
+    Результат парсинга по колонкам вместо списка словарей.
+
+    Числа лежат в array (8 байт на значение, без объектов int/float), отпечаток — в array('Q'),
+    name/brand интернированы: одинаковые строки из разных партий и запросов хранятся один раз.
+    Итерация отдаёт те же словари, что parse()/parse_many(), так что контейнер можно
+    передавать туда, где ждут список строк; crud.upsert_products берёт его напрямую.
+    """
+
+    __slots__ = INT_FIELDS + ("rating", "name", "brand", "fingerprint", "unchanged", "stocks", "regions", "queries")
+
+    def __init__(self):
+        for f in INT_FIELDS:
+            setattr(self, f, array("q"))
+        self.rating = array("d")
+        self.fingerprint = array("Q")
+        self.unchanged = array("b")
+        self.name: List[str] = []
+        self.brand: List[Optional[str]] = []
+        # [(wh, размер, qty), ...] или None — разбивка остатка по складам
+        self.stocks: List[Optional[list]] = []
+        # [(dest, цена, остаток), ...] на товар — только при доп. регионах (WBApiParser.regions)
+        self.regions: Optional[List[Optional[list]]] = None
+        # [{"query", "position"}, ...] на товар — только у parse_many
+        self.queries: Optional[List[List[Dict[str, Any]]]] = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict]) -> "ProductColumns":
+        cols = cls()
+        cols.extend(rows)
+        return cols
+
+    def append(self, row: Dict) -> None:
+        """Строка в формате parse(); в том числе {"nm_id", "fingerprint", "unchanged": True}."""
+        unchanged = bool(row.get("unchanged"))
+        for f in INT_FIELDS:
+            v = row.get(f)
+            getattr(self, f).append(NULL if v is None else int(v))
+        self.rating.append(math.nan if unchanged else float(row.get("rating") or 0.0))
+        self.fingerprint.append(_fp_to_int(row.get("fingerprint")))
+        self.unchanged.append(unchanged)
+        self.name.append(_intern(row.get("name") or ""))
+        self.brand.append(_intern(row.get("brand")))
+        self.stocks.append(row.get("stocks"))
+        if "regions" in row:
+            if self.regions is None:
+                self.regions = [None] * (len(self.nm_id) - 1)
+            self.regions.append(row["regions"])
+        elif self.regions is not None:
+            self.regions.append(None)
+        if "queries" in row:
+            if self.queries is None:
+                self.queries = [[] for _ in range(len(self.nm_id) - 1)]
+            self.queries.append(row["queries"])
+        elif self.queries is not None:
+            self.queries.append([])
+
+    def extend(self, rows: Iterable[Dict]) -> None:
+        for row in rows:
+            self.append(row)
+
+    def attach_positions(self, positions: Dict[int, List[Dict[str, Any]]]) -> "ProductColumns":
+        """Аналог WBApiParser._attach_positions: списки позиций берутся как есть, без копий."""
+        self.queries = [positions.get(pid, []) for pid in self.nm_id]
+        return self
+
+    def __len__(self) -> int:
+        return len(self.nm_id)
+
+    def _int(self, f: str, i: int) -> Optional[int]:
+        v = getattr(self, f)[i]
+        return None if v == NULL else v
+
+    def row(self, i: int) -> Dict[str, Any]:
+        if self.unchanged[i]:
+            out: Dict[str, Any] = {
+                "nm_id": self.nm_id[i],
+                "fingerprint": _fp_from_int(self.fingerprint[i]),
+                "unchanged": True,
+            }
+        else:
+            out = {
+                "nm_id": self.nm_id[i],
+                "name": self.name[i],
+                "brand": self.brand[i],
+                "price_api": self.price_api[i],
+                "price_wallet": self._int("price_wallet", i),
+                "price_final": self.price_final[i],
+                "rating": self.rating[i],
+                "review_count": self.review_count[i],
+                "stock": self._int("stock", i),
+                "stocks": self.stocks[i],
+                "fingerprint": _fp_from_int(self.fingerprint[i]),
+                "data_card_index": self._int("data_card_index", i),
+                "page": self._int("page", i),
+            }
+            if self.regions is not None:
+                out["regions"] = self.regions[i]
+        if self.queries is not None:
+            out["queries"] = self.queries[i]
+        return out
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.row(i)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    # --- запись в БД ---
+
+    def _written(self) -> Iterator[int]:
+        return (i for i, u in enumerate(self.unchanged) if not u)
+
+    def upsert_ids(self) -> List[int]:
+        """nm_id строк, которые пишутся в products (неизменённые пропускаются)."""
+        ids = self.nm_id
+        return [ids[i] for i in self._written()]
+
+    def upsert_rows(self) -> Iterator[Dict[str, Any]]:
+        """Строки для crud.upsert_products — как app.main._prepare_rows, но прямо из колонок."""
+        for i in self._written():
+            yield {
+                "nm_id": self.nm_id[i],
+                "name": self.name[i].strip(),
+                "price": self.price_final[i] or self.price_api[i],
+                "rating": self.rating[i],
+                "review_count": self.review_count[i],
+                "stock": self._int("stock", i),
+                "stocks": self.stocks[i],
+                "regions": self.regions[i] if self.regions is not None else None,
+                "fingerprint": _fp_from_int(self.fingerprint[i]),
+            }
+
+    def upsert_stocks(self) -> Dict[int, list]:
+        """nm_id -> разбивка по складам для записываемых строк, где она известна (crud.replace_stocks)."""
+        return {self.nm_id[i]: self.stocks[i] for i in self._written() if self.stocks[i] is not None}
+
+    def upsert_regions(self) -> Dict[int, list]:
+        """nm_id -> [(dest, цена, остаток), ...] для записываемых строк (crud.upsert_region_prices)."""
+        if self.regions is None:
+            return {}
+        return {self.nm_id[i]: self.regions[i] for i in self._written() if self.regions[i] is not None}
+
+    def write_upsert_csv(self, buf, refreshed_at: str) -> int:
+        """
+        CSV для COPY в products_stage (колонки UPSERT_CSV_FIELDS) прямо из колонок,
+        без промежуточных словарей. Пустое поле — NULL, кроме name (crud.COPY_OPTIONS).
+        Возвращает число строк.
+        """
+        w = csv.writer(buf)
+        n = 0
+        for i in self._written():
+            stock = self.stock[i]
+            w.writerow((
+                self.nm_id[i], self.name[i].strip(), self.price_final[i] or self.price_api[i],
+                self.rating[i], self.review_count[i], None if stock == NULL else stock,
+                _fp_from_int(self.fingerprint[i]), refreshed_at,
+            ))
+            n += 1
+        return n
+
+    # --- Arrow / Parquet ---
+
+    def to_arrow(self):
+        """
+        pyarrow.Table с колонками INT_FIELDS, rating, name, brand, fingerprint, unchanged, stocks
+        (+ regions, queries).
+        Буферы array отдаются в Arrow без копирования; копия делается только для колонок,
+        где есть NULL (нужна маска), и для строк.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+        except ImportError as e:
+            raise ImportError("to_arrow() требует pyarrow: pip install pyarrow") from e
+
+        n = len(self)
+        columns: Dict[str, Any] = {}
+        for f in INT_FIELDS:
+            arr = getattr(self, f)
+            col = pa.Array.from_buffers(pa.int64(), n, [None, pa.py_buffer(arr)])
+            if NULL in arr:
+                col = pc.if_else(pc.equal(col, NULL), pa.nulls(n, pa.int64()), col)
+            columns[f] = col
+        rating = pa.Array.from_buffers(pa.float64(), n, [None, pa.py_buffer(self.rating)])
+        if any(self.unchanged):
+            rating = pc.if_else(pc.is_nan(rating), pa.nulls(n, pa.float64()), rating)
+        columns["rating"] = rating
+        columns["name"] = pa.array(self.name, pa.string())
+        columns["brand"] = pa.array(self.brand, pa.string()).dictionary_encode()
+        columns["fingerprint"] = pa.array([_fp_from_int(v) for v in self.fingerprint], pa.string())
+        columns["unchanged"] = pa.Array.from_buffers(pa.int8(), n, [None, pa.py_buffer(self.unchanged)]).cast(pa.bool_())
+        columns["stocks"] = pa.array(
+            [None if r is None else [{"wh": w, "size": sz, "qty": q} for w, sz, q in r] for r in self.stocks],
+            pa.list_(pa.struct([("wh", pa.int64()), ("size", pa.string()), ("qty", pa.int64())])),
+        )
+        if self.regions is not None:
+            columns["regions"] = pa.array(
+                [None if r is None else [{"dest": d, "price": p, "stock": st} for d, p, st in r] for r in self.regions],
+                pa.list_(pa.struct([("dest", pa.int64()), ("price", pa.int64()), ("stock", pa.int64())])),
+            )
+        if self.queries is not None:
+            columns["queries"] = pa.array(
+                self.queries, pa.list_(pa.struct([("query", pa.string()), ("position", pa.int32())]))
+            )
+        return pa.table(columns)
+
+    def to_parquet(self, path: str, **kwargs) -> None:
+        """Parquet-файл из to_arrow(); kwargs уходят в pyarrow.parquet.write_table."""
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("to_parquet() требует pyarrow: pip install pyarrow") from e
+        pq.write_table(self.to_arrow(), path, **kwargs)
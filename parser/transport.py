@@ -0,0 +1,231 @@
+import os
+import socket
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from parser.cache import TTLCache
+
+# Размер keep-alive пула по хосту: сколько запросов к нему бывает одновременно
+# (html_concurrency, concurrency у parse_many, detail по доп. регионам) с запасом.
+# Сверх пула соединение открывается заново и после ответа закрывается.
+DEFAULT_HOST_POOLS: Dict[str, int] = {
+    "search.wb.ru": 8,
+    "card.wb.ru": 16,
+    "www.wildberries.ru": 8,
+    "user-geo-data.wildberries.ru": 2,
+}
+# Остальные хосты — как у requests по умолчанию.
+DEFAULT_POOL = 10
+# Сколько секунд держать адреса хоста и простаивающее соединение (httpx).
+DNS_TTL = 300.0
+KEEPALIVE_EXPIRY = 30.0
+
+TRANSPORTS = ("requests", "httpx", "http2")
+
+
+class DNSCache:
+    """
+    Адреса хостов на ttl секунд: новое соединение к тому же хосту не ждёт getaddrinfo.
+    Если ни один адрес не ответил, запись выбрасывается и следующее соединение резолвит заново.
+    """
+
+    def __init__(self, ttl: float = DNS_TTL, maxsize: int = 256):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize)
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        addrs = self._cache.get((host, port))
+        if addrs is None:
+            addrs = []
+            for *_, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+                if sockaddr[0] not in addrs:
+                    addrs.append(sockaddr[0])
+            self._cache.set((host, port), addrs, self.ttl)
+        return addrs
+
+    def forget(self, host: str, port: int) -> None:
+        self._cache.pop((host, port))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+# Кэш DNS общий на процесс (WB_DNS_TTL, 0 — резолвить каждый раз).
+dns_cache = DNSCache(float(os.getenv("WB_DNS_TTL", str(DNS_TTL))))
+
+
+class _CachedDNSConnection:
+    """Подмешивается к соединениям urllib3: адрес берётся из dns_cache, по очереди, как в create_connection."""
+
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addrs = dns_cache.resolve(host, self.port)
+        except OSError:
+            # ошибку имени оформит сам urllib3
+            return super()._new_conn()
+        if not addrs:
+            return super()._new_conn()
+        err: Optional[Exception] = None
+        try:
+            for addr in addrs:
+                # host (SNI, Host, проверка сертификата) не меняется — только адрес сокета
+                self._dns_host = addr
+                try:
+                    return super()._new_conn()
+                # отказ (NewConnectionError) — тоже повод попробовать следующий адрес
+                except (ConnectTimeoutError, NewConnectionError) as e:
+                    err = e
+        finally:
+            self._dns_host = host
+        dns_cache.forget(host, self.port)
+        raise err
+
+
+class _HTTPConnection(_CachedDNSConnection, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CachedDNSConnection, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class HostPoolAdapter(HTTPAdapter):
+    """HTTPAdapter, у которого соединения резолвят хост через dns_cache."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPConnectionPool, "https": _HTTPSConnectionPool}
+
+
+def parse_host_pools(value: Optional[str]) -> Dict[str, int]:
+    """WB_HOST_POOLS: card.wb.ru=32,search.wb.ru=8 -> {"card.wb.ru": 32, "search.wb.ru": 8}."""
+    out: Dict[str, int] = {}
+    for part in (value or "").split(","):
+        host, sep, n = part.partition("=")
+        if sep and host.strip() and n.strip():
+            out[host.strip()] = int(n)
+    return out
+
+
+class RequestsTransport:
+    """
+    Запросы через requests.Session (HTTP/1.1): на каждый хост из host_pools — свой
+    keep-alive пул нужного размера, адреса хостов — из dns_cache.
+    """
+
+    name = "requests"
+    http2 = False
+
+    def __init__(self, session: requests.Session, host_pools: Optional[Dict[str, int]] = None):
+        self.session = session
+        self.host_pools = {**DEFAULT_HOST_POOLS, **(host_pools or {})}
+        for scheme in ("https://", "http://"):
+            session.mount(scheme, HostPoolAdapter(pool_maxsize=DEFAULT_POOL))
+            for host, n in self.host_pools.items():
+                session.mount(f"{scheme}{host}/", HostPoolAdapter(pool_connections=1, pool_maxsize=n))
+
+    def get(self, url: str, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def warm(self, urls: List[str]) -> int:
+        """
+        Открыть по соединению (DNS, TCP, TLS) к хосту каждого URL и положить в keep-alive пул —
+        первый настоящий запрос не ждёт рукопожатия. Ошибки не пробрасываются; сколько открылось.
+        """
+        opened = 0
+        for origin in {f"{p.scheme}://{p.netloc}/" for p in map(urlsplit, urls)}:
+            try:
+                # пул тот же, что у session.get: его ключ зависит от verify/cert/прокси с учётом окружения
+                env = self.session.merge_environment_settings(origin, {}, None, None, None)
+                pool = self.session.get_adapter(origin).get_connection_with_tls_context(
+                    requests.Request("GET", origin).prepare(), verify=env["verify"], proxies=env["proxies"], cert=env["cert"],
+                )
+                conn = pool._get_conn()
+                try:
+                    conn.connect()
+                    opened += 1
+                finally:
+                    pool._put_conn(conn)
+            except Exception:
+                pass
+        return opened
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class HttpxTransport:
+    """
+    Запросы через httpx.Client с заголовками и cookies той же requests.Session.
+    http2=True — HTTP/2 (нужен пакет h2): параллельные запросы к хосту идут
+    одним соединением. httpx не делит пул по хостам, его размер — сумма host_pools.
+    """
+
+    def __init__(self, session: requests.Session, host_pools: Optional[Dict[str, int]] = None, http2: bool = False):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("WB_TRANSPORT=httpx требует httpx: pip install httpx") from e
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError as e:
+                raise ImportError("WB_TRANSPORT=http2 требует h2: pip install 'httpx[http2]'") from e
+        self.session = session
+        self.http2 = http2
+        self.name = "http2" if http2 else "httpx"
+        self.host_pools = {**DEFAULT_HOST_POOLS, **(host_pools or {})}
+        total = sum(self.host_pools.values()) + DEFAULT_POOL
+        self.client = httpx.Client(
+            http2=http2,
+            cookies=session.cookies,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=total, max_keepalive_connections=total, keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    def get(self, url: str, params=None, headers=None, timeout=None, **kwargs):
+        # заголовки сессии читаются на каждый запрос: X-Info туда дописывается после создания транспорта.
+        # Connection — забота httpx (в HTTP/2 такого заголовка быть не может).
+        merged = {k: v for k, v in self.session.headers.items() if k.lower() != "connection"}
+        merged.update(headers or {})
+        kw = {"timeout": timeout} if timeout is not None else {}
+        return self.client.get(url, params=params, headers=merged, **kw)
+
+    def warm(self, urls: List[str]) -> int:
+        # у httpx нет способа открыть соединение без запроса — первый запрос к хосту платит рукопожатие сам
+        return 0
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def make_transport(name: Optional[str], session: requests.Session, host_pools: Optional[Dict[str, int]] = None):
+    """
+    Транспорт по имени: requests (по умолчанию), httpx или http2. Без имени — WB_TRANSPORT;
+    размеры пулов поверх DEFAULT_HOST_POOLS — host_pools или WB_HOST_POOLS ("host=n,host=n").
+    """
+    name = name or os.getenv("WB_TRANSPORT", "requests")
+    if host_pools is None:
+        host_pools = parse_host_pools(os.getenv("WB_HOST_POOLS"))
+    if name == "requests":
+        return RequestsTransport(session, host_pools)
+    if name in ("httpx", "http2"):
+        return HttpxTransport(session, host_pools, http2=name == "http2")
+    raise ValueError(f"unknown transport: {name!r} (ожидается одно из {', '.join(TRANSPORTS)})")
@@ -1,13 +1,31 @@
+import hashlib
 import json
 import logging
 import os
+import queue
 import re
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from html import unescape
-from typing import Any, Dict, List, Optional, Tuple
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
 
 import requests
 
+
+from parser.cache import FileCache, TTLCache
+from parser.checkpoint import CrawlCheckpoint, CrawlRun, get_default_checkpoint
+from parser.detail import HAS_NUMPY, StockRows, apply_detail_payload, apply_detail_payload_np
+from parser.httpcache import CachedResponse, ResponseCache, get_default_cache
+from parser import metrics
+from parser.health import EndpointHealth, get_default_health
+from parser.ratelimit import RATE_LIMIT_STATUSES, RateLimiter, THROTTLE_STATUSES, get_default_limiter
+from parser.records import ProductColumns
+from parser.transport import make_transport
+
 logger = logging.getLogger("parser.wb_api")
 if not logger.handlers:
     h = logging.StreamHandler()
@@ -15,6 +33,349 @@ if not logger.handlers:
     logger.addHandler(h)
 logger.setLevel(logging.INFO)
 
+# Сколько секунд товар с неизменным отпечатком выдачи можно не перепроверять (инкрементальный режим).
+INCREMENTAL_MAX_AGE = 24 * 3600
+
+# Поля товара из search.wb.ru, которые нужны итоговой строке (см. WBApiParser._slim_product).
+SEARCH_FIELDS = (
+    "id", "name", "brand", "brandName", "reviewRating", "rating", "supplierRating",
+    "feedbacks", "feedbackCount", "promoPriceU", "salePriceU", "priceU",
+)
+
+# Карточек на странице search.aspx и на сколько страниц HTML-выдача может «съехать»
+# относительно позиции товара в API-поиске.
+HTML_PER_PAGE = 100
+HTML_PAGE_SLACK = 1
+# Разобранные страницы search.aspx: (query, page, geo) -> карточки. 0 — кэш выключен.
+HTML_CACHE_TTL = float(os.getenv("WB_HTML_CACHE_TTL", "0"))
+_html_page_cache = TTLCache(maxsize=2048)
+# geo-info (dest, spp, X-Info) по адресу: один запрос к get-geo-info на адрес за столько секунд
+# на процесс — новый парсер и ParserPool.acquire его не ждут. 0 — спрашивать каждый раз.
+GEO_CACHE_TTL = float(os.getenv("WB_GEO_CACHE_TTL", "3600"))
+# Пауза перед повтором detail после ошибки — attempt * ERROR_BACKOFF секунд, через лимитер.
+ERROR_BACKOFF = 0.4
+_geo_cache = TTLCache(maxsize=256)
+
+
+def _read_cookie_file(path: str) -> List[Dict[str, Any]]:
+    """Cookies wildberries.ru из файла (формат export_cookies_cdp / normalize_cookies)."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    out = [
+        c for c in data
+        if "wildberries.ru" in (c.get("domain") or "") and c.get("name") and c.get("value") is not None
+    ]
+    logger.info("Загружены cookies: %d шт из %s", len(out), path)
+    return out
+
+
+def _read_ua_file(path: str) -> Optional[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [ln.strip() for ln in f if ln.strip()]
+    if lines:
+        logger.info("UA loaded from ua.txt")
+        return lines[0]
+    return None
+
+
+# Файлы разбираются заново, только когда изменились на диске.
+_cookie_files = FileCache(_read_cookie_file)
+_ua_files = FileCache(_read_ua_file)
+
+# --- разбор карточек search.aspx (см. WBApiParser._extract_cards_from_html) ---
+
+# <article ...>(.*?)</article> разбит на два поиска: ленивое (.*?) под re.I
+# проверяет "</article>" на каждом символе и было самым дорогим местом разбора
+_ARTICLE_OPEN_RE = re.compile(r'<article\b([^>]*)>', flags=re.I)
+_ARTICLE_CLOSE_RE = re.compile(r'</article>', flags=re.I)
+# все интересные атрибуты <article> за один проход; "c" допустим только у id="c123"
+_CARD_ATTR_RE = re.compile(
+    r'(?:\s|^)(data-nm-id|data-id|id|data-card-index|data-card-idx|data-index)\s*=\s*"(c?)(\d+)"',
+    flags=re.I,
+)
+_NM_ID_ATTRS = ("data-nm-id", "data-id", "id")
+_INDEX_ATTRS = ("data-card-index", "data-card-idx", "data-index")
+_LOWER_PRICE_RE = re.compile(
+    r'<(?:ins|span)\b[^>]*class="[^"]*price__lower-price[^"]*"[^>]*>([\s\S]*?)</(?:ins|span)>',
+    flags=re.I,
+)
+_PRICE_CLASS_RE = re.compile(r'class="[^"]*price[^"]*"', flags=re.I)
+_CURRENCY_RE = re.compile(r'₽|[рР][уУ][бБ]')
+_NON_DIGIT_RE = re.compile(r'[^\d]')
+
+
+def _iter_articles(html: str) -> Iterator[Tuple[str, int, int]]:
+    """(атрибуты, начало, конец тела) каждого <article> — как finditer по <article\\b([^>]*)>(.*?)</article>."""
+    pos = 0
+    while True:
+        m = _ARTICLE_OPEN_RE.search(html, pos)
+        if not m:
+            return
+        close = _ARTICLE_CLOSE_RE.search(html, m.end())
+        if not close:
+            return
+        yield m.group(1) or "", m.end(), close.start()
+        pos = close.end()
+
+
+def _find_card_price(html: str, start: int, end: int) -> Optional[str]:
+    """Сырой текст цены внутри html[start:end] или None."""
+    m = _LOWER_PRICE_RE.search(html, start, end)
+    if m:
+        return m.group(1)
+    # то же, что class="[^"]*price[^"]*"[\s\S]*?>([\s\S]*?)(?:₽|руб), но без возвратов:
+    # если после первого подходящего class= нет '>' с валютой дальше, не будет и после следующих
+    m = _PRICE_CLASS_RE.search(html, start, end)
+    if not m:
+        return None
+    gt = html.find(">", m.end(), end)
+    if gt < 0:
+        return None
+    cur = _CURRENCY_RE.search(html, gt + 1, end)
+    if not cur:
+        return None
+    return html[gt + 1:cur.start()]
+
+
+# --- разбор window.__WBSTATE__ (см. WBApiParser._extract_from_wbstate) ---
+
+_STATE_START_RE = re.compile(r"window\.__WBSTATE__\s*=\s*", flags=re.I)
+# то, что влияет на глубину скобок: сами скобки и строки (внутри строк скобки не считаются)
+_STATE_SCAN_RE = re.compile(r'[{}]|"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'', flags=re.S)
+_JS_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+|/\*[\s\S]*?\*/|//[^\n]*)
+    | (?P<dq>"(?:[^"\\]|\\.)*")
+    | (?P<sq>'(?:[^'\\]|\\.)*')
+    | (?P<num>-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<ident>[A-Za-z_$][\w$]*)
+    | (?P<punct>[{}\[\]:,])
+    """,
+    flags=re.X,
+)
+_JSON_DECODER = json.JSONDecoder()
+_JS_NULLS = {"undefined", "NaN", "Infinity"}
+_STATE_ID_KEYS = ("id", "nm", "nmId")
+_STATE_PRICE_KEYS = ("promoPriceU", "salePriceU", "priceU")
+_STATE_SIZE_PRICE_KEYS = ("basic", "total", "product")
+
+
+def _cut_js_object(text: str, start: int) -> Optional[str]:
+    """Объект {...}, начинающийся в text[start], с учётом вложенности и строк."""
+    if start >= len(text) or text[start] != "{":
+        return None
+    depth = 0
+    for m in _STATE_SCAN_RE.finditer(text, start):
+        t = m.group()
+        if t == "{":
+            depth += 1
+        elif t == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:m.end()]
+    return None
+
+
+def _js_to_json(raw: str) -> str:
+    """
+    JS-литерал -> JSON: ключи без кавычек, одинарные кавычки, undefined/NaN,
+    висячие запятые, комментарии. Всё, что не похоже на литерал, — ValueError.
+    """
+    out: List[str] = []
+    pos = 0
+    n = len(raw)
+    while pos < n:
+        m = _JS_TOKEN_RE.match(raw, pos)
+        if not m:
+            raise ValueError(f"unexpected JS at {pos}: {raw[pos:pos + 20]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        tok = m.group()
+        if kind == "ws":
+            continue
+        if kind == "sq":
+            body = tok[1:-1].replace("\\'", "'").replace('"', '\\"')
+            tok = '"' + body + '"'
+        elif kind == "num":
+            if tok.lstrip("-").startswith("."):
+                tok = tok.replace(".", "0.", 1)
+            if tok.endswith("."):
+                tok += "0"
+        elif kind == "ident":
+            if tok in _JS_NULLS:
+                tok = "null"
+            elif tok not in ("true", "false", "null"):
+                tok = '"' + tok + '"'
+        elif tok in "}]" and out and out[-1] == ",":
+            out.pop()
+        out.append(tok)
+    return "".join(out)
+
+
+def _decode_wbstate(html: str) -> Optional[Any]:
+    m = _STATE_START_RE.search(html)
+    if not m:
+        return None
+    try:
+        # raw_decode сам находит конец объекта — резать строку не нужно
+        return _JSON_DECODER.raw_decode(html, m.end())[0]
+    except ValueError:
+        pass
+    raw = _cut_js_object(html, m.end())
+    if raw is None:
+        return None
+    try:
+        return json.loads(_js_to_json(raw))
+    except ValueError:
+        return None
+
+
+def _state_prices_u(p: Dict[str, Any]) -> List[int]:
+    """Все цены товара из WBSTATE (в копейках): promo/sale/priceU и price.{basic,total,product} у него и у размеров."""
+    out = [v for v in (p.get(k) for k in _STATE_PRICE_KEYS) if type(v) is int and v > 0]
+    sizes = p.get("sizes")
+    holders = [p, *sizes] if isinstance(sizes, list) else [p]
+    for h in holders:
+        po = h.get("price") if isinstance(h, dict) else None
+        if isinstance(po, dict):
+            out.extend(v for v in (po.get(k) for k in _STATE_SIZE_PRICE_KEYS) if type(v) is int and v > 0)
+    return out
+
+
+def _state_products(state: Any) -> Iterator[Tuple[int, List[int], Dict[str, Any]]]:
+    """
+    Обходим дерево состояния по порядку; товар — словарь с числовым id/nm/nmId
+    и хоть одной ценой. Внутрь товара не спускаемся.
+    """
+    stack = [state]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            pid = next((v for v in (node.get(k) for k in _STATE_ID_KEYS) if type(v) is int), None)
+            prices = _state_prices_u(node) if pid is not None else None
+            if prices:
+                yield pid, prices, node
+                continue
+            stack.extend(reversed(node.values()))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+
+
+class _HtmlPagePlan:
+    """
+    Какие страницы search.aspx качать, чтобы найти needed.
+    Для id с позицией в поиске сначала качается предсказанная страница, потом соседние
+    (± HTML_PAGE_SLACK); если и там нет — id больше не ищем. id без позиции ищутся
+    прежним обходом подряд с первой страницы (по window страниц за раз).
+    Пустая страница означает конец выдачи: страницы за ней не качаются.
+    """
+
+    def __init__(self, needed: set, positions: Dict[int, int], max_pages: int, window: int):
+        self.needed = needed
+        self.window = max(1, window)
+        self.max_pages = max_pages
+        self.last_page = max_pages
+        self.fetched: set = set()
+        self.groups: Dict[int, List[List[int]]] = {}
+        self.unplaced: set = set()
+        for pid in needed:
+            pos = positions.get(pid)
+            if not pos:
+                self.unplaced.add(pid)
+                continue
+            home = (pos - 1) // HTML_PER_PAGE + 1
+            self.groups[pid] = [[home]] + [[home - d, home + d] for d in range(1, HTML_PAGE_SLACK + 1)]
+
+    def next_pages(self) -> List[int]:
+        pages = set()
+        for pid in self.needed:
+            for group in self.groups.get(pid, ()):
+                todo = [p for p in group if 1 <= p <= self.last_page and p not in self.fetched]
+                if todo:
+                    pages.update(todo)
+                    break
+        if self.needed & self.unplaced:
+            seq = (p for p in range(1, self.last_page + 1) if p not in self.fetched)
+            for p, _ in zip(seq, range(self.window)):
+                pages.add(p)
+        return sorted(pages)
+
+    def mark(self, page: int, cards: Optional[Dict[int, Dict[str, Any]]]) -> None:
+        """cards=None — страницу скачать не удалось, {} — страница пустая."""
+        self.fetched.add(page)
+        if cards is not None and not cards:
+            self.last_page = min(self.last_page, page - 1)
+
+    def legacy_pages(self, result: Dict[int, Dict[str, Any]], total: Optional[int]) -> int:
+        """Сколько страниц прошёл бы прежний обход подряд с первой страницы."""
+        if not self.groups and not self.unplaced:
+            return 0
+        last_found = max((m["page"] for m in result.values()), default=0)
+        return self.legacy_estimate(last_found, bool(self.needed), total, self.max_pages)
+
+    @staticmethod
+    def legacy_estimate(last_found: int, missing: bool, total: Optional[int], max_pages: int) -> int:
+        """
+        Прежний обход останавливался, найдя всё (на last_found), иначе — на первой
+        пустой странице после выдачи из total товаров или на max_pages.
+        """
+        if not missing:
+            return last_found
+        if total is None:
+            return max_pages
+        return min(max_pages, (total + HTML_PER_PAGE - 1) // HTML_PER_PAGE + 1)
+
+
+def _drain_parallel(gens: List[Iterator[List[Dict]]], concurrency: int) -> Iterator[List[Dict]]:
+    """
+    Генераторы партий в concurrency потоках; готовые партии отдаются по мере появления
+    через очередь на concurrency мест — поток, обогнавший потребителя, ждёт.
+    Ошибка в потоке пробрасывается потребителю; если он бросил чтение, потоки
+    останавливаются после текущей партии.
+    """
+    out: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=concurrency)
+    stop = threading.Event()
+
+    def put(item: Tuple[str, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(gen: Iterator[List[Dict]]) -> None:
+        try:
+            for rows in gen:
+                if not put(("rows", rows)):
+                    return
+            put(("done", None))
+        except BaseException as e:
+            put(("error", e))
+        finally:
+            gen.close()
+
+    ex = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for gen in gens:
+            ex.submit(drain, gen)
+        left = len(gens)
+        while left:
+            kind, value = out.get()
+            if kind == "rows":
+                yield value
+            elif kind == "done":
+                left -= 1
+            else:
+                raise value
+    finally:
+        stop.set()
+        ex.shutdown(wait=True, cancel_futures=True)
+
+
 class WBApiParser:
     SEARCH_URLS = [
         "https://search.wb.ru/exactmatch/ru/common/v5/search",
@@ -26,9 +387,44 @@ class WBApiParser:
         "https://card.wb.ru/cards/detail",
     ]
     SEARCH_HTML_URL = "https://www.wildberries.ru/catalog/0/search.aspx"
+    GEO_URL = "https://user-geo-data.wildberries.ru/get-geo-info"
 
-    def __init__(self, ua_path: Optional[str] = None, cookies_path: Optional[str] = None, timeout: int = 15):
+    def __init__(
+        self,
+        ua_path: Optional[str] = None,
+        cookies_path: Optional[str] = None,
+        timeout: int = 15,
+        rate_limiter: Optional[RateLimiter] = None,
+        http_cache: Optional[ResponseCache] = None,
+        checkpoint: Optional[CrawlCheckpoint] = None,
+        regions: Optional[List[Union[str, int]]] = None,
+        transport: Any = None,
+        health: Optional[EndpointHealth] = None,
+    ):
         self.timeout = timeout
+        # Все запросы к WB идут через лимитер; по умолчанию он общий на процесс.
+        self.rate_limiter = rate_limiter or get_default_limiter()
+        # Живость запасных URL search/detail: мёртвые не пробуются (общий на процесс реестр).
+        self.health = health if health is not None else get_default_health()
+        # Кэш ответов search/card/search.aspx на диске; по умолчанию — из WB_HTTP_CACHE (или выключен).
+        self.http_cache = http_cache if http_cache is not None else get_default_cache()
+        # Чекпоинты обхода: упавший прогон с теми же параметрами продолжается (WB_CHECKPOINT_DB).
+        self.checkpoint = checkpoint if checkpoint is not None else get_default_checkpoint()
+        # с run_id чекпоинт продолжает только прогон с тем же run_id (задача /parse — свой id)
+        self.run_id: Optional[str] = None
+        self._run: Optional[CrawlRun] = None
+        self._incomplete: List[str] = []
+        # nm_id -> [(wh, размер, qty), ...] из detail, пока строка товара не собрана
+        self._wh_stocks: Dict[int, StockRows] = {}
+        # nm_id -> {dest: (цена, остаток)} по доп. регионам, пока строка товара не собрана
+        self._region_detail: Dict[int, Dict[int, Tuple[Optional[int], int]]] = {}
+        # on_progress(stage, n): "search_pages" / "detail_batches" / "html_pages"
+        self.on_progress: Optional[Callable[[str, int], None]] = None
+        self.last_stats: Dict[str, int] = {}
+        self.html_concurrency = int(os.getenv("WB_HTML_CONCURRENCY", "4"))
+        self.html_cache_ttl = HTML_CACHE_TTL
+        self._stats_lock = threading.Lock()
+        self._html_counts: Dict[str, int] = {}
         self.session = requests.Session()
         self.user_agent = self._load_user_agent(ua_path)
         self.session.headers.update({
@@ -42,14 +438,38 @@ class WBApiParser:
             here = os.path.dirname(__file__)
             guess = os.path.abspath(os.path.join(here, "..", "cookies.json"))
             cookies_path = guess if os.path.exists(guess) else None
+        self.cookies_path = cookies_path
+        # (mtime, размер) загруженного файла cookies: refresh() перечитывает его, только если он другой
+        self._cookies_stamp = None
         if cookies_path and os.path.exists(cookies_path):
             self._load_cookies(cookies_path)
 
+        # Через что ходим в сеть: "requests" (по умолчанию), "httpx", "http2" (WB_TRANSPORT)
+        # или готовый объект с get(url, params=, headers=, timeout=). Заголовки и cookies — из session.
+        if transport is None or isinstance(transport, str):
+            transport = make_transport(transport, self.session)
+        self.transport = transport
+
+        # Все хосты WB — на один адрес (WB_API_BASE=http://127.0.0.1:8800): мок bench.mockwb или стенд.
+        # URL эндпоинта -> исходный URL WB: по нему http_cache выбирает TTL (см. _rebase).
+        self._ttl_urls: Dict[str, str] = {}
+        base = os.getenv("WB_API_BASE")
+        if base:
+            self._rebase(base)
+
         self.xinfo_raw: Optional[str] = None
-        address = os.getenv("WB_ADDRESS", "Москва")
-        self.geo = self._get_geo_info_via_xinfo(address)  
+        self.address = os.getenv("WB_ADDRESS", "Москва")
+        self.geo = self._get_geo_info_via_xinfo(self.address)
+        # Доп. регионы: detail по ним качается вместе с основным (поиск и HTML — только по основному).
+        if regions is None:
+            regions = [r for r in os.getenv("WB_REGIONS", "").split(";") if r.strip()]
+        self.regions: List[Dict[str, Any]] = self._resolve_regions(regions)
 
         self.enable_html_meta = bool(int(os.getenv("WB_HTML_META", "1")))
+        # Остатки и цены из detail через NumPy (WB_DETAIL_NUMPY=1); результат тот же, что без него.
+        self.detail_numpy = bool(int(os.getenv("WB_DETAIL_NUMPY", "0")))
+        if self.detail_numpy and not HAS_NUMPY:
+            raise ImportError("WB_DETAIL_NUMPY=1 требует numpy: pip install numpy")
 
         self.html_headers = {
             "User-Agent": self.user_agent,
@@ -63,388 +483,1238 @@ class WBApiParser:
             self.html_headers["X-Info"] = self.xinfo_raw
             self.session.headers["X-Info"] = self.xinfo_raw
 
-    def parse(self, query: str, max_products: Optional[int] = None, max_pages: Optional[int] = None) -> List[Dict]:
+    def refresh(self) -> None:
+        """
+        Перед очередным прогоном долгоживущего экземпляра (parser.pool.ParserPool): cookies —
+        если файл изменился на диске, geo/X-Info основного региона — если истёк кэш (WB_GEO_CACHE_TTL).
+        Не удалось получить geo — остаётся прежнее.
+        """
+        self._reload_cookies()
+        try:
+            self.geo, xinfo = self._fetch_geo(self.address)
+        except Exception as e:
+            logger.warning("geo-info не обновлено, остаётся прежнее: %s", e)
+            return
+        if xinfo:
+            self.xinfo_raw = xinfo
+            self.html_headers["X-Info"] = xinfo
+            self.session.headers["X-Info"] = xinfo
+
+    def warm(self) -> int:
+        """Заранее открыть соединения к хостам поиска, detail и HTML; сколько открылось."""
+        warm = getattr(self.transport, "warm", None)
+        if warm is None:
+            return 0
+        return warm([self.SEARCH_URLS[0], self.DETAIL_URLS[0], self.SEARCH_HTML_URL])
+
+    def close(self) -> None:
+        """Закрыть соединения транспорта и сессии."""
+        self.transport.close()
+        self.session.close()
+
+    def parse(
+        self,
+        query: str,
+        max_products: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        engine: str = "sync",
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]] = None,
+        max_age: Optional[float] = INCREMENTAL_MAX_AGE,
+        columnar: bool = False,
+    ):
         """
         max_products=None  -> собрать вообще все товары (до окончания страниц или max_pages)
         max_pages=None     -> без ограничения по страницам (пока не кончатся товары)
         Можно совмещать: например max_products=2000 и max_pages=50.
+        engine="async"     -> все три этапа (поиск, detail, HTML) идут конвейером
+                              через asyncio, см. parser.wb_async.AsyncWBApiParser.
+
+        Инкрементальный режим: known = {nm_id: (fingerprint, refreshed_at epoch)} из прошлых
+        обходов (crud.load_fingerprints). Товары с тем же отпечатком выдачи, проверенные
+        не раньше max_age секунд назад, не идут в detail/HTML и возвращаются строкой
+        {"nm_id", "fingerprint", "unchanged": True}. Сводка экономии — в self.last_stats.
+
+        Если задан checkpoint, состояние обхода пишется по ходу дела; прогон, где не скачались
+        страницы поиска или detail (last_stats["incomplete"] > 0) или который прервался исключением,
+        при повторном вызове с теми же параметрами (режим и run_id тоже) продолжается с места остановки.
+        Неудачные страницы HTML-меты прогон неполным не делают (last_stats["html_failed"]).
+        stock = None — остаток неизвестен (detail по товару так и не ответил).
+
+        columnar=True      -> вместо списка словарей parser.records.ProductColumns: те же строки
+                              по колонкам (компактно в памяти, to_arrow()/to_parquet(),
+                              crud.upsert_products грузит его без промежуточных словарей).
+
+        С доп. регионами (regions= в конструкторе или WB_REGIONS) у строк есть "regions":
+        [(dest, цена, остаток), ...] — сначала основной регион, затем доп. в порядке regions.
         """
+        if engine == "async":
+            import asyncio
+            from parser.wb_async import AsyncWBApiParser
+
+            aparser = AsyncWBApiParser.from_parser(self)
+            rows = asyncio.run(aparser.aparse(
+                query, max_products, max_pages, known=known, max_age=max_age, columnar=columnar,
+            ))
+            self.last_stats = aparser.last_stats
+            return rows
+        if engine != "sync":
+            raise ValueError(f"unknown engine: {engine!r}")
+
+        now = time.time()
+        self._begin_run([query], max_products, max_pages, known, max_age)
         items = self._search(query, limit=max_products, max_pages=max_pages)
         logger.info("search returned %d items for query='%s'", len(items), query)
         if not items:
-            return []
+            self.last_stats = self._finish_run(self._run_stats({query: items}, [], []))
+            return ProductColumns() if columnar else []
 
-        ids = [it["id"] for it in items if it.get("id")]
+        refresh, unchanged = self._split_for_refresh(items, known, max_age, now)
+        ids = [it["id"] for it in refresh if it.get("id")]
         id2stock, id2price = self._detail_info(ids)
 
         html_meta: Dict[int, Dict[str, Any]] = {}
         if self.enable_html_meta:
-            html_meta = self._collect_html_meta_for_ids(query, ids, per_page=100, max_pages=max_pages or 50)
+            html_meta = self._collect_html_meta_for_ids(
+                query, ids, max_pages=max_pages or 50,
+                positions=self._search_positions(items), total=len(items),
+            )
+
+        self.last_stats = self._finish_run(self._run_stats({query: items}, refresh, unchanged))
+        return self._result_rows(refresh, unchanged, id2stock, id2price, html_meta, columnar)
+
+    def parse_many(
+        self,
+        queries: List[str],
+        max_products: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        engine: str = "sync",
+        concurrency: int = 4,
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]] = None,
+        max_age: Optional[float] = INCREMENTAL_MAX_AGE,
+        columnar: bool = False,
+    ):
+        """
+        Несколько запросов за один прогон. Поиск по запросам идёт параллельно
+        (до concurrency одновременно, общий бюджет — через rate_limiter),
+        detail и HTML-мета запрашиваются по каждому nm_id один раз.
+        max_products / max_pages действуют на каждый запрос отдельно.
+        known / max_age — инкрементальный режим, как в parse(); columnar — тоже.
+
+        Строки — как у parse(), плюс "queries": [{"query", "position"}, ...] —
+        под какими запросами и на какой позиции (с 1) товар встретился.
+        """
+        queries = self._normalize_queries(queries)
+        if not queries:
+            return ProductColumns() if columnar else []
+        if engine == "async":
+            import asyncio
+            from parser.wb_async import AsyncWBApiParser
+
+            aparser = AsyncWBApiParser.from_parser(self, concurrency=concurrency)
+            rows = asyncio.run(aparser.aparse_many(
+                queries, max_products, max_pages, known=known, max_age=max_age, columnar=columnar,
+            ))
+            self.last_stats = aparser.last_stats
+            return rows
+        if engine != "sync":
+            raise ValueError(f"unknown engine: {engine!r}")
+
+        now = time.time()
+        self._begin_run(queries, max_products, max_pages, known, max_age)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(queries))) as ex:
+            found = list(ex.map(lambda q: self._search(q, limit=max_products, max_pages=max_pages), queries))
+        items, positions, owner = self._merge_query_results(queries, found)
+        logger.info("search returned %d unique items for %d queries", len(items), len(queries))
+        if not items:
+            self.last_stats = self._finish_run(self._run_stats(dict(zip(queries, found)), [], []))
+            return ProductColumns() if columnar else []
+
+        refresh, unchanged = self._split_for_refresh(list(items.values()), known, max_age, now)
+        ids = [it["id"] for it in refresh]
+        id2stock, id2price = self._detail_info(ids)
+
+        html_meta: Dict[int, Dict[str, Any]] = {}
+        if self.enable_html_meta:
+            by_query = self._ids_by_owner(queries, {pid: owner[pid] for pid in ids})
+            found_by_query = dict(zip(queries, found))
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(by_query) or 1)) as ex:
+                metas = ex.map(
+                    lambda q: self._collect_html_meta_for_ids(
+                        q, by_query[q], max_pages=max_pages or 50,
+                        positions=self._search_positions(found_by_query[q]), total=len(found_by_query[q]),
+                    ),
+                    list(by_query),
+                )
+                for meta in metas:
+                    html_meta.update(meta)
+
+        self.last_stats = self._finish_run(self._run_stats(dict(zip(queries, found)), refresh, unchanged))
+        rows = self._result_rows(refresh, unchanged, id2stock, id2price, html_meta, columnar)
+        return self._attach_positions(rows, positions)
+
+    def iter_parse(
+        self,
+        queries: List[str],
+        max_products: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]] = None,
+        max_age: Optional[float] = INCREMENTAL_MAX_AGE,
+        batch_size: int = 500,
+        concurrency: int = 4,
+    ) -> Iterator[List[Dict]]:
+        """
+        Потоковый parse_many(): отдаёт готовые строки партиями, как только для партии
+        (batch_size товаров поиска, кратно 100) получены detail и HTML-мета.
+        Запросы, как в parse_many, обходятся параллельно: до concurrency потоков (общий
+        бюджет — через rate_limiter), каждый собирает и обогащает партии своего запроса
+        и кладёт их в общую очередь на concurrency партий. В памяти — порядка
+        2 * concurrency партий сырых товаров плюс множество уже выданных nm_id.
+
+        Строки — как у parse_many(), но "queries" содержит только запрос, где товар
+        встретился впервые (по нему же ищется HTML-мета; при concurrency > 1 «впервые» —
+        по времени, а не по порядку queries). Повторная встреча по другому запросу
+        приходит строкой {"nm_id", "queries", "duplicate": True} — только позиция.
+        Партии разных запросов идут вперемешку. Сводка — в self.last_stats, когда генератор исчерпан.
+        """
+        queries = self._normalize_queries(queries)
+        batch_size = max(100, batch_size // 100 * 100)
+        now = time.time()
+        self._begin_run(queries, max_products, max_pages, known, max_age)
+        emitted: set[int] = set()
+        emitted_lock = threading.Lock()
+        per_query = [self._new_query_stats() for _ in queries]
+        gens = [
+            self._query_batches(
+                query, qstats, emitted, emitted_lock, known, max_age, now, max_products, max_pages, batch_size,
+            )
+            for query, qstats in zip(queries, per_query)
+        ]
+
+        if concurrency > 1 and len(gens) > 1:
+            yield from _drain_parallel(gens, min(concurrency, len(gens)))
+        else:
+            for gen in gens:
+                yield from gen
+
+        self.last_stats = self._finish_run(self._stream_stats(per_query, max_pages))
+
+    def _query_batches(
+        self,
+        query: str,
+        qstats: Dict[str, int],
+        emitted: set,
+        emitted_lock: threading.Lock,
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]],
+        max_age: Optional[float],
+        now: float,
+        max_products: Optional[int],
+        max_pages: Optional[int],
+        batch_size: int,
+    ) -> Iterator[List[Dict]]:
+        """Партии одного запроса для iter_parse: страницы поиска -> batch_size новых товаров -> detail и HTML-мета."""
+        batch: List[Tuple[int, Dict]] = []
+        dups: List[Dict] = []
+        # None в конце — сигнал выдать неполную последнюю партию
+        for page_items in chain(self._search_pages(query, max_products, max_pages), (None,)):
+            if page_items is not None:
+                # emitted общий для запросов, которые идут в соседних потоках
+                with emitted_lock:
+                    self._take_batch_items(query, page_items, qstats, emitted, batch, dups)
+                if len(batch) < batch_size:
+                    continue
+            if not batch and not dups:
+                continue
+            rows = self._enrich_batch(query, batch, qstats, known, max_age, now, max_pages)
+            yield rows + dups
+            batch, dups = [], []
+
+    @staticmethod
+    def _new_query_stats() -> Dict[str, int]:
+        """Счётчики одного запроса в iter_parse (seen — товаров выдачи, html_page — последняя страница с находкой)."""
+        return {"seen": 0, "refreshed": 0, "unchanged": 0, "last_refresh": 0, "html_page": 0, "html_missing": 0}
+
+    def _stream_stats(self, per_query: List[Dict[str, int]], max_pages: Optional[int]) -> Dict[str, int]:
+        if self.enable_html_meta:
+            for q in per_query:
+                if q["refreshed"]:
+                    self._count_html("html_requests_legacy", _HtmlPagePlan.legacy_estimate(
+                        q["html_page"], bool(q["html_missing"]), q["seen"], max_pages or 50,
+                    ))
+        return self._stats_from_counts(
+            [(q["seen"], q["last_refresh"]) for q in per_query],
+            sum(q["refreshed"] for q in per_query),
+            sum(q["unchanged"] for q in per_query),
+        )
+
+    @staticmethod
+    def _take_batch_items(
+        query: str,
+        page_items: List[Dict],
+        qstats: Dict[str, int],
+        emitted: set,
+        batch: List[Tuple[int, Dict]],
+        dups: List[Dict],
+    ) -> None:
+        """Раскладываем страницу поиска: новые товары — в batch (с позицией), уже выданные — в dups."""
+        for it in page_items:
+            qstats["seen"] += 1
+            pos = qstats["seen"]
+            pid = it["id"]
+            if pid in emitted:
+                dups.append({"nm_id": pid, "duplicate": True, "queries": [{"query": query, "position": pos}]})
+            else:
+                emitted.add(pid)
+                batch.append((pos, it))
 
-        out: List[Dict] = []
+    def _enrich_batch(
+        self,
+        query: str,
+        batch: List[Tuple[int, Dict]],
+        qstats: Dict[str, int],
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]],
+        max_age: Optional[float],
+        now: float,
+        max_pages: Optional[int],
+    ) -> List[Dict]:
+        if not batch:
+            return []
+        refresh, unchanged = self._split_for_refresh([it for _, it in batch], known, max_age, now)
+        ids = [it["id"] for it in refresh]
+        id2stock, id2price = self._detail_info(ids)
+        html_meta: Dict[int, Dict[str, Any]] = {}
+        if self.enable_html_meta and ids:
+            html_meta = self._collect_html_meta_for_ids(
+                query, ids, max_pages=max_pages or 50,
+                positions={it["id"]: pos for pos, it in batch},
+            )
+        return self._batch_rows(query, batch, qstats, refresh, unchanged, id2stock, id2price, html_meta)
+
+    def _batch_rows(
+        self,
+        query: str,
+        batch: List[Tuple[int, Dict]],
+        qstats: Dict[str, int],
+        refresh: List[Dict],
+        unchanged: List[Dict],
+        id2stock: Dict[int, int],
+        id2price: Dict[int, int],
+        html_meta: Dict[int, Dict[str, Any]],
+    ) -> List[Dict]:
+        """Строки партии (с позицией в запросе) + обновление счётчиков запроса."""
+        pos_of = {it["id"]: pos for pos, it in batch}
+        rows = self._result_rows(refresh, unchanged, id2stock, id2price, html_meta)
+        for row in rows:
+            row["queries"] = [{"query": query, "position": pos_of[row["nm_id"]]}]
+        qstats["refreshed"] += len(refresh)
+        qstats["unchanged"] += len(unchanged)
+        qstats["last_refresh"] = max([qstats["last_refresh"], *(pos_of[it["id"]] for it in refresh)])
+        qstats["html_page"] = max([qstats["html_page"], *(m["page"] for m in html_meta.values())])
+        qstats["html_missing"] += len(refresh) - len(html_meta)
+        return rows
+
+    @staticmethod
+    def fingerprint(it: Dict) -> str:
+        """Отпечаток полей поисковой выдачи: поменялся — товар надо перепроверить."""
+        fp = it.get("_fp")
+        if fp:
+            return fp
+        sizes = tuple(
+            tuple((s.get("price") or {}).get(k) for k in ("basic", "product", "total"))
+            for s in (it.get("sizes") or [])
+        )
+        key = (
+            it.get("name"), it.get("brand") or it.get("brandName"),
+            it.get("promoPriceU"), it.get("salePriceU"), it.get("priceU"),
+            it.get("reviewRating"), it.get("rating"), it.get("supplierRating"),
+            it.get("feedbacks") or it.get("feedbackCount"),
+            it.get("totalQuantity"), sizes,
+        )
+        return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).hexdigest()
+
+    def _is_unchanged(
+        self,
+        it: Dict,
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]],
+        max_age: Optional[float],
+        now: float,
+    ) -> bool:
+        if not known:
+            return False
+        k = known.get(it.get("id"))
+        if not k or k[0] != self.fingerprint(it):
+            return False
+        return max_age is None or (k[1] is not None and now - k[1] <= max_age)
+
+    def _split_for_refresh(
+        self,
+        items: List[Dict],
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]],
+        max_age: Optional[float],
+        now: float,
+    ) -> Tuple[List[Dict], List[Dict]]:
+        if not known:
+            return items, []
+        refresh: List[Dict] = []
+        unchanged: List[Dict] = []
         for it in items:
-            pid = int(it.get("id", 0) or 0)
-            name = (it.get("name") or "").strip()
-            brand = it.get("brand") or it.get("brandName")
-
-            raw_rating = it.get("reviewRating")
-            if raw_rating is None:
-                raw_rating = it.get("rating")
-            if raw_rating is None:
-                raw_rating = it.get("supplierRating")
-            try:
-                rating = float(raw_rating or 0.0)
-                if rating > 5:
-                    rating = rating / 10.0
-                rating = round(rating, 1)
-            except Exception:
-                rating = 0.0
-
-            review_count = int(it.get("feedbacks") or it.get("feedbackCount") or 0)
-
-            price_u = it.get("promoPriceU") or it.get("salePriceU") or it.get("priceU") or 0
-            price_api = (price_u or 0) // 100
-
-            if pid in id2price:
-                price_api = min(price_api, id2price[pid]) if price_api else id2price[pid]
-
-            meta = html_meta.get(pid, {})
-            wallet_price = meta.get("wallet_price")
-            idx = meta.get("index")
-            page = meta.get("page")
-
-            price_final = wallet_price if isinstance(wallet_price, int) and wallet_price > 0 else price_api
-
-            out.append({
-                "nm_id": pid,
-                "name": name,
-                "brand": brand,
-                "price_api": int(price_api or 0),
-                "price_wallet": int(wallet_price) if wallet_price is not None else None,
-                "price_final": int(price_final or 0),
-                "rating": rating,
-                "review_count": review_count,
-                "stock": int(id2stock.get(pid, 0)),
-                "data_card_index": idx if isinstance(idx, int) else None,
-                "page": int(page) if isinstance(page, int) else None,
-            })
-
-        out.sort(key=lambda x: (
-            x["page"] is None, x["page"] if x["page"] is not None else 10**9,
-            x["data_card_index"] is None, x["data_card_index"] if x["data_card_index"] is not None else 10**9
-        ))
+            (unchanged if self._is_unchanged(it, known, max_age, now) else refresh).append(it)
+        return refresh, unchanged
+
+    def _unchanged_rows(self, items: List[Dict], out=None):
+        out = [] if out is None else out
+        for it in items:
+            out.append({"nm_id": int(it["id"]), "fingerprint": self.fingerprint(it), "unchanged": True})
+        return out
+
+    def _result_rows(
+        self,
+        refresh: List[Dict],
+        unchanged: List[Dict],
+        id2stock: Dict[int, int],
+        id2price: Dict[int, int],
+        html_meta: Dict[int, Dict[str, Any]],
+        columnar: bool = False,
+    ):
+        """Итог parse()/parse_many(): список словарей или ProductColumns (columnar=True)."""
+        out = ProductColumns() if columnar else []
+        with metrics.stage("build_rows", rows=len(refresh) + len(unchanged)):
+            self._build_rows(refresh, id2stock, id2price, html_meta, out)
+            self._unchanged_rows(unchanged, out)
         return out
 
+    @staticmethod
+    def _run_stats(found: Dict[str, List[Dict]], refresh: List[Dict], unchanged: List[Dict]) -> Dict[str, int]:
+        """
+        Сводка прогона и оценка экономии относительно полного обхода.
+        HTML-страниц полный обход проходит до последнего товара выдачи,
+        инкрементальный — до последнего товара, который пришлось перепроверять.
+        """
+        refresh_ids = {it.get("id") for it in refresh}
+        per_query = [
+            (len(its), max((i for i, it in enumerate(its, start=1) if it.get("id") in refresh_ids), default=0))
+            for its in found.values()
+        ]
+        return WBApiParser._stats_from_counts(per_query, len(refresh), len(unchanged))
+
+    @staticmethod
+    def _stats_from_counts(per_query: List[Tuple[int, int]], refreshed: int, unchanged: int) -> Dict[str, int]:
+        """per_query — (товаров в выдаче, позиция последнего перепроверенного) по каждому запросу."""
+        html_full = html_needed = 0
+        for n_items, last in per_query:
+            html_full += (n_items + 99) // 100
+            html_needed += (last + 99) // 100
+        total = refreshed + unchanged
+        return {
+            "items": total,
+            "refreshed": refreshed,
+            "unchanged": unchanged,
+            "detail_requests_saved": (total + 99) // 100 - (refreshed + 99) // 100,
+            "html_requests_saved": html_full - html_needed,
+            "writes_saved": unchanged,
+        }
+
+    @staticmethod
+    def _normalize_queries(queries: List[str]) -> List[str]:
+        return list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+
+    @staticmethod
+    def _merge_query_results(
+        queries: List[str],
+        found: List[List[Dict]],
+    ) -> Tuple[Dict[int, Dict], Dict[int, List[Dict[str, Any]]], Dict[int, Tuple[int, str]]]:
+        """
+        items: nm_id -> товар из поиска (первое появление);
+        positions: nm_id -> [{"query", "position"}];
+        owner: nm_id -> (лучшая позиция, запрос) — по этому запросу ищем товар в HTML.
+        """
+        items: Dict[int, Dict] = {}
+        positions: Dict[int, List[Dict[str, Any]]] = {}
+        owner: Dict[int, Tuple[int, str]] = {}
+        for query, its in zip(queries, found):
+            for pos, it in enumerate(its, start=1):
+                pid = it.get("id")
+                if not pid:
+                    continue
+                items.setdefault(pid, it)
+                positions.setdefault(pid, []).append({"query": query, "position": pos})
+                if pid not in owner or pos < owner[pid][0]:
+                    owner[pid] = (pos, query)
+        return items, positions, owner
+
+    @staticmethod
+    def _ids_by_owner(queries: List[str], owner: Dict[int, Tuple[int, str]]) -> Dict[str, List[int]]:
+        by_query: Dict[str, List[int]] = {q: [] for q in queries}
+        for pid, (_, q) in owner.items():
+            by_query[q].append(pid)
+        return {q: ids for q, ids in by_query.items() if ids}
+
+    @staticmethod
+    def _attach_positions(rows, positions: Dict[int, List[Dict[str, Any]]]):
+        if isinstance(rows, ProductColumns):
+            return rows.attach_positions(positions)
+        for row in rows:
+            row["queries"] = positions.get(row["nm_id"], [])
+        return rows
+
+    @staticmethod
+    def _search_positions(items: List[Dict]) -> Dict[int, int]:
+        """nm_id -> позиция (с 1) в выдаче API-поиска: по ней предсказываем страницу search.aspx."""
+        return {it["id"]: pos for pos, it in enumerate(items, start=1) if it.get("id")}
+
+    def _reset_html_counts(self) -> None:
+        self._html_counts = {"html_requests": 0, "html_cache_hits": 0, "html_requests_legacy": 0}
+
+    def _count_html(self, key: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._html_counts[key] = self._html_counts.get(key, 0) + n
+
+    def _begin_run(
+        self,
+        queries: List[str],
+        max_products: Optional[int],
+        max_pages: Optional[int],
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]] = None,
+        max_age: Optional[float] = None,
+    ) -> None:
+        """Сброс счётчиков прогона; с checkpoint — продолжение прерванного прогона с теми же параметрами."""
+        self._reset_html_counts()
+        self._run_started = time.perf_counter()
+        self._incomplete = []
+        self._wh_stocks = {}
+        self._region_detail = {}
+        self._run = None
+        if self.checkpoint is not None:
+            params: Dict[str, Any] = {
+                "queries": sorted(queries),
+                "max_products": max_products,
+                "max_pages": max_pages,
+                "geo": self._geo_params(),
+            }
+            if self.regions:
+                params["regions"] = [g["dest"] for g in self.regions]
+            # полный и инкрементальный обходы не продолжают друг друга; сам known в ключ не входит —
+            # после частичной записи он уже другой, а продолжить надо
+            if known is not None:
+                params["incremental"] = {"max_age": max_age}
+            if self.run_id is not None:
+                params["run_id"] = self.run_id
+            self._run = self.checkpoint.run(params)
+            if self._run.resumed:
+                logger.info("Продолжаем прерванный обход (checkpoint %s)", self._run.key)
+
+    def _mark_incomplete(self, what: str) -> None:
+        """Что-то не скачалось: чекпоинт не удаляем, следующий прогон докачает."""
+        with self._stats_lock:
+            self._incomplete.append(what)
+
+    def _finish_run(self, stats: Dict[str, int]) -> Dict[str, int]:
+        """Итог прогона: сводка + HTML-счётчики + чекпоинт (удаляем, если всё скачалось)."""
+        stats = {**stats, **self._html_counts, "incomplete": len(self._incomplete)}
+        if metrics.ENABLED:
+            metrics.observe_stage("run", time.perf_counter() - self._run_started)
+        run, self._run = self._run, None
+        if run is not None:
+            stats["resumed"] = int(run.resumed)
+            stats.update({f"replayed_{k}": v for k, v in run.replayed.items()})
+            if not self._incomplete:
+                run.finish()
+        if self._incomplete:
+            logger.warning("Обход неполный: %s", ", ".join(self._incomplete[:10]))
+        return stats
+
+    def _html_cache_key(self, query: str, page: int) -> Tuple:
+        return (query, page, tuple(sorted(self._geo_params().items())))
+
+    def _known_html_cards(self, query: str, page: int) -> Optional[Dict[int, Dict[str, Any]]]:
+        """Страница, уже разобранная в этом прогоне (чекпоинт) или недавно (кэш)."""
+        if self._run is not None:
+            cards = self._run.html_page(query, page)
+            if cards is not None:
+                return cards
+        return self._cached_html_cards(query, page)
+
+    def _cached_html_cards(self, query: str, page: int) -> Optional[Dict[int, Dict[str, Any]]]:
+        if self.html_cache_ttl <= 0:
+            return None
+        cards = _html_page_cache.get(self._html_cache_key(query, page))
+        if cards is None:
+            return None
+        self._count_html("html_cache_hits")
+        # _merge_html_cards дописывает в мету page — отдаём копию
+        return {k: dict(v) for k, v in cards.items()}
+
+    def _parse_html_page(self, query: str, page: int, html: str) -> Dict[int, Dict[str, Any]]:
+        with metrics.stage("html_extract", page=page):
+            cards = self._extract_cards_from_html(html)
+        if self._run is not None:
+            self._run.save_html_page(query, page, cards)
+        if self.html_cache_ttl > 0:
+            _html_page_cache.set(
+                self._html_cache_key(query, page), {k: dict(v) for k, v in cards.items()}, self.html_cache_ttl
+            )
+        return cards
+
+    @staticmethod
+    def _row_order(meta: Dict[str, Any]) -> Tuple:
+        """Порядок строк результата: по странице search.aspx и индексу карточки, без меты — в конце."""
+        page = meta.get("page")
+        idx = meta.get("index")
+        page = page if isinstance(page, int) else None
+        idx = idx if isinstance(idx, int) else None
+        return (page is None, page if page is not None else 10**9, idx is None, idx if idx is not None else 10**9)
+
+    def _build_rows(
+        self,
+        items: List[Dict],
+        id2stock: Dict[int, int],
+        id2price: Dict[int, int],
+        html_meta: Dict[int, Dict[str, Any]],
+        out=None,
+    ):
+        """
+        Сводим поиск, detail и HTML-мету в итоговые строки (общая часть sync/async).
+        out — куда складывать: список (по умолчанию) или ProductColumns.
+        """
+        out = [] if out is None else out
+        order = sorted(items, key=lambda it: self._row_order(html_meta.get(int(it.get("id", 0) or 0), {})))
+        for it in order:
+            out.append(self._build_row(it, id2stock, id2price, html_meta))
+        return out
+
+    def _build_row(
+        self,
+        it: Dict,
+        id2stock: Dict[int, int],
+        id2price: Dict[int, int],
+        html_meta: Dict[int, Dict[str, Any]],
+    ) -> Dict:
+        pid = int(it.get("id", 0) or 0)
+        name = (it.get("name") or "").strip()
+        brand = it.get("brand") or it.get("brandName")
+
+        raw_rating = it.get("reviewRating")
+        if raw_rating is None:
+            raw_rating = it.get("rating")
+        if raw_rating is None:
+            raw_rating = it.get("supplierRating")
+        try:
+            rating = float(raw_rating or 0.0)
+            if rating > 5:
+                rating = rating / 10.0
+            rating = round(rating, 1)
+        except Exception:
+            rating = 0.0
+
+        review_count = int(it.get("feedbacks") or it.get("feedbackCount") or 0)
+
+        price_u = it.get("promoPriceU") or it.get("salePriceU") or it.get("priceU") or 0
+        price_api = (price_u or 0) // 100
+
+        if pid in id2price:
+            price_api = min(price_api, id2price[pid]) if price_api else id2price[pid]
+
+        # нет в detail — остаток неизвестен: None, а не 0 (upsert оставит прежний)
+        stock = id2stock.get(pid)
+
+        meta = html_meta.get(pid, {})
+        wallet_price = meta.get("wallet_price")
+        idx = meta.get("index")
+        page = meta.get("page")
+
+        price_final = wallet_price if isinstance(wallet_price, int) and wallet_price > 0 else price_api
+
+        row = {
+            "nm_id": pid,
+            "name": name,
+            "brand": brand,
+            "price_api": int(price_api or 0),
+            "price_wallet": int(wallet_price) if wallet_price is not None else None,
+            "price_final": int(price_final or 0),
+            "rating": rating,
+            "review_count": review_count,
+            "stock": int(stock) if stock is not None else None,
+            # [(wh, размер, qty), ...]; сумма qty = stock
+            "stocks": self._wh_stocks.pop(pid, None) if stock is not None else None,
+            # без detail товар не считается перепроверенным — инкрементальный режим вернётся к нему
+            "fingerprint": self.fingerprint(it) if stock is not None else None,
+            "data_card_index": idx if isinstance(idx, int) else None,
+            "page": int(page) if isinstance(page, int) else None,
+        }
+        if self.regions:
+            row["regions"] = self._region_rows(pid, stock, id2price.get(pid))
+        return row
+
+    def _region_rows(self, pid: int, stock: Optional[int], price: Optional[int]) -> Optional[list]:
+        """[(dest, цена, остаток), ...]: основной регион (цена и остаток из его detail), затем доп."""
+        by_dest = self._region_detail.pop(pid, {})
+        if stock is None:
+            return None
+        out = [(self.geo.get("dest"), price, stock)]
+        for geo in self.regions:
+            got = by_dest.get(geo["dest"])
+            if got is not None:
+                out.append((geo["dest"], *got))
+        return out
+
+    def _rebase(self, base: str) -> None:
+        """
+        URL эндпоинтов этого парсера: тот же путь, но хост из base. TTL http_cache
+        заданы по хостам WB, поэтому для перенесённых URL запоминаем исходные.
+        """
+        base = base.rstrip("/")
+        orig = [*self.SEARCH_URLS, *self.DETAIL_URLS, self.SEARCH_HTML_URL, self.GEO_URL]
+        self.SEARCH_URLS = [base + urlsplit(u).path for u in self.SEARCH_URLS]
+        self.DETAIL_URLS = [base + urlsplit(u).path for u in self.DETAIL_URLS]
+        self.SEARCH_HTML_URL = base + urlsplit(self.SEARCH_HTML_URL).path
+        self.GEO_URL = base + urlsplit(self.GEO_URL).path
+        new = [*self.SEARCH_URLS, *self.DETAIL_URLS, self.SEARCH_HTML_URL, self.GEO_URL]
+        self._ttl_urls = dict(zip(new, orig))
+
+    def _report(self, stage: str, n: int = 1) -> None:
+        if self.on_progress is not None:
+            self.on_progress(stage, n)
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """
+        GET через лимитер хоста: ждём токен, потом сообщаем ему статус ответа.
+        С http_cache свежий ответ берётся из кэша без запроса, устаревший — перепроверяется.
+        """
+        ttl, key, entry = self._cache_lookup(url, kwargs.get("params"))
+        if entry is not None and entry.fresh:
+            if metrics.ENABLED:
+                metrics.request(url, "cache")
+            return self._cached_response(entry)
+        if entry is not None:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), **entry.validators()}
+
+        host = urlsplit(url).hostname or ""
+        self.rate_limiter.acquire(host)
+        kwargs.setdefault("timeout", self.timeout)
+        t = time.perf_counter()
+        try:
+            r = self.transport.get(url, **kwargs)
+        except Exception:
+            self.rate_limiter.feedback(host, None)
+            if metrics.ENABLED:
+                metrics.request(url, "error", time.perf_counter() - t)
+            raise
+        elapsed = time.perf_counter() - t
+        self.health.latency(url, elapsed)
+        if metrics.ENABLED:
+            metrics.request(url, r.status_code, elapsed)
+        self.rate_limiter.feedback(host, r.status_code, r.headers.get("Retry-After"))
+        if ttl is not None and self._cache_store(ttl, key, entry, url, r.status_code, r.content, r.headers):
+            return self._cached_response(entry)
+        return r
+
+    def _cache_lookup(
+        self, url: str, params: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[float], Optional[str], Optional[CachedResponse]]:
+        """(ttl, ключ, запись) для запроса; ttl=None — эндпоинт не кэшируется."""
+        cache = self.http_cache
+        ttl = cache.ttl_for(self._ttl_urls.get(url, url)) if cache is not None else None
+        if ttl is None:
+            return None, None, None
+        key = cache.key(url, params, self._geo_params())
+        return ttl, key, cache.get(key)
+
+    def _cache_store(
+        self,
+        ttl: float,
+        key: str,
+        entry: Optional[CachedResponse],
+        url: str,
+        status: int,
+        body: bytes,
+        headers,
+    ) -> bool:
+        """Учитываем ответ сети в кэше. True — это 304, и надо отдать тело из entry."""
+        if status == 304 and entry is not None:
+            self.http_cache.revalidated(entry, ttl)
+            return True
+        self.http_cache.miss()
+        if status == 200:
+            self.http_cache.put(key, url, body, headers, ttl)
+        return False
+
+    @staticmethod
+    def _cached_response(entry: CachedResponse) -> requests.Response:
+        r = requests.Response()
+        r.status_code = 200
+        r._content = entry.body
+        r.headers.update(entry.headers)
+        r.url = entry.url
+        r.encoding = "utf-8"
+        return r
+
     def _load_user_agent(self, ua_path: Optional[str]) -> str:
         default = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
-        if not ua_path or not os.path.exists(ua_path):
+        if not ua_path:
             return default
         try:
-            with open(ua_path, "r", encoding="utf-8") as f:
-                lines = [ln.strip() for ln in f if ln.strip()]
-            if lines:
-                logger.info("UA loaded from ua.txt")
-                return lines[0]
+            return _ua_files.get(ua_path)[1] or default
         except Exception as e:
             logger.warning("UA load failed: %s", e)
         return default
 
     def _load_cookies(self, path: str):
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, dict):
-                data = [data]
-            cnt = 0
-            for c in data:
-                if "wildberries.ru" not in (c.get("domain") or ""):
-                    continue
-                name = c.get("name")
-                value = c.get("value")
-                if not name or value is None:
-                    continue
-                cookie = requests.cookies.create_cookie(
-                    name=name,
-                    value=str(value),
-                    domain=c.get("domain") or ".wildberries.ru",
-                    path=c.get("path", "/"),
-                    secure=bool(c.get("secure", False)),
-                )
-                self.session.cookies.set_cookie(cookie)
-                cnt += 1
-            logger.info("Загружены cookies: %d шт из %s", cnt, path)
+            stamp, data = _cookie_files.get(path)
         except Exception as e:
             logger.warning("Не удалось загрузить cookies из %s: %s", path, e)
+            # битый файл не перечитываем на каждом refresh() — только когда его поправят
+            self._cookies_stamp = FileCache.stamp(path)
+            return
+        self._cookies_stamp = stamp
+        for c in data or ():
+            cookie = requests.cookies.create_cookie(
+                name=c["name"],
+                value=str(c["value"]),
+                domain=c.get("domain") or ".wildberries.ru",
+                path=c.get("path", "/"),
+                secure=bool(c.get("secure", False)),
+            )
+            self.session.cookies.set_cookie(cookie)
+
+    def _reload_cookies(self) -> bool:
+        """Файл cookies изменился с последней загрузки — перечитать; удалённый файл cookies не сбрасывает."""
+        if not self.cookies_path or FileCache.stamp(self.cookies_path) in (None, self._cookies_stamp):
+            return False
+        self._load_cookies(self.cookies_path)
+        return True
+
+    def _fetch_geo(self, address: str) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        (geo-параметры, сырой X-Info) для адреса; ошибки сети и ответа пробрасываются (и не кэшируются).
+        Удачный ответ живёт в _geo_cache GEO_CACHE_TTL секунд.
+        """
+        key = (self.GEO_URL, address)
+        cached = _geo_cache.get(key)
+        if cached is not None:
+            return dict(cached[0]), cached[1]
+        r = self._get(self.GEO_URL, params={"address": address})
+        r.raise_for_status()
+        data = r.json() or {}
+        xinfo = data.get("xinfo", "") or ""
+
+        geo: Dict[str, Any] = {}
+        for part in xinfo.split("&"):
+            if "=" in part:
+                k, v = part.split("=", 1)
+                if v != "":
+                    geo[k] = int(v) if v.lstrip("-").isdigit() else v
+        if "dest" not in geo:
+            geo["dest"] = -1257786
+        if "spp" not in geo:
+            geo["spp"] = 0
+        _geo_cache.set(key, (dict(geo), xinfo or None), GEO_CACHE_TTL)
+        return geo, xinfo or None
 
     def _get_geo_info_via_xinfo(self, address: str = "Москва") -> Dict[str, Any]:
-        url = "https://user-geo-data.wildberries.ru/get-geo-info"
         try:
-            r = self.session.get(url, params={"address": address}, timeout=self.timeout)
-            r.raise_for_status()
-            data = r.json() or {}
-            xinfo = data.get("xinfo", "") or ""
-            self.xinfo_raw = xinfo or None
-
-            geo: Dict[str, Any] = {}
-            for part in xinfo.split("&"):
-                if "=" in part:
-                    k, v = part.split("=", 1)
-                    if v != "":
-                        geo[k] = int(v) if v.lstrip("-").isdigit() else v
-            if "dest" not in geo:
-                geo["dest"] = -1257786
-            if "spp" not in geo:
-                geo["spp"] = 0
+            geo, self.xinfo_raw = self._fetch_geo(address)
             return geo
         except Exception as e:
             logger.warning("Не удалось получить geo-info via xinfo: %s", e)
             return {"dest": -1257786, "spp": 0}
 
+    def _region_geo(self, region: Union[str, int]) -> Optional[Dict[str, Any]]:
+        """dest (число) берём как есть, адрес — через get-geo-info; None — адрес не разрешился."""
+        region = str(region).strip()
+        if region.lstrip("-").isdigit():
+            return {"dest": int(region), "spp": self.geo.get("spp", 0)}
+        try:
+            return self._fetch_geo(region)[0]
+        except Exception as e:
+            logger.warning("Регион %r пропущен: не удалось получить geo-info: %s", region, e)
+            return None
+
+    def _resolve_regions(self, regions: List[Union[str, int]]) -> List[Dict[str, Any]]:
+        """
+        Адреса и dest -> geo-параметры доп. регионов. Разрешаются один раз на экземпляр
+        (параллельно), повторы по dest и основной регион отбрасываются.
+        """
+        if not regions:
+            return []
+        with ThreadPoolExecutor(max_workers=min(8, len(regions))) as ex:
+            geos = list(ex.map(self._region_geo, regions))
+        out: List[Dict[str, Any]] = []
+        seen = {self.geo.get("dest")}
+        for geo in geos:
+            if geo is not None and geo["dest"] not in seen:
+                seen.add(geo["dest"])
+                out.append(geo)
+        if out:
+            logger.info("Доп. регионы: %s", ", ".join(str(g["dest"]) for g in out))
+        return out
+
+    def _geo_params(self, geo: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Гео-параметры запроса: основной регион или geo доп. региона."""
+        return {k: v for k, v in (geo or self.geo).items() if isinstance(v, (str, int))}
+
+    @staticmethod
+    def _search_per_page(limit: Optional[int]) -> int:
+        if limit is None or limit > 300:
+            return 300
+        return min(max(10, limit), 300)
+
+    def _search_params(self, query: str, page: int, per_page: int) -> Dict[str, Any]:
+        return {
+            "resultset": "catalog",
+            "page": page,
+            "limit": per_page,
+            "query": query,
+            "sort": "popular",
+            "appType": 1,
+            "curr": "rub",
+            "locale": "ru",
+            **self._geo_params(),
+        }
+
+    @staticmethod
+    def _search_products(data: Dict) -> List[Dict]:
+        products = ((data or {}).get("data") or {}).get("products") or []
+        return [WBApiParser._slim_product(p) for p in products]
+
+    @staticmethod
+    def _slim_product(p: Dict) -> Dict:
+        """
+        Из товара поиска оставляем только поля, нужные _build_row, и готовый отпечаток ("_fp"):
+        вложенные sizes/colors/... не живут до конца прогона (и не пишутся в чекпоинт).
+        """
+        out = {k: p[k] for k in SEARCH_FIELDS if k in p}
+        for k in ("name", "brand", "brandName"):
+            if isinstance(out.get(k), str):
+                out[k] = sys.intern(out[k])
+        out["_fp"] = WBApiParser.fingerprint(p)
+        return out
+
     def _search(self, query: str, limit: Optional[int], max_pages: Optional[int]) -> List[Dict]:
+        """Вся выдача поиска одним списком (см. _search_pages)."""
+        return [p for page_items in self._search_pages(query, limit, max_pages) for p in page_items]
+
+    def _search_pages(self, query: str, limit: Optional[int], max_pages: Optional[int]) -> Iterator[List[Dict]]:
         """
-        Идём постранично, пока:
+        Идём постранично и отдаём новые товары каждой страницы, пока:
           - не кончатся товары,
           - не достигнем max_pages (если задан),
           - не наберём limit (если задан).
         """
-        all_items: List[Dict] = []
         seen_ids: set[int] = set()
+        total = 0
         page = 1
-
-        if limit is None or limit > 300:
-            per_page = 300
-        else:
-            per_page = min(max(10, limit), 300)
+        per_page = self._search_per_page(limit)
 
         while True:
             if max_pages is not None and page > max_pages:
-                break
+                return
 
-            got = None
+            got = self._run.search_page(query, page) if self._run is not None else None
             last_err = None
-            for url in self.SEARCH_URLS:
-                params = {
-                    "resultset": "catalog",
-                    "page": page,
-                    "limit": per_page,
-                    "query": query,
-                    "sort": "popular",
-                    "appType": 1,
-                    "curr": "rub",
-                    "locale": "ru",
-                    **{k: v for k, v in self.geo.items() if isinstance(v, (str, int))},
-                }
-                try:
-                    r = self.session.get(url, params=params, timeout=self.timeout)
-                    r.raise_for_status()
-                    data = r.json() or {}
-                    products = (data.get("data") or {}).get("products") or []
-                    if products:
-                        got = products
-                        break
-                except Exception as e:
-                    last_err = e
-                    continue
+            answered = got is not None
+            if got is None:
+                with metrics.stage("search_page", query=query, page=page):
+                    empty: List[str] = []
+                    for url in self.health.order(self.SEARCH_URLS):
+                        params = self._search_params(query, page, per_page)
+                        try:
+                            r = self._get(url, params=params)
+                            r.raise_for_status()
+                            answered = True
+                            products = self._search_products(r.json())
+                        except Exception as e:
+                            last_err = e
+                            self._endpoint_failed(url, e)
+                            continue
+                        if products:
+                            got = products
+                            self.health.success(url)
+                            self._save_search_page(query, page, got)
+                            break
+                        empty.append(url)
+                    self._settle_empty(empty, bool(got))
 
             if not got:
+                if not answered:
+                    self._mark_incomplete(f"search {query!r} page {page}")
                 logger.info("Страниц больше нет (page=%d, last_err=%s).", page, str(last_err))
-                break
+                return
 
+            self._report("search_pages")
+            fresh: List[Dict] = []
             for p in got:
                 pid = p.get("id")
                 if isinstance(pid, int) and pid not in seen_ids:
                     seen_ids.add(pid)
-                    all_items.append(p)
-                    if limit is not None and len(all_items) >= limit:
-                        return all_items
+                    fresh.append(p)
+                    total += 1
+                    if limit is not None and total >= limit:
+                        yield fresh
+                        return
+            yield fresh
 
             if len(got) < per_page:
-                break
+                return
 
             page += 1
-            time.sleep(0.25)  
-        return all_items
+
+    def _endpoint_failed(self, url: str, err: Exception) -> None:
+        """
+        Сбой запроса — в реестр живости; 429/498 не в счёт (их разбирает лимитер).
+        503 считается: лимитер на него тоже притормаживает, но повторяющийся 503 —
+        лежащий эндпоинт, и его надо выключить, а не долбить.
+        """
+        status = getattr(getattr(err, "response", None), "status_code", None)
+        if status not in RATE_LIMIT_STATUSES:
+            self.health.failure(url, err)
+
+    def _settle_empty(self, empty: List[str], got: bool) -> None:
+        """Пустая выдача — неудача эндпоинта, только если другой URL на тот же запрос дал товары."""
+        for url in empty:
+            if got:
+                self.health.failure(url, "empty response")
+            else:
+                self.health.success(url)
+
+    def _save_search_page(self, query: str, page: int, products: List[Dict]) -> None:
+        if self._run is not None:
+            self._run.save_search_page(query, page, products)
+
+    def _detail_from_checkpoint(self, ids: List[int], id2stock: Dict[int, int], id2price: Dict[int, int]) -> List[int]:
+        """Переносим из чекпоинта уже полученный detail; возвращаем id, которые ещё надо запросить."""
+        if self._run is None or not ids:
+            return ids
+        done = self._run.detail(ids)
+        for pid, (stock, price, stocks, regions) in done.items():
+            if stock is not None:
+                id2stock[pid] = stock
+            if stocks is not None:
+                self._wh_stocks[pid] = stocks
+            if regions:
+                self._region_detail[pid] = {dest: (p, st) for dest, p, st in regions}
+            if price is not None:
+                id2price[pid] = price
+        return [i for i in ids if i not in done]
+
+    def _save_detail_batch(self, batch: List[int], id2stock: Dict[int, int], id2price: Dict[int, int]) -> None:
+        if self._run is not None:
+            rows = []
+            for pid in batch:
+                by_dest = self._region_detail.get(pid)
+                regions = [(dest, p, st) for dest, (p, st) in by_dest.items()] if by_dest else None
+                rows.append((pid, id2stock.get(pid), id2price.get(pid), self._wh_stocks.get(pid), regions))
+            self._run.save_detail(rows)
+
+    def _finish_detail_batch(
+        self, batch: List[int], ok: bool, id2stock: Dict[int, int], id2price: Dict[int, int],
+    ) -> None:
+        """
+        Итог detail-партии (sync/async): в чекпоинт — только если ответили основной
+        и все доп. регионы, иначе партия будет докачана следующим прогоном.
+        """
+        if ok:
+            self._save_detail_batch(batch, id2stock, id2price)
+        else:
+            self._mark_incomplete(f"detail batch of {len(batch)}")
+        self._report("detail_batches")
+
+    def _store_region_detail(self, geo: Dict[str, Any], id2stock: Dict[int, int], id2price: Dict[int, int]) -> None:
+        dest = geo["dest"]
+        with self._stats_lock:
+            for pid, stock in id2stock.items():
+                self._region_detail.setdefault(pid, {})[dest] = (id2price.get(pid), stock)
+
+    def _detail_params(self, url: str, batch: List[int], geo: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        params = {
+            "appType": 1,
+            "curr": "rub",
+            "nm": ";".join(map(str, batch)),
+            **self._geo_params(geo),
+        }
+        if url.endswith("/cards/detail"):
+            params.update({"reg": 0, "emp": 0, "locale": "ru", "lang": "ru", "pricemarginCoeff": 1.0})
+        return params
+
+    def _apply_detail_payload(
+        self, data: Dict, id2stock: Dict[int, int], id2price: Dict[int, int], warehouses: bool = True,
+    ) -> None:
+        """
+        Раскладываем ответ card.wb.ru по id2stock / id2price (WB_DETAIL_NUMPY=1 — через NumPy).
+        Разбивка остатка по складам и размерам копится в self._wh_stocks до сборки строки
+        (warehouses=False — не нужна: ответ доп. региона).
+        """
+        id2wh = self._wh_stocks if warehouses else None
+        if self.detail_numpy:
+            apply_detail_payload_np(data, id2stock, id2price, id2wh)
+        else:
+            apply_detail_payload(data, id2stock, id2price, id2wh)
 
     def _detail_info(self, ids: List[int]) -> Tuple[Dict[int, int], Dict[int, int]]:
         id2stock: Dict[int, int] = {}
         id2price: Dict[int, int] = {}
+        ids = self._detail_from_checkpoint(ids, id2stock, id2price)
         if not ids:
             return id2stock, id2price
 
-        for i in range(0, len(ids), 100):
-            batch = ids[i:i + 100]
-            base_params = {
-                "appType": 1,
-                "curr": "rub",
-                "nm": ";".join(map(str, batch)),
-                **{k: v for k, v in self.geo.items() if isinstance(v, (str, int))},
-            }
-            success = False
-            for url in self.DETAIL_URLS:
-                params = dict(base_params)
-                if url.endswith("/cards/detail"):
-                    params.update({"reg": 0, "emp": 0, "locale": "ru", "lang": "ru", "pricemarginCoeff": 1.0})
-                for attempt in range(3):
-                    try:
-                        r = self.session.get(url, params=params, timeout=self.timeout)
-                        if r.status_code in (429, 503):
-                            time.sleep(0.5 * (attempt + 1))
-                            continue
-                        r.raise_for_status()
-                        data = r.json() or {}
-                        d = data.get("data")
-                        if isinstance(d, dict):
-                            products = d.get("products") or []
-                        elif isinstance(d, list):
-                            products = d
-                        else:
-                            products = []
-                        for p in products:
-                            pid = p.get("id")
-                            total_stock = 0
-                            price_candidates_u: List[int] = []
-
-                            for key in ("promoPriceU", "salePriceU", "priceU"):
-                                v = p.get(key)
-                                if isinstance(v, int) and v > 0:
-                                    price_candidates_u.append(v)
-
-                            for size in (p.get("sizes") or []):
-                                for st in (size.get("stocks") or []):
-                                    qty = st.get("qty")
-                                    if isinstance(qty, int):
-                                        total_stock += qty
-                                po = size.get("price") or {}
-                                for k in ("product", "basic", "total"):
-                                    v = po.get(k)
-                                    if isinstance(v, int) and v > 0:
-                                        price_candidates_u.append(v)
-
-                            if pid:
-                                id2stock[pid] = total_stock
-                                if price_candidates_u:
-                                    id2price[pid] = min(price_candidates_u) // 100
-                        logger.info("stocks/price batch ok via %s (%d ids)", url, len(batch))
-                        success = True
-                        break
-                    except requests.HTTPError as e:
-                        logger.warning("Ошибка detail для партии %s на %s: %s", batch, url, e)
-                        time.sleep(0.4 * (attempt + 1))
-                    except Exception as e:
-                        logger.warning("Сбой detail для партии %s на %s: %s", batch, url, e)
-                        time.sleep(0.4 * (attempt + 1))
-                if success:
-                    break
-            if not success:
-                logger.warning("Не удалось получить detail ни по одному URL для партии %s", batch)
-            time.sleep(0.2)
+        # доп. регионы качаются в потоках одновременно с основным, через общую сессию
+        with ThreadPoolExecutor(max_workers=max(1, len(self.regions))) as ex:
+            for i in range(0, len(ids), 100):
+                batch = ids[i:i + 100]
+                with metrics.stage("detail_batch", ids=len(batch)):
+                    regional = [ex.submit(self._region_detail_batch, batch, geo) for geo in self.regions]
+                    ok = self._detail_batch(batch, id2stock, id2price)
+                    ok = all([f.result() for f in regional]) and ok
+                    self._finish_detail_batch(batch, ok, id2stock, id2price)
         return id2stock, id2price
 
-    def _collect_html_meta_for_ids(self, query: str, target_ids: List[int], per_page: int = 100, max_pages: int = 50) -> Dict[int, Dict[str, Any]]:
-        needed = set(int(x) for x in target_ids)
-        if not needed:
-            return {}
+    def _region_detail_batch(self, batch: List[int], geo: Dict[str, Any]) -> bool:
+        id2stock: Dict[int, int] = {}
+        id2price: Dict[int, int] = {}
+        ok = self._detail_batch(batch, id2stock, id2price, geo)
+        if ok:
+            self._store_region_detail(geo, id2stock, id2price)
+        return ok
 
-        result: Dict[int, Dict[str, Any]] = {}
-        page = 1
-        while needed and page <= max_pages:
-            params = {"search": query, "page": page}
+    def _detail_batch(
+        self,
+        batch: List[int],
+        id2stock: Dict[int, int],
+        id2price: Dict[int, int],
+        geo: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """Партия detail по DETAIL_URLS, по 3 попытки на URL; geo — доп. регион (иначе основной)."""
+        where = f" dest={geo['dest']}" if geo is not None else ""
+        for url in self.health.order(self.DETAIL_URLS):
+            params = self._detail_params(url, batch, geo)
+            for attempt in range(3):
+                try:
+                    r = self._get(url, params=params)
+                    if r.status_code in RATE_LIMIT_STATUSES:
+                        # паузу перед повтором выдержит лимитер (AIMD + Retry-After);
+                        # 503 идёт дальше в raise_for_status — это и неудача эндпоинта
+                        continue
+                    r.raise_for_status()
+                    self._apply_detail_payload(r.json(), id2stock, id2price, warehouses=geo is None)
+                    self.health.success(url)
+                    logger.info("stocks/price batch ok via %s (%d ids)%s", url, len(batch), where)
+                    return True
+                except requests.HTTPError as e:
+                    self._endpoint_failed(url, e)
+                    logger.warning("Ошибка detail для партии %s на %s%s: %s", batch, url, where, e)
+                except Exception as e:
+                    self._endpoint_failed(url, e)
+                    logger.warning("Сбой detail для партии %s на %s%s: %s", batch, url, where, e)
+                if not self.health.available(url):
+                    # эндпоинт выключен — сразу к следующему URL
+                    break
+                # паузу выдержит следующий acquire: её видят и другие потоки/процессы этого хоста
+                self.rate_limiter.penalty(urlsplit(url).hostname or "", ERROR_BACKOFF * (attempt + 1))
+        logger.warning("Не удалось получить detail ни по одному URL для партии %s%s", batch, where)
+        return False
+
+    def _fetch_html_cards(self, query: str, page: int) -> Optional[Dict[int, Dict[str, Any]]]:
+        """Карточки страницы search.aspx (из чекпоинта, кэша или сети); None — не удалось скачать."""
+        cards = self._known_html_cards(query, page)
+        if cards is not None:
+            return cards
+        params = {"search": query, "page": page}
+        with metrics.stage("html_page", page=page):
             try:
-                r = self.session.get(
-                    self.SEARCH_HTML_URL,
-                    params=params,
-                    timeout=self.timeout,
-                    headers=self.html_headers,
-                )
-                if r.status_code in (429, 498, 503):
-                    time.sleep(0.4)
-                    r = self.session.get(
-                        self.SEARCH_HTML_URL,
-                        params=params,
-                        timeout=self.timeout,
-                        headers=self.html_headers,
-                    )
+                self._count_html("html_requests")
+                r = self._get(self.SEARCH_HTML_URL, params=params, headers=self.html_headers)
+                if r.status_code in THROTTLE_STATUSES:
+                    self._count_html("html_requests")
+                    r = self._get(self.SEARCH_HTML_URL, params=params, headers=self.html_headers)
                 r.raise_for_status()
             except Exception as e:
+                # HTML-мета необязательна: из-за неё чекпоинт не держим, иначе следующий
+                # прогон взял бы из него устаревшие страницы поиска и detail
+                self._count_html("html_failed")
                 logger.warning("HTML page %d fetch failed: %s", page, e)
-                break
-
-            cards = self._extract_cards_from_html(r.text)
-            for nm_id, meta in cards.items():
-                if nm_id in needed:
-                    meta["page"] = page
-                    result[nm_id] = meta
-                    needed.discard(nm_id)
-
-            if not cards:
+                return None
+        return self._parse_html_page(query, page, r.text)
 
-                break
+    def _collect_html_meta_for_ids(
+        self,
+        query: str,
+        target_ids: List[int],
+        max_pages: int = 50,
+        positions: Optional[Dict[int, int]] = None,
+        total: Optional[int] = None,
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Ищем target_ids на страницах search.aspx. positions (nm_id -> позиция в API-поиске)
+        предсказывают страницу каждого id, и качаются только нужные страницы —
+        параллельно, до html_concurrency за раз (см. _HtmlPagePlan). total — сколько
+        товаров вернул поиск: по нему оценивается, сколько страниц прошёл бы прежний обход
+        (None — оценку считает вызывающий, как iter_parse по всему запросу).
+        """
+        needed = set(int(x) for x in target_ids)
+        result: Dict[int, Dict[str, Any]] = {}
+        if not needed:
+            return result
 
-            page += 1
-            time.sleep(0.15)
+        plan = _HtmlPagePlan(needed, positions or {}, max_pages, self.html_concurrency)
+        with ThreadPoolExecutor(max_workers=max(1, self.html_concurrency)) as ex:
+            while needed:
+                pages = plan.next_pages()
+                if not pages:
+                    break
+                for p, cards in zip(pages, ex.map(lambda p: self._fetch_html_cards(query, p), pages)):
+                    plan.mark(p, cards)
+                    if cards is not None:
+                        self._report("html_pages")
+                        self._merge_html_cards(cards, p, needed, result)
 
+        if total is not None:
+            self._count_html("html_requests_legacy", plan.legacy_pages(result, total))
         return result
 
+    @staticmethod
+    def _merge_html_cards(
+        cards: Dict[int, Dict[str, Any]],
+        page: int,
+        needed: set,
+        result: Dict[int, Dict[str, Any]],
+    ) -> bool:
+        """Переносим найденные на странице карточки в result. False — страница пустая, дальше идти незачем."""
+        for nm_id, meta in cards.items():
+            if nm_id in needed:
+                meta["page"] = page
+                result[nm_id] = meta
+                needed.discard(nm_id)
+        return bool(cards)
+
     def _extract_cards_from_html(self, html: str) -> Dict[int, Dict[str, Any]]:
         """
         Достаём nm_id, data-card-index (из атрибутов <article ...>)
         и wallet_price (из блока цены). Если верстка другая —
         дольём данные из window.__WBSTATE__.
+
+        Один проход по <article> (_iter_articles): атрибуты разбираются одним
+        комбинированным регэкспом, цена ищется внутри блока без копирования (pos/endpos).
+        Запасной поиск цены по class="...price..." сделан линейным: первый
+        такой атрибут -> первый '>' после него -> первая валюта.
         """
         out: Dict[int, Dict[str, Any]] = {}
 
-        article_re = re.compile(
-            r'<article\b([^>]*)>(.*?)</article>',
-            flags=re.S | re.I
-        )
+        for attrs_str, start, end in _iter_articles(html):
+            found: Dict[str, int] = {}
+            for ma in _CARD_ATTR_RE.finditer(attrs_str):
+                name = ma.group(1).lower()
+                if name in found or bool(ma.group(2)) != (name == "id"):
+                    continue
+                found[name] = int(ma.group(3))
 
-        for m in article_re.finditer(html):
-            attrs_str = m.group(1) or ""
-            block = m.group(2) or ""
-
-            nm_id = None
-            for pat in (
-                r'(?:\s|^)data-nm-id\s*=\s*"(\d+)"',
-                r'(?:\s|^)data-id\s*=\s*"(\d+)"',
-                r'(?:\s|^)id\s*=\s*"c(\d+)"',
-            ):
-                mi = re.search(pat, attrs_str, flags=re.I)
-                if mi:
-                    try:
-                        nm_id = int(mi.group(1))
-                        break
-                    except Exception:
-                        pass
+            nm_id = next((found[k] for k in _NM_ID_ATTRS if k in found), None)
             if not nm_id:
                 continue
-
-            idx = None
-            for pat in (
-                r'(?:\s|^)data-card-index\s*=\s*"(\d+)"',
-                r'(?:\s|^)data-card-idx\s*=\s*"(\d+)"',
-                r'(?:\s|^)data-index\s*=\s*"(\d+)"',
-            ):
-                mi = re.search(pat, attrs_str, flags=re.I)
-                if mi:
-                    try:
-                        idx = int(mi.group(1))
-                        break
-                    except Exception:
-                        pass
+            idx = next((found[k] for k in _INDEX_ATTRS if k in found), None)
 
             price = None
-            m_price = re.search(
-                r'<(?:ins|span)\b[^>]*class="[^"]*price__lower-price[^"]*"[^>]*>([\s\S]*?)</(?:ins|span)>',
-                block, flags=re.I
-            )
-            if not m_price:
-                m_price = re.search(
-                    r'class="[^"]*price[^"]*"[\s\S]*?>([\s\S]*?)(?:₽|руб)',
-                    block, flags=re.I
-                )
-            if m_price:
-                raw = unescape(m_price.group(1))
-                raw_digits = re.sub(r'[^\d]', '', raw)
+            raw = _find_card_price(html, start, end)
+            if raw is not None:
+                raw_digits = _NON_DIGIT_RE.sub('', unescape(raw))
                 if raw_digits.isdigit():
                     try:
                         price = int(raw_digits)
@@ -470,8 +1740,34 @@ class WBApiParser:
         """
         Разбираем window.__WBSTATE__ и вытаскиваем:
           - wallet_price (мин. из promo/sale/basic/total/priceU, делённый на 100)
-          - index (если встречается поблизости)
-        WBSTATE часто не чистый JSON — используем регэкспы.
+          - index (поле index самого товара)
+        Объект разбирается JSON-декодером с того места, где он начинается;
+        не-JSON литерал вырезается с учётом скобок и строк и переводится в JSON (_js_to_json). Цена берётся из того же объекта товара,
+        а не из соседнего. Если состояние не разобралось — старый разбор регэкспами.
+        """
+        state = _decode_wbstate(html)
+        if state is None:
+            return self._extract_from_wbstate_regex(html)
+
+        out: Dict[int, Dict[str, Any]] = {}
+        for nm_id, prices, p in _state_products(state):
+            price = min(prices) // 100
+            idx = p.get("index")
+            if type(idx) is not int:
+                idx = None
+            if nm_id in out:
+                a = out[nm_id].get("wallet_price")
+                out[nm_id]["wallet_price"] = min(a, price) if isinstance(a, int) else price
+                if out[nm_id].get("index") is None and idx is not None:
+                    out[nm_id]["index"] = idx
+            else:
+                out[nm_id] = {"wallet_price": price, "index": idx}
+        return out
+
+    def _extract_from_wbstate_regex(self, html: str) -> Dict[int, Dict[str, Any]]:
+        """
+        Прежний разбор WBSTATE регэкспами — запасной путь, когда состояние не декодируется.
+        Ленивое окно между id и ценой может захватить цену соседнего товара.
         """
         out: Dict[int, Dict[str, Any]] = {}
         m = re.search(r"window\.__WBSTATE__\s*=\s*(\{[\s\S]*?\})\s*;<", html, flags=re.I)
@@ -0,0 +1,522 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from parser import metrics
+from parser.ratelimit import RATE_LIMIT_STATUSES, THROTTLE_STATUSES
+from parser.records import ProductColumns
+from parser.wb_api import ERROR_BACKOFF, INCREMENTAL_MAX_AGE, WBApiParser, _HtmlPagePlan
+
+logger = logging.getLogger("parser.wb_api")
+
+
+async def _then_none(agen: AsyncIterator[List[Dict]]) -> AsyncIterator[Optional[List[Dict]]]:
+    """Элементы agen, а в конце None (как chain(gen, (None,)) в WBApiParser.iter_parse)."""
+    async for x in agen:
+        yield x
+    yield None
+
+
+class AsyncWBApiParser(WBApiParser):
+    """
+    Асинхронный движок поверх WBApiParser: поиск, detail-партии и HTML-страницы
+    идут конвейером. Партия detail (100 id) уходит сразу, как только поиск её набрал,
+    HTML-этап стартует сразу после поиска и идёт параллельно с detail.
+    Результат совпадает с WBApiParser.parse() для тех же ответов.
+
+    host_concurrency — лимит одновременных запросов на хост (search.wb.ru, card.wb.ru, ...),
+    для хостов без явного значения используется concurrency.
+    """
+
+    def __init__(
+        self,
+        *args,
+        concurrency: int = 4,
+        host_concurrency: Optional[Dict[str, int]] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._init_async(concurrency, host_concurrency)
+
+    @classmethod
+    def from_parser(
+        cls,
+        parser: WBApiParser,
+        concurrency: int = 4,
+        host_concurrency: Optional[Dict[str, int]] = None,
+    ) -> "AsyncWBApiParser":
+        """Переиспользуем уже настроенный парсер (cookies, UA, geo) без повторного __init__."""
+        obj = cls.__new__(cls)
+        obj.__dict__.update(parser.__dict__)
+        obj._init_async(concurrency, host_concurrency)
+        return obj
+
+    def _init_async(self, concurrency: int, host_concurrency: Optional[Dict[str, int]]):
+        self.concurrency = max(1, int(concurrency))
+        self.host_concurrency = dict(host_concurrency or {})
+        self._host_sems: Dict[str, asyncio.Semaphore] = {}
+
+    def _sem(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname or ""
+        sem = self._host_sems.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(max(1, int(self.host_concurrency.get(host, self.concurrency))))
+            self._host_sems[host] = sem
+        return sem
+
+    def _client(self):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("engine='async' требует httpx: pip install httpx") from e
+
+        limits = httpx.Limits(
+            max_connections=max([self.concurrency, *self.host_concurrency.values()]) * 4,
+            max_keepalive_connections=max([self.concurrency, *self.host_concurrency.values()]) * 4,
+        )
+        return httpx.AsyncClient(
+            http2=bool(getattr(self.transport, "http2", False)),
+            headers=dict(self.session.headers),
+            cookies=self.session.cookies,
+            timeout=self.timeout,
+            limits=limits,
+            follow_redirects=True,
+        )
+
+    async def _aget(self, client, url: str, params: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        ttl, key, entry = self._cache_lookup(url, params)
+        if entry is not None and entry.fresh:
+            if metrics.ENABLED:
+                metrics.request(url, "cache")
+            return self._acached_response(entry)
+        if entry is not None:
+            headers = {**(headers or {}), **entry.validators()}
+
+        host = urlsplit(url).hostname or ""
+        async with self._sem(url):
+            await self.rate_limiter.aacquire(host)
+            t = time.perf_counter()
+            try:
+                r = await client.get(url, params=params, headers=headers)
+            except Exception:
+                self.rate_limiter.feedback(host, None)
+                if metrics.ENABLED:
+                    metrics.request(url, "error", time.perf_counter() - t)
+                raise
+            elapsed = time.perf_counter() - t
+            self.health.latency(url, elapsed)
+            if metrics.ENABLED:
+                metrics.request(url, r.status_code, elapsed)
+        self.rate_limiter.feedback(host, r.status_code, r.headers.get("Retry-After"))
+        if ttl is not None and self._cache_store(ttl, key, entry, url, r.status_code, r.content, r.headers):
+            return self._acached_response(entry)
+        return r
+
+    @staticmethod
+    def _acached_response(entry):
+        import httpx
+
+        return httpx.Response(200, headers=entry.headers, content=entry.body, request=httpx.Request("GET", entry.url))
+
+    async def aparse(
+        self,
+        query: str,
+        max_products: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]] = None,
+        max_age: Optional[float] = INCREMENTAL_MAX_AGE,
+        columnar: bool = False,
+    ):
+        """Асинхронный аналог parse(), параметры те же."""
+        now = time.time()
+        self._begin_run([query], max_products, max_pages, known, max_age)
+        async with self._client() as client:
+            items: List[Dict] = []
+            id2stock: Dict[int, int] = {}
+            id2price: Dict[int, int] = {}
+            detail_tasks: List[asyncio.Task] = []
+            pending: List[int] = []
+
+            async for page_items in self._asearch_pages(client, query, max_products, max_pages):
+                items.extend(page_items)
+                pending.extend(self._detail_from_checkpoint([
+                    it["id"] for it in page_items
+                    if it.get("id") and not self._is_unchanged(it, known, max_age, now)
+                ], id2stock, id2price))
+                while len(pending) >= 100:
+                    batch, pending = pending[:100], pending[100:]
+                    detail_tasks.append(asyncio.create_task(
+                        self._adetail_batch(client, batch, id2stock, id2price)
+                    ))
+            if pending:
+                detail_tasks.append(asyncio.create_task(
+                    self._adetail_batch(client, pending, id2stock, id2price)
+                ))
+
+            logger.info("search returned %d items for query='%s'", len(items), query)
+            if not items:
+                self.last_stats = self._finish_run(self._run_stats({query: items}, [], []))
+                return ProductColumns() if columnar else []
+
+            refresh, unchanged = self._split_for_refresh(items, known, max_age, now)
+            ids = [it["id"] for it in refresh if it.get("id")]
+            html_meta: Dict[int, Dict[str, Any]] = {}
+            if self.enable_html_meta:
+                html_meta, _ = await asyncio.gather(
+                    self._acollect_html_meta_for_ids(
+                        client, query, ids, max_pages=max_pages or 50,
+                        positions=self._search_positions(items), total=len(items),
+                    ),
+                    asyncio.gather(*detail_tasks),
+                )
+            else:
+                await asyncio.gather(*detail_tasks)
+
+        self.last_stats = self._finish_run(self._run_stats({query: items}, refresh, unchanged))
+        return self._result_rows(refresh, unchanged, id2stock, id2price, html_meta, columnar)
+
+    async def aparse_many(
+        self,
+        queries: List[str],
+        max_products: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]] = None,
+        max_age: Optional[float] = INCREMENTAL_MAX_AGE,
+        columnar: bool = False,
+    ):
+        """Асинхронный аналог parse_many(): поиск по всем запросам сразу, detail — по мере поступления новых id."""
+        queries = self._normalize_queries(queries)
+        if not queries:
+            return ProductColumns() if columnar else []
+        now = time.time()
+        self._begin_run(queries, max_products, max_pages, known, max_age)
+        async with self._client() as client:
+            found: Dict[str, List[Dict]] = {q: [] for q in queries}
+            id2stock: Dict[int, int] = {}
+            id2price: Dict[int, int] = {}
+            detail_tasks: List[asyncio.Task] = []
+            dispatched: set[int] = set()
+            pending: List[int] = []
+
+            def flush(force: bool = False):
+                nonlocal pending
+                while len(pending) >= 100 or (force and pending):
+                    batch, pending = pending[:100], pending[100:]
+                    detail_tasks.append(asyncio.create_task(
+                        self._adetail_batch(client, batch, id2stock, id2price)
+                    ))
+
+            async def search_one(query: str):
+                async for page_items in self._asearch_pages(client, query, max_products, max_pages):
+                    found[query].extend(page_items)
+                    fresh: List[int] = []
+                    for it in page_items:
+                        pid = it.get("id")
+                        if pid and pid not in dispatched:
+                            dispatched.add(pid)
+                            if not self._is_unchanged(it, known, max_age, now):
+                                fresh.append(pid)
+                    pending.extend(self._detail_from_checkpoint(fresh, id2stock, id2price))
+                    flush()
+
+            await asyncio.gather(*(search_one(q) for q in queries))
+            flush(force=True)
+
+            items, positions, owner = self._merge_query_results(queries, [found[q] for q in queries])
+            logger.info("search returned %d unique items for %d queries", len(items), len(queries))
+            if not items:
+                self.last_stats = self._finish_run(self._run_stats(found, [], []))
+                return ProductColumns() if columnar else []
+
+            refresh, unchanged = self._split_for_refresh(list(items.values()), known, max_age, now)
+            html_meta: Dict[int, Dict[str, Any]] = {}
+            html_jobs = []
+            if self.enable_html_meta:
+                by_query = self._ids_by_owner(queries, {it["id"]: owner[it["id"]] for it in refresh})
+                html_jobs = [
+                    self._acollect_html_meta_for_ids(
+                        client, q, ids, max_pages=max_pages or 50,
+                        positions=self._search_positions(found[q]), total=len(found[q]),
+                    )
+                    for q, ids in by_query.items()
+                ]
+            metas = await asyncio.gather(*html_jobs, asyncio.gather(*detail_tasks))
+            for meta in metas[:-1]:
+                html_meta.update(meta)
+
+        self.last_stats = self._finish_run(self._run_stats(found, refresh, unchanged))
+        rows = self._result_rows(refresh, unchanged, id2stock, id2price, html_meta, columnar)
+        return self._attach_positions(rows, positions)
+
+    async def aiter_parse(
+        self,
+        queries: List[str],
+        max_products: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]] = None,
+        max_age: Optional[float] = INCREMENTAL_MAX_AGE,
+        batch_size: int = 500,
+    ) -> AsyncIterator[List[Dict]]:
+        """
+        Асинхронный iter_parse(): до self.concurrency запросов обходятся одновременно,
+        detail-партии и HTML-страницы одной партии тоже качаются параллельно.
+        Готовые партии идут через очередь на self.concurrency мест.
+        """
+        queries = self._normalize_queries(queries)
+        batch_size = max(100, batch_size // 100 * 100)
+        now = time.time()
+        self._begin_run(queries, max_products, max_pages, known, max_age)
+        emitted: set[int] = set()
+        per_query = [self._new_query_stats() for _ in queries]
+        todo = iter(zip(queries, per_query))
+        out: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+
+        async with self._client() as client:
+            async def worker() -> None:
+                for query, qstats in todo:
+                    batch: List[Tuple[int, Dict]] = []
+                    dups: List[Dict] = []
+                    async for page_items in _then_none(self._asearch_pages(client, query, max_products, max_pages)):
+                        if page_items is not None:
+                            self._take_batch_items(query, page_items, qstats, emitted, batch, dups)
+                            if len(batch) < batch_size:
+                                continue
+                        if not batch and not dups:
+                            continue
+                        rows = await self._aenrich_batch(client, query, batch, qstats, known, max_age, now, max_pages)
+                        await out.put(("rows", rows + dups))
+                        batch, dups = [], []
+
+            workers = [asyncio.ensure_future(worker()) for _ in range(min(self.concurrency, len(queries)))]
+
+            async def finish() -> None:
+                try:
+                    await asyncio.gather(*workers)
+                    await out.put(("done", None))
+                except Exception as e:
+                    await out.put(("error", e))
+
+            closer = asyncio.ensure_future(finish())
+            try:
+                while True:
+                    kind, value = await out.get()
+                    if kind == "done":
+                        break
+                    if kind == "error":
+                        raise value
+                    yield value
+            finally:
+                for t in (*workers, closer):
+                    t.cancel()
+                await asyncio.gather(*workers, closer, return_exceptions=True)
+
+        self.last_stats = self._finish_run(self._stream_stats(per_query, max_pages))
+
+    async def _aenrich_batch(
+        self,
+        client,
+        query: str,
+        batch: List[Tuple[int, Dict]],
+        qstats: Dict[str, int],
+        known: Optional[Dict[int, Tuple[str, Optional[float]]]],
+        max_age: Optional[float],
+        now: float,
+        max_pages: Optional[int],
+    ) -> List[Dict]:
+        if not batch:
+            return []
+        refresh, unchanged = self._split_for_refresh([it for _, it in batch], known, max_age, now)
+        ids = [it["id"] for it in refresh]
+        id2stock: Dict[int, int] = {}
+        id2price: Dict[int, int] = {}
+        todo = self._detail_from_checkpoint(ids, id2stock, id2price)
+        jobs = [self._adetail_batch(client, todo[i:i + 100], id2stock, id2price) for i in range(0, len(todo), 100)]
+        html_meta: Dict[int, Dict[str, Any]] = {}
+        if self.enable_html_meta and ids:
+            jobs.append(self._acollect_html_meta_for_ids(
+                client, query, ids, max_pages=max_pages or 50,
+                positions={it["id"]: pos for pos, it in batch},
+            ))
+            *_, html_meta = await asyncio.gather(*jobs)
+        else:
+            await asyncio.gather(*jobs)
+        return self._batch_rows(query, batch, qstats, refresh, unchanged, id2stock, id2price, html_meta)
+
+    async def _asearch_pages(
+        self,
+        client,
+        query: str,
+        limit: Optional[int],
+        max_pages: Optional[int],
+    ) -> AsyncIterator[List[Dict]]:
+        """Как _search, но отдаёт новые товары постранично, чтобы detail стартовал сразу."""
+        seen_ids: set[int] = set()
+        total = 0
+        page = 1
+        per_page = self._search_per_page(limit)
+
+        while True:
+            if max_pages is not None and page > max_pages:
+                return
+
+            got = self._run.search_page(query, page) if self._run is not None else None
+            last_err = None
+            answered = got is not None
+            if got is None:
+                with metrics.stage("search_page", query=query, page=page):
+                    empty: List[str] = []
+                    for url in self.health.order(self.SEARCH_URLS):
+                        try:
+                            r = await self._aget(client, url, self._search_params(query, page, per_page))
+                            r.raise_for_status()
+                            answered = True
+                            products = self._search_products(r.json())
+                        except Exception as e:
+                            last_err = e
+                            self._endpoint_failed(url, e)
+                            continue
+                        if products:
+                            got = products
+                            self.health.success(url)
+                            self._save_search_page(query, page, got)
+                            break
+                        empty.append(url)
+                    self._settle_empty(empty, bool(got))
+
+            if not got:
+                if not answered:
+                    self._mark_incomplete(f"search {query!r} page {page}")
+                logger.info("Страниц больше нет (page=%d, last_err=%s).", page, str(last_err))
+                return
+
+            self._report("search_pages")
+            fresh: List[Dict] = []
+            for p in got:
+                pid = p.get("id")
+                if isinstance(pid, int) and pid not in seen_ids:
+                    seen_ids.add(pid)
+                    fresh.append(p)
+                    total += 1
+                    if limit is not None and total >= limit:
+                        yield fresh
+                        return
+            yield fresh
+
+            if len(got) < per_page:
+                return
+
+            page += 1
+
+    async def _adetail_batch(
+        self,
+        client,
+        batch: List[int],
+        id2stock: Dict[int, int],
+        id2price: Dict[int, int],
+    ) -> bool:
+        """Партия detail по основному региону и одновременно — по всем доп. (общий client)."""
+        with metrics.stage("detail_batch", ids=len(batch)):
+            oks = await asyncio.gather(
+                self._adetail_batch_once(client, batch, id2stock, id2price),
+                *(self._aregion_detail_batch(client, batch, geo) for geo in self.regions),
+            )
+        ok = all(oks)
+        self._finish_detail_batch(batch, ok, id2stock, id2price)
+        return ok
+
+    async def _aregion_detail_batch(self, client, batch: List[int], geo: Dict[str, Any]) -> bool:
+        id2stock: Dict[int, int] = {}
+        id2price: Dict[int, int] = {}
+        ok = await self._adetail_batch_once(client, batch, id2stock, id2price, geo)
+        if ok:
+            self._store_region_detail(geo, id2stock, id2price)
+        return ok
+
+    async def _adetail_batch_once(
+        self,
+        client,
+        batch: List[int],
+        id2stock: Dict[int, int],
+        id2price: Dict[int, int],
+        geo: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        where = f" dest={geo['dest']}" if geo is not None else ""
+        for url in self.health.order(self.DETAIL_URLS):
+            params = self._detail_params(url, batch, geo)
+            for attempt in range(3):
+                try:
+                    r = await self._aget(client, url, params)
+                    if r.status_code in RATE_LIMIT_STATUSES:
+                        continue
+                    r.raise_for_status()
+                    self._apply_detail_payload(r.json(), id2stock, id2price, warehouses=geo is None)
+                    self.health.success(url)
+                    logger.info("stocks/price batch ok via %s (%d ids)%s", url, len(batch), where)
+                    return True
+                except Exception as e:
+                    self._endpoint_failed(url, e)
+                    logger.warning("Сбой detail для партии %s на %s%s: %s", batch, url, where, e)
+                if not self.health.available(url):
+                    break
+                # как в WBApiParser._detail_batch: пауза — через лимитер, её выждет aacquire
+                self.rate_limiter.penalty(urlsplit(url).hostname or "", ERROR_BACKOFF * (attempt + 1))
+        logger.warning("Не удалось получить detail ни по одному URL для партии %s%s", batch, where)
+        return False
+
+    async def _afetch_html_cards(self, client, query: str, page: int):
+        cards = self._known_html_cards(query, page)
+        if cards is not None:
+            return cards
+        params = {"search": query, "page": page}
+        with metrics.stage("html_page", page=page):
+            try:
+                self._count_html("html_requests")
+                r = await self._aget(client, self.SEARCH_HTML_URL, params, headers=self.html_headers)
+                if r.status_code in THROTTLE_STATUSES:
+                    self._count_html("html_requests")
+                    r = await self._aget(client, self.SEARCH_HTML_URL, params, headers=self.html_headers)
+                r.raise_for_status()
+            except Exception as e:
+                self._count_html("html_failed")  # как в WBApiParser._fetch_html_cards
+                logger.warning("HTML page %d fetch failed: %s", page, e)
+                return None
+        return self._parse_html_page(query, page, r.text)
+
+    async def _acollect_html_meta_for_ids(
+        self,
+        client,
+        query: str,
+        target_ids: List[int],
+        max_pages: int = 50,
+        positions: Optional[Dict[int, int]] = None,
+        total: Optional[int] = None,
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Как _collect_html_meta_for_ids: качаются только предсказанные по позициям
+        страницы, все страницы раунда — одновременно (в пределах лимита хоста),
+        разбираются по порядку номеров. total=None — оценку прежнего обхода считает
+        вызывающий (aiter_parse — по всему запросу в _stream_stats).
+        """
+        needed = set(int(x) for x in target_ids)
+        result: Dict[int, Dict[str, Any]] = {}
+        if not needed:
+            return result
+
+        window = max(1, int(self.host_concurrency.get(urlsplit(self.SEARCH_HTML_URL).hostname or "", self.concurrency)))
+        plan = _HtmlPagePlan(needed, positions or {}, max_pages, window)
+        while needed:
+            pages = plan.next_pages()
+            if not pages:
+                break
+            cards_list = await asyncio.gather(*(self._afetch_html_cards(client, query, p) for p in pages))
+            for p, cards in zip(pages, cards_list):
+                plan.mark(p, cards)
+                if cards is not None:
+                    self._report("html_pages")
+                    self._merge_html_cards(cards, p, needed, result)
+
+        if total is not None:
+            self._count_html("html_requests_legacy", plan.legacy_pages(result, total))
+        return result
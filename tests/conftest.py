@@ -0,0 +1,45 @@
+"""
+Общие фикстуры. БД — временный SQLite (app.database создаёт движок при импорте,
+поэтому DATABASE_URL подменяется здесь, до импорта app), WB — локальный мок bench.mockwb.
+"""
+import os
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="wb-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_TMP, "test.db")
+os.environ["WB_JOBS_DB"] = os.path.join(_TMP, "jobs.db")
+# общие на процесс кэши и чекпоинты тестам не нужны — каждый тест создаёт свои
+for name in ("WB_CHECKPOINT_DB", "WB_HTTP_CACHE", "WB_RATE_LIMIT_DB", "WB_REGIONS", "WB_TRANSPORT", "DB_ASYNC"):
+    os.environ.pop(name, None)
+
+import pytest
+
+from bench.mockwb import MockWB
+from parser.health import EndpointHealth
+from parser.ratelimit import RateLimiter
+from parser.wb_api import WBApiParser
+
+
+@pytest.fixture(scope="session")
+def mock_wb():
+    """Синтетический каталог на 300 товаров без задержек и ошибок."""
+    with MockWB(size=300) as srv:
+        yield srv
+
+
+@pytest.fixture
+def make_parser(monkeypatch):
+    """make_parser(base_url, **kwargs) -> WBApiParser на мок со своими лимитером и реестром живости."""
+    parsers = []
+
+    def make(base_url: str, **kwargs) -> WBApiParser:
+        monkeypatch.setenv("WB_API_BASE", base_url)
+        kwargs.setdefault("rate_limiter", RateLimiter(host_rates={"127.0.0.1": 1000}))
+        kwargs.setdefault("health", EndpointHealth())
+        parser = WBApiParser(**kwargs)
+        parsers.append(parser)
+        return parser
+
+    yield make
+    for p in parsers:
+        p.close()
@@ -0,0 +1,49 @@
+"""Чекпоинт обхода: что держит его неполным и кто может его продолжить."""
+import pytest
+
+from bench.mockwb import MockWB
+from parser.checkpoint import CrawlCheckpoint
+
+QUERY = "термопаста"
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return CrawlCheckpoint(str(tmp_path / "checkpoint.db"))
+
+
+def _runs(checkpoint):
+    return checkpoint._conn().execute("SELECT COUNT(*) FROM crawl_runs").fetchone()[0]
+
+
+def test_html_failures_do_not_keep_checkpoint(make_parser, checkpoint):
+    with MockWB(size=150, dead=["search.aspx"]) as srv:
+        parser = make_parser(srv.base_url, checkpoint=checkpoint)
+        rows = parser.parse_many([QUERY])
+    assert len(rows) == 150
+    assert parser.last_stats["incomplete"] == 0
+    assert parser.last_stats["html_failed"] > 0
+    assert _runs(checkpoint) == 0
+
+
+def test_resume_needs_same_mode_and_run_id(make_parser, checkpoint):
+    with MockWB(size=50, dead=["/cards/"]) as srv:
+        parser = make_parser(srv.base_url, checkpoint=checkpoint)
+        parser.parse_many([QUERY])
+        assert parser.last_stats["incomplete"] > 0
+        assert _runs(checkpoint) == 1
+
+        # инкрементальный обход не продолжает полный (и оставляет свой чекпоинт)
+        parser.parse_many([QUERY], known={})
+        assert not parser.last_stats["resumed"]
+        # прогон со своим run_id (задача /parse) — тоже
+        parser.run_id = "job-1"
+        parser.parse_many([QUERY])
+        assert not parser.last_stats["resumed"]
+        parser.parse_many([QUERY])
+        assert parser.last_stats["resumed"]
+        assert parser.last_stats["replayed_search_pages"] > 0
+        # те же параметры без run_id — продолжение первого прогона
+        parser.run_id = None
+        parser.parse_many([QUERY])
+        assert parser.last_stats["resumed"]
@@ -0,0 +1,238 @@
+"""upsert_products и replace_stocks на SQLite: счётчики, история, смена разбивки по складам; CSV для COPY."""
+import csv
+import io
+import os
+import re
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.database import Base
+from app.models import Product, ProductHistory, ProductStock
+from parser.records import ProductColumns
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'crud.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def item(nm_id: int, price: int = 100, stock=5, **kw) -> dict:
+    return {"nm_id": nm_id, "name": f"товар {nm_id}", "price": price, "rating": 4.5,
+            "review_count": 10, "stock": stock, **kw}
+
+
+def counts(res: crud.UpsertResult) -> tuple:
+    return res.inserted, res.updated, res.unchanged, res.history
+
+
+def history(db, nm_id: int) -> list:
+    t = ProductHistory.__table__
+    return db.execute(select(t.c.price_prev, t.c.price, t.c.stock).where(t.c.nm_id == nm_id).order_by(t.c.ts)).all()
+
+
+def product(db, nm_id: int) -> Product:
+    return db.execute(select(Product).where(Product.nm_id == nm_id)).scalar_one()
+
+
+def test_insert_unchanged_update(db):
+    items = [item(i) for i in range(1, 11)]
+    assert counts(crud.upsert_products(db, items)) == (10, 0, 0, 10)
+    assert counts(crud.upsert_products(db, items)) == (0, 0, 10, 0)
+
+    items[0] = item(1, price=90)
+    items[1] = item(2, stock=0)
+    res = crud.upsert_products(db, items)
+    assert counts(res) == (0, 2, 8, 2)
+    assert history(db, 1) == [(None, 100, 5), (100, 90, 5)]
+    assert history(db, 2)[-1] == (100, 100, 0)
+    assert product(db, 1).price == 90
+
+
+def test_mixed_batch_across_chunks(db):
+    crud.upsert_products(db, [item(i) for i in range(1, 6)])
+    items = [item(i, price=200 if i % 2 else 100) for i in range(1, 9)]
+    # 1, 3, 5 изменились, 2, 4 — нет, 6..8 новые; чанк меньше партии
+    assert counts(crud.upsert_products(db, items, chunk_size=3)) == (3, 3, 2, 6)
+
+
+def test_name_change_updates_without_history(db):
+    crud.upsert_products(db, [item(1)])
+    res = crud.upsert_products(db, [item(1, name="новое имя")])
+    assert counts(res) == (0, 1, 0, 0)
+    assert product(db, 1).name == "новое имя"
+
+
+def test_unknown_stock_keeps_saved(db):
+    crud.upsert_products(db, [item(1, stock=7)])
+    res = crud.upsert_products(db, [item(1, stock=None)])
+    assert counts(res) == (0, 0, 1, 0)
+    assert product(db, 1).stock == 7
+
+
+def test_duplicates_last_wins(db):
+    res = crud.upsert_products(db, [item(1, price=100), item(1, price=150)])
+    assert counts(res) == (1, 0, 0, 1)
+    assert product(db, 1).price == 150
+
+
+def test_price_changes_skip_first_insert(db):
+    since = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    crud.upsert_products(db, [item(1), item(2)])
+    assert crud.price_changes(db, since) == []
+    crud.upsert_products(db, [item(1, price=90), item(2, stock=1)])
+    changes = crud.price_changes(db, since)
+    # у 2 изменился только остаток: строка истории есть, изменения цены нет
+    assert [(r["nm_id"], r["price_prev"], r["price"]) for r in changes] == [(1, 100, 90)]
+
+
+def test_history_off(db):
+    crud.upsert_products(db, [item(1)], history=False)
+    crud.upsert_products(db, [item(1, price=1)], history=False)
+    assert history(db, 1) == []
+
+
+def test_touch_unchanged(db):
+    crud.upsert_products(db, [item(1), item(2)])
+    before = product(db, 1).refreshed_at
+    res = crud.upsert_products(db, [item(1), item(2, price=1)], touch_unchanged=True)
+    assert (res.updated, res.unchanged, res.touched) == (1, 1, 1)
+    db.expire_all()
+    assert product(db, 1).refreshed_at > before
+
+
+def stocks(db, nm_id: int) -> list:
+    t = ProductStock.__table__
+    return db.execute(select(t.c.wh, t.c.size, t.c.qty).where(t.c.nm_id == nm_id).order_by(t.c.wh, t.c.size)).all()
+
+
+def test_replace_stocks_change_detection(db):
+    now = datetime.now(timezone.utc)
+    first = {1: [(507, "", 3), (117986, "", 2)], 2: [(507, "M", 1)]}
+    assert crud.replace_stocks(db, first, now) == 3
+    # та же разбивка в другом порядке — ничего не пишется
+    assert crud.replace_stocks(db, {1: [(117986, "", 2), (507, "", 3)], 2: [(507, "M", 1)]}, now) == 0
+    # у 1 поменялось количество — переписан только он, 2 не тронут
+    assert crud.replace_stocks(db, {1: [(507, "", 4)], 2: [(507, "M", 1)]}, now) == 1
+    db.commit()
+    assert stocks(db, 1) == [(507, "", 4)]
+    assert stocks(db, 2) == [(507, "M", 1)]
+    # пустая разбивка — товар распродан, строки удаляются
+    assert crud.replace_stocks(db, {2: []}, now) == 0
+    db.commit()
+    assert stocks(db, 2) == []
+    assert crud.replace_stocks(db, {}, now) == 0
+
+
+def test_replace_stocks_ignores_db_collation(tmp_path):
+    # порядок size в БД не кодовый, как у ru_RU на Postgres: в NOCASE 'a' < 'B', в Python — наоборот
+    engine = create_engine(f"sqlite:///{tmp_path / 'collate.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE product_stocks (nm_id BIGINT, wh BIGINT, size TEXT COLLATE NOCASE, qty INTEGER NOT NULL, "
+            "updated_at DATETIME NOT NULL, PRIMARY KEY (nm_id, wh, size))"
+        ))
+    session = sessionmaker(bind=engine)()
+    now = datetime.now(timezone.utc)
+    sizes = [(507, "a", 1), (507, "B", 2), (507, "42-44", 3), (507, "42/44", 4), (507, "М", 5), (507, "M", 6)]
+    try:
+        assert crud.replace_stocks(session, {1: sizes}, now) == len(sizes)
+        session.commit()
+        assert crud.replace_stocks(session, {1: list(reversed(sizes))}, now) == 0
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def test_upsert_counts_stock_rows(db):
+    res = crud.upsert_products(db, [item(1, stocks=[(507, "", 5)]), item(2)])
+    assert res.stocks == 1
+    res = crud.upsert_products(db, [item(1, stocks=[(507, "", 5)]), item(2, stocks=None)])
+    assert (res.stocks, res.unchanged) == (0, 2)
+    assert stocks(db, 1) == [(507, "", 5)]
+
+
+class _CopySession:
+    """Session без Postgres: запоминает COPY (SQL и CSV), остальные запросы ничего не пишут."""
+
+    class _Result:
+        rowcount = 0
+
+        def all(self):
+            return []
+
+    def __init__(self):
+        self.copies = []
+        # db.connection().connection.cursor() — сырой курсор psycopg2
+        self.connection = lambda: type("Conn", (), {"connection": self})()
+
+    def execute(self, *args, **kwargs):
+        return self._Result()
+
+    def cursor(self):
+        return self
+
+    def copy_expert(self, sql, buf):
+        self.copies.append((sql, buf.read()))
+
+    def close(self):
+        pass
+
+
+def _copy_rows(sql: str, data: str) -> list:
+    """Строки так, как их прочтёт COPY ... CSV: пустое поле без кавычек — NULL, кроме FORCE_NOT_NULL."""
+    cols = [c.strip() for c in re.search(r"\(([^)]*)\) FROM STDIN", sql).group(1).split(",")]
+    m = re.search(r"FORCE_NOT_NULL \(([^)]*)\)", sql)
+    not_null = {c.strip() for c in m.group(1).split(",")} if m else set()
+    # csv.writer не берёт в кавычки пустые поля строки из нескольких колонок
+    return [
+        {c: (None if v == "" and c not in not_null else v) for c, v in zip(cols, rec)}
+        for rec in csv.reader(io.StringIO(data))
+    ]
+
+
+def test_copy_keeps_empty_name():
+    session = _CopySession()
+    now = datetime.now(timezone.utc)
+    rows = crud._prepare_rows([item(1, name=""), item(2, stock=None)])
+    for r in rows:
+        r["refreshed_at"] = now
+    crud._upsert_via_copy(session, rows, crud.UpsertResult())
+    cols = ProductColumns.from_rows([
+        {"nm_id": 3, "name": "  ", "price_api": 100, "price_final": 90, "stock": None},
+    ])
+    crud._copy_and_merge(session, cols.upsert_ids(), lambda buf: cols.write_upsert_csv(buf, now.isoformat()),
+                         crud.UpsertResult())
+
+    (sql, data), (sql_cols, data_cols) = session.copies
+    first, second = _copy_rows(sql, data)
+    assert first["name"] == "" and first["stock"] == "5"
+    # неизвестный остаток — по-прежнему NULL (COALESCE в ON CONFLICT сохранит прежний)
+    assert second["stock"] is None
+    (third,) = _copy_rows(sql_cols, data_cols)
+    assert third["name"] == "" and third["stock"] is None and third["price"] == "90"
+
+
+@pytest.mark.skipif(not os.getenv("WB_TEST_POSTGRES_URL"), reason="нужен Postgres: WB_TEST_POSTGRES_URL")
+def test_copy_empty_name_postgres():
+    engine = create_engine(os.environ["WB_TEST_POSTGRES_URL"])
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        session.execute(Product.__table__.delete().where(Product.nm_id.in_([1, 2])))
+        res = crud.upsert_products(session, [item(1, name=""), item(2)], use_copy=True, history=False)
+        assert res.inserted == 2
+        assert product(session, 1).name == ""
+    finally:
+        session.execute(Product.__table__.delete().where(Product.nm_id.in_([1, 2])))
+        session.commit()
+        session.close()
+        engine.dispose()
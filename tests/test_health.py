@@ -0,0 +1,68 @@
+"""Реестр живости эндпоинтов: 503 выключает URL, 429/498 — нет (это троттлинг)."""
+import pytest
+import requests
+
+from parser.health import EndpointHealth
+
+
+def _response(url: str, status: int) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    r.url = url
+    r._content = b"{}"
+    return r
+
+
+def test_circuit_opens_and_probes():
+    h = EndpointHealth(failure_threshold=2, cooldown=0.0)
+    a, b = "http://x/a", "http://x/b"
+    h.failure(a)
+    assert h.order([a, b]) == [a, b]
+    h.failure(a)
+    assert not h.available(a)
+    # cooldown 0 — истёк сразу: один пробный запрос
+    assert h.order([a, b]) == [a, b]
+    h.success(a)
+    assert h.available(a) and h.snapshot()[a]["ok"] == 1
+
+
+@pytest.mark.parametrize("status,opened", [(503, True), (429, False), (498, False)])
+def test_detail_status_and_health(make_parser, mock_wb, monkeypatch, status, opened):
+    parser = make_parser(mock_wb.base_url)
+    down = parser.DETAIL_URLS[0]
+    real_get = parser._get
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(url)
+        if url == down:
+            return _response(url, status)
+        return real_get(url, **kwargs)
+
+    monkeypatch.setattr(parser, "_get", get)
+    id2stock, id2price = {}, {}
+    assert parser._detail_batch([100_000_000], id2stock, id2price)
+    assert id2stock[100_000_000] > 0
+    # три попытки на первом URL, затем — следующий
+    assert calls.count(down) == 3
+    assert parser.health.available(down) is not opened
+    if opened:
+        # выключенный URL больше не пробуется: партия сразу идёт на запасной
+        calls.clear()
+        assert parser._detail_batch([100_000_001], id2stock, id2price)
+        assert down not in calls
+
+
+def test_search_503_counts_as_failure(make_parser, mock_wb, monkeypatch):
+    # выдача мока — страница товаров и пустая: две неудачи v5
+    parser = make_parser(mock_wb.base_url, health=EndpointHealth(failure_threshold=2))
+    down = parser.SEARCH_URLS[0]
+    real_get = parser._get
+
+    def get(url, **kwargs):
+        return _response(url, 503) if url == down else real_get(url, **kwargs)
+
+    monkeypatch.setattr(parser, "_get", get)
+    rows = parser.parse("термопаста", max_pages=3)
+    assert len(rows) == 300
+    assert not parser.health.available(down)
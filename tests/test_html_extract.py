@@ -0,0 +1,71 @@
+"""Однопроходный разбор карточек search.aspx даёт то же, что прежние регэкспы (bench.html_extract)."""
+import glob
+import os
+
+import pytest
+
+from bench.html_extract import FIXTURES, legacy_extract_cards
+from parser.wb_api import WBApiParser
+
+PAGES = sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+
+
+@pytest.fixture(scope="module")
+def parser():
+    # разбор не трогает сеть и настройки — __init__ (cookies, geo) не нужен
+    return WBApiParser.__new__(WBApiParser)
+
+
+def _read(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("path", PAGES, ids=os.path.basename)
+def test_fixture_parity(parser, path):
+    html = _read(path)
+    new = parser._extract_cards_from_html(html)
+    assert new
+    assert new == legacy_extract_cards(parser, html)
+
+
+CARDS = {
+    "data-nm-id и lower-price": (
+        '<article data-nm-id="101" data-card-index="0"><ins class="price__lower-price">1&nbsp;234&nbsp;₽</ins></article>',
+        {101: {"wallet_price": 1234, "index": 0}},
+    ),
+    "id=c и data-card-idx": (
+        '<article class="card" id="c202" data-card-idx="5"><span class="wallet-price">990 руб.</span></article>',
+        {202: {"wallet_price": 990, "index": 5}},
+    ),
+    "id без c не nm_id": (
+        '<article id="303" data-index="1"><span class="price">10 ₽</span></article>',
+        {},
+    ),
+    "первый подходящий атрибут": (
+        '<ARTICLE data-id="404" data-nm-id="405" data-index="7" data-card-index="2"><b class="price">5 РУБ</b></ARTICLE>',
+        {405: {"wallet_price": 5, "index": 2}},
+    ),
+    "price без валюты": (
+        '<article data-nm-id="506"><span class="price">без цены</span></article>'
+        '<article data-nm-id="507" data-index="3"><span class="price">77 ₽</span></article>',
+        {506: {"wallet_price": None, "index": None}, 507: {"wallet_price": 77, "index": 3}},
+    ),
+    "добор из WBSTATE": (
+        '<article data-nm-id="608"><div>нет цены</div></article>'
+        '<script>window.__WBSTATE__ = {"products":[{"id":608,"index":4,"salePriceU":45600},'
+        '{"id":609,"index":5,"priceU":12300}]};</script>',
+        {608: {"wallet_price": 456, "index": 4}, 609: {"wallet_price": 123, "index": 5}},
+    ),
+    "незакрытый article": (
+        '<article data-nm-id="710"><span class="price">1 ₽</span></article><article data-nm-id="711">',
+        {710: {"wallet_price": 1, "index": None}},
+    ),
+}
+
+
+@pytest.mark.parametrize("html, expected", CARDS.values(), ids=CARDS.keys())
+def test_cards_parity(parser, html, expected):
+    new = parser._extract_cards_from_html(html)
+    assert new == expected
+    assert new == legacy_extract_cards(parser, html)
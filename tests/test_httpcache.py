@@ -0,0 +1,27 @@
+"""Кэш ответов WB: TTL по эндпоинту, в том числе у парсера, перенесённого на мок (WB_API_BASE)."""
+from parser.httpcache import ResponseCache
+
+
+def test_ttl_for(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    assert cache.ttl_for("https://search.wb.ru/exactmatch/ru/common/v5/search") == 300
+    assert cache.ttl_for("https://card.wb.ru/cards/v2/detail") == 120
+    assert cache.ttl_for("https://www.wildberries.ru/catalog/0/search.aspx") == 300
+    assert cache.ttl_for("https://user-geo-data.wildberries.ru/get-geo-info") is None
+    assert cache.ttl_for("http://127.0.0.1:8800/cards/v2/detail") is None
+
+
+def test_rebased_parser_uses_cache(make_parser, mock_wb, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    first = make_parser(mock_wb.base_url, http_cache=cache)
+    rows = first.parse("термопаста", max_products=100)
+    assert cache.counters["stored"] > 0
+
+    before = mock_wb.counts()
+    second = make_parser(mock_wb.base_url, http_cache=cache)
+    again = second.parse("термопаста", max_products=100)
+    after = mock_wb.counts()
+    # search, detail и search.aspx — из кэша; geo не кэшируется
+    assert {k: after[k] - before[k] for k in ("search", "detail", "html")} == {"search": 0, "detail": 0, "html": 0}
+    assert cache.counters["hits"] > 0
+    assert [r["price_final"] for r in again] == [r["price_final"] for r in rows]
@@ -0,0 +1,99 @@
+"""Потоковый обход iter_parse/aiter_parse: запросы параллельно, те же товары, что у parse_many."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from parser.wb_async import AsyncWBApiParser
+
+QUERIES = ["термопаста", "кабель", "мышь"]
+
+
+def _flatten(batches):
+    return [row for rows in batches for row in rows]
+
+
+def _check_rows(rows, size):
+    fresh = [r for r in rows if not r.get("duplicate")]
+    dups = [r for r in rows if r.get("duplicate")]
+    # синтетический мок отдаёт один и тот же каталог на любой запрос: каждый товар выдан
+    # полной строкой один раз, остальные встречи — повторы с позицией
+    assert len({r["nm_id"] for r in fresh}) == len(fresh) == size
+    assert len(dups) == size * (len(QUERIES) - 1)
+    assert all(r["stock"] is not None for r in fresh)
+    seen = {q["query"] for r in rows for q in r["queries"]}
+    assert seen == set(QUERIES)
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_iter_parse_matches_parse_many(make_parser, mock_wb, concurrency):
+    parser = make_parser(mock_wb.base_url)
+    rows = _flatten(parser.iter_parse(QUERIES, batch_size=100, concurrency=concurrency))
+    _check_rows(rows, 300)
+    many = parser.parse_many(QUERIES)
+    fresh = {r["nm_id"]: r for r in rows if not r.get("duplicate")}
+    assert set(fresh) == {r["nm_id"] for r in many}
+    for r in many:
+        assert (fresh[r["nm_id"]]["price_final"], fresh[r["nm_id"]]["stock"]) == (r["price_final"], r["stock"])
+
+
+def test_iter_parse_runs_queries_concurrently(make_parser, mock_wb, monkeypatch):
+    parser = make_parser(mock_wb.base_url)
+    active, peak = set(), []
+    lock = threading.Lock()
+    search_pages = parser._search_pages
+
+    def tracked(query, *args):
+        with lock:
+            active.add(query)
+            peak.append(len(active))
+        try:
+            for page in search_pages(query, *args):
+                time.sleep(0.02)
+                yield page
+        finally:
+            with lock:
+                active.discard(query)
+
+    monkeypatch.setattr(parser, "_search_pages", tracked)
+    _flatten(parser.iter_parse(QUERIES, concurrency=len(QUERIES)))
+    assert max(peak) > 1
+
+
+def test_iter_parse_close_early_and_errors(make_parser, mock_wb, monkeypatch):
+    parser = make_parser(mock_wb.base_url)
+    gen = parser.iter_parse(QUERIES, batch_size=100, concurrency=2)
+    assert next(gen)
+    gen.close()  # потоки останавливаются, генератор не виснет
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("detail down")
+
+    monkeypatch.setattr(parser, "_detail_info", broken)
+    with pytest.raises(RuntimeError, match="detail down"):
+        _flatten(parser.iter_parse(QUERIES, concurrency=2))
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_aiter_parse(make_parser, mock_wb, concurrency):
+    parser = AsyncWBApiParser.from_parser(make_parser(mock_wb.base_url), concurrency=concurrency)
+
+    async def collect():
+        return _flatten([rows async for rows in parser.aiter_parse(QUERIES, batch_size=100)])
+
+    _check_rows(asyncio.run(collect()), 300)
+
+
+def test_stream_stats_match_between_engines(make_parser, mock_wb):
+    """Сводка потокового обхода не зависит от движка: html_requests_legacy считается один раз."""
+    sync_parser = make_parser(mock_wb.base_url)
+    _flatten(sync_parser.iter_parse(QUERIES, batch_size=100, concurrency=1))
+    aparser = AsyncWBApiParser.from_parser(make_parser(mock_wb.base_url), concurrency=1)
+
+    async def collect():
+        return [rows async for rows in aparser.aiter_parse(QUERIES, batch_size=100)]
+
+    asyncio.run(collect())
+    assert aparser.last_stats == sync_parser.last_stats
+    assert sync_parser.last_stats["html_requests_legacy"] >= sync_parser.last_stats["html_requests"] > 0
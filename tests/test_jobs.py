@@ -0,0 +1,161 @@
+"""Очередь задач /parse: дедупликация, claim, возврат running после рестарта, пул воркеров."""
+import threading
+import time
+
+import pytest
+
+from app.jobs import JobProgress, JobQueue, JobTimeout, JobWorkerPool
+
+
+@pytest.fixture
+def q(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_submit_dedup_while_active(q):
+    a = q.submit("k", {"query": "x"})
+    b = q.submit("k", {"query": "x"})
+    assert not a["deduplicated"] and b["deduplicated"]
+    assert a["id"] == b["id"]
+    # другой ключ — своя задача
+    assert q.submit("other", {})["id"] != a["id"]
+    # running тоже активна
+    assert q.claim()["id"] == a["id"]
+    assert q.submit("k", {})["id"] == a["id"]
+
+
+@pytest.mark.parametrize("end", ["finish", "fail"])
+def test_submit_after_end_creates_new_job(q, end):
+    a = q.submit("k", {})
+    q.claim()
+    if end == "finish":
+        q.finish(a["id"], {"rows": 1})
+    else:
+        q.fail(a["id"], "boom")
+    b = q.submit("k", {})
+    assert not b["deduplicated"] and b["id"] != a["id"]
+    assert q.get(a["id"])["status"] == ("done" if end == "finish" else "failed")
+
+
+def test_concurrent_submit_single_job(q):
+    ids = []
+
+    def go():
+        ids.append(q.submit("k", {})["id"])
+
+    threads = [threading.Thread(target=go) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(ids)) == 1
+    assert len(q.list()) == 1
+
+
+def test_claim_oldest_first(q):
+    first = q.submit("a", {})
+    second = q.submit("b", {})
+    assert q.claim()["id"] == first["id"]
+    assert q.claim()["id"] == second["id"]
+    assert q.claim() is None
+
+
+def test_requeue_running(q):
+    a = q.submit("a", {})
+    b = q.submit("b", {})
+    q.claim()
+    q.claim()
+    q.finish(b["id"], {})
+    # «рестарт» с тем же владельцем: свои running-задачи осиротели
+    q2 = JobQueue(q.path)
+    assert q2.requeue_running() == 1
+    job = q2.get(a["id"])
+    assert job["status"] == "queued" and job["started_at"] is None
+    assert q2.get(b["id"])["status"] == "done"
+    # возвращённая задача по-прежнему держит свой dedup_key
+    assert q2.submit("a", {})["id"] == a["id"]
+    assert q2.claim()["id"] == a["id"]
+
+
+def test_requeue_skips_live_sibling(q):
+    sibling = JobQueue(q.path, owner="host:2", lease=60)
+    job = q.submit("a", {})
+    assert sibling.claim()["owner"] == "host:2"
+    # соседний процесс жив (heartbeat свежий) — его задачу не забираем ни на старте, ни потом
+    assert q.requeue_running() == 0
+    assert q.requeue_running(own=False) == 0
+    assert q.get(job["id"])["status"] == "running"
+    assert q.submit("a", {})["deduplicated"]
+
+
+def test_requeue_expired_lease(q):
+    sibling = JobQueue(q.path, owner="host:2", lease=60)
+    job = q.submit("a", {})
+    sibling.claim()
+    short = JobQueue(q.path, owner="host:3", lease=0.05)
+    time.sleep(0.1)
+    assert short.requeue_running(own=False) == 1
+    requeued = q.get(job["id"])
+    assert requeued["status"] == "queued" and requeued["owner"] is None
+    assert short.claim()["owner"] == "host:3"
+
+
+def test_heartbeat_extends_lease(q):
+    owner = JobQueue(q.path, owner="host:2", lease=0.2)
+    other = JobQueue(q.path, owner="host:3", lease=0.2)
+    job = q.submit("a", {})
+    owner.claim()
+    for _ in range(3):
+        time.sleep(0.1)
+        assert owner.heartbeat() == 1
+        assert other.requeue_running(own=False) == 0
+    assert q.get(job["id"])["status"] == "running"
+
+
+def _wait(q, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = q.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"задача {job_id} не завершилась")
+
+
+def test_worker_pool_runs_jobs(q):
+    def handler(job, progress):
+        if job["params"].get("fail"):
+            raise ValueError("плохой запрос")
+        if job["params"].get("slow"):
+            while True:
+                progress("pages")
+                time.sleep(0.01)
+        progress("pages", 3)
+        return {"query": job["params"]["query"]}
+
+    pool = JobWorkerPool(q, handler, workers=2, timeout=0.2, poll_interval=0.05)
+    pool.start()
+    try:
+        ok = q.submit("ok", {"query": "x"})
+        bad = q.submit("bad", {"fail": True})
+        slow = q.submit("slow", {"slow": True})
+        pool.notify()
+        done = _wait(q, ok["id"])
+        assert done["status"] == "done" and done["result"] == {"query": "x"}
+        assert done["progress"] == {"pages": 3}
+        failed = _wait(q, bad["id"])
+        assert failed["status"] == "failed" and "ValueError" in failed["error"]
+        timed_out = _wait(q, slow["id"])
+        assert timed_out["status"] == "failed" and timed_out["progress"]["pages"] > 0
+    finally:
+        pool.stop()
+
+
+def test_progress_timeout_raises(q):
+    job = q.submit("k", {})
+    p = JobProgress(q, job["id"], timeout=0.01, flush_every=0)
+    p("pages")
+    time.sleep(0.02)
+    with pytest.raises(JobTimeout):
+        p("pages")
+    assert q.get(job["id"])["progress"] == {"pages": 2}
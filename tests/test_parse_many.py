@@ -0,0 +1,89 @@
+"""parse_many против локального мока WB (bench.mockwb): строки, число запросов, деградация эндпоинтов."""
+import time
+
+import pytest
+
+from bench.mockwb import MockWB, SyntheticCatalog
+
+QUERIES = ["термопаста", "кабель"]
+SIZE = 300
+
+
+def expected(catalog: SyntheticCatalog, nm_id: int) -> dict:
+    p = catalog.detail([nm_id])[0]
+    price = p["salePriceU"] // 100
+    return {
+        "price_api": price,
+        "price_wallet": price * 97 // 100,
+        "stock": sum(s["qty"] for size in p["sizes"] for s in size["stocks"]),
+    }
+
+
+def key(row: dict) -> tuple:
+    return row["nm_id"], row["price_final"], row["stock"], tuple((q["query"], q["position"]) for q in row["queries"])
+
+
+def delta(before: dict, after: dict) -> dict:
+    return {k: after[k] - before[k] for k in after}
+
+
+@pytest.mark.parametrize("engine", ["sync", "async"])
+def test_parse_many_rows_and_requests(make_parser, mock_wb, engine):
+    parser = make_parser(mock_wb.base_url)
+    before = mock_wb.counts()
+    rows = parser.parse_many(QUERIES, engine=engine)
+    sent = delta(before, mock_wb.counts())
+
+    assert len(rows) == len({r["nm_id"] for r in rows}) == SIZE
+    catalog = SyntheticCatalog(SIZE)
+    for pos, r in enumerate(sorted(rows, key=lambda r: r["nm_id"]), 1):
+        assert {k: r[k] for k in ("price_api", "price_wallet", "stock")} == expected(catalog, r["nm_id"])
+        assert r["price_final"] == r["price_wallet"]
+        assert r["queries"] == [{"query": q, "position": pos} for q in QUERIES]
+        assert r["fingerprint"]
+
+    # detail и HTML-мета — по каждому nm_id один раз, хотя товар нашёлся по обоим запросам
+    assert sent["detail"] == SIZE // 100
+    assert sent["html"] == SIZE // 100
+    stats = parser.last_stats
+    assert (stats["items"], stats["refreshed"], stats["incomplete"]) == (SIZE, SIZE, 0)
+
+
+def test_sync_and_async_agree(make_parser, mock_wb):
+    parser = make_parser(mock_wb.base_url)
+    sync_rows = parser.parse_many(QUERIES, max_products=150)
+    async_rows = parser.parse_many(QUERIES, max_products=150, engine="async")
+    assert len(sync_rows) == 150
+    assert sorted(map(key, sync_rows)) == sorted(map(key, async_rows))
+
+
+def test_incremental_rerun_skips_detail(make_parser, mock_wb):
+    parser = make_parser(mock_wb.base_url)
+    first = parser.parse_many(QUERIES)
+    known = {r["nm_id"]: (r["fingerprint"], time.time()) for r in first}
+    before = mock_wb.counts()
+    parser.parse_many(QUERIES, known=known)
+    sent = delta(before, mock_wb.counts())
+    assert sent["detail"] == 0 and sent["html"] == 0
+    assert parser.last_stats["unchanged"] == SIZE
+
+
+def test_dead_detail_marks_run_incomplete(make_parser):
+    with MockWB(size=150, dead=["/cards/"]) as srv:
+        parser = make_parser(srv.base_url)
+        rows = parser.parse_many(QUERIES)
+    assert len(rows) == 150
+    # остаток неизвестен — None (upsert не затрёт сохранённый), цена — из поиска
+    assert all(r["stock"] is None and r["price_api"] for r in rows)
+    assert parser.last_stats["incomplete"] == 2
+
+
+def test_dead_html_falls_back_to_api_price(make_parser):
+    with MockWB(size=150, dead=["search.aspx"]) as srv:
+        parser = make_parser(srv.base_url)
+        rows = parser.parse_many(QUERIES)
+    assert len(rows) == 150
+    assert all(r["price_wallet"] is None and r["price_final"] == r["price_api"] for r in rows)
+    assert all(r["stock"] is not None for r in rows)
+    # HTML-мета необязательна: обход полный, отказы — отдельным счётчиком
+    assert parser.last_stats["incomplete"] == 0 and parser.last_stats["html_failed"] > 0
@@ -0,0 +1,167 @@
+"""Token bucket + AIMD в parser/ratelimit.py на подменённых часах."""
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from parser import ratelimit, wb_api
+from parser.ratelimit import MemoryBackend, RateLimiter, SQLiteBackend, parse_host_rates, parse_retry_after
+
+HOST = "search.wb.ru"
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, sec: float) -> None:
+        self.now += sec
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(ratelimit, "time", c)
+    return c
+
+
+def limiter(backend=None, **kw) -> RateLimiter:
+    return RateLimiter(host_rates={HOST: 4.0}, burst=2.0, backend=backend, **kw)
+
+
+def test_burst_then_interval(clock):
+    rl = limiter()
+    assert rl.reserve(HOST) == 0.0
+    assert rl.reserve(HOST) == 0.0
+    # запас исчерпан: следующий — через 1/rate, за ним — через 2/rate
+    assert rl.reserve(HOST) == pytest.approx(0.25)
+    assert rl.reserve(HOST) == pytest.approx(0.5)
+
+
+def test_tokens_refill_up_to_burst(clock):
+    rl = limiter()
+    for _ in range(2):
+        rl.reserve(HOST)
+    clock.now += 100
+    assert rl.reserve(HOST) == 0.0
+    assert rl.reserve(HOST) == 0.0
+    assert rl.reserve(HOST) > 0
+
+
+def test_acquire_sleeps_reserved_wait(clock):
+    rl = limiter()
+    start = clock.now
+    for _ in range(4):
+        rl.acquire(HOST)
+    # 2 из запаса, затем 0.25 и ещё 0.25 — часы двигает sleep
+    assert clock.now - start == pytest.approx(0.5)
+
+
+def test_throttle_halves_rate_and_blocks(clock):
+    rl = limiter()
+    rl.feedback(HOST, 429)
+    st = rl.snapshot()[HOST]
+    assert st["rate"] == 2.0 and st["throttled"] == 1
+    # без Retry-After — блок на один интервал новой скорости
+    assert st["blocked_for"] == pytest.approx(0.5)
+    assert rl.reserve(HOST) == pytest.approx(0.5)
+
+
+def test_retry_after_seconds(clock):
+    rl = limiter()
+    rl.feedback(HOST, 503, retry_after="7")
+    assert rl.reserve(HOST) == pytest.approx(7.0)
+
+
+def test_rate_floor_and_ceiling(clock):
+    rl = limiter(min_rate=0.25, max_rate_factor=2.0, increase=1.0)
+    for _ in range(10):
+        rl.feedback(HOST, 498)
+    assert rl.snapshot()[HOST]["rate"] == 0.25
+    for _ in range(20):
+        rl.feedback(HOST, 200)
+    assert rl.snapshot()[HOST]["rate"] == 8.0
+    assert rl.snapshot()[HOST]["ok"] == 20
+
+
+def test_errors_do_not_move_rate(clock):
+    rl = limiter()
+    rl.feedback(HOST, None)
+    rl.feedback(HOST, 404)
+    rl.feedback(HOST, 500)
+    st = rl.snapshot()[HOST]
+    assert st["rate"] == 4.0 and st["ok"] == 0 and st["throttled"] == 0
+
+
+def test_penalty_blocks_host_without_slowing(clock):
+    rl = limiter()
+    rl.penalty(HOST, 0.8)
+    rl.penalty(HOST, 0.4)  # короткая пауза не сокращает уже назначенную
+    assert rl.reserve(HOST) == pytest.approx(0.8)
+    assert rl.snapshot()[HOST]["rate"] == 4.0
+    assert rl.reserve("card.wb.ru") == 0.0
+    clock.now += 1
+    assert rl.reserve(HOST) == 0.0
+
+
+def test_unknown_host_uses_default_rate(clock):
+    rl = limiter(default_rate=1.0)
+    rl.reserve("example.org")
+    assert rl.snapshot()["example.org"]["base_rate"] == 1.0
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_backend_shared_between_limiters(clock, tmp_path, backend):
+    if backend == "memory":
+        a = b = MemoryBackend()
+    else:
+        path = str(tmp_path / "rl.db")
+        a, b = SQLiteBackend(path), SQLiteBackend(path)
+    first, second = limiter(backend=a), limiter(backend=b)
+    assert first.reserve(HOST) == 0.0
+    assert second.reserve(HOST) == 0.0
+    # бюджет хоста общий: третий запрос ждёт, кто бы его ни делал
+    assert first.reserve(HOST) == pytest.approx(0.25)
+    second.feedback(HOST, 429, retry_after="3")
+    assert first.snapshot()[HOST]["throttled"] == 1
+    assert first.reserve(HOST) == pytest.approx(3.0)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("5") == 5.0
+    assert parse_retry_after(" 1.5 ") == 1.5
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    now = 1_700_000_000.0
+    assert parse_retry_after(formatdate(now + 30, usegmt=True), now=now) == pytest.approx(30.0)
+    assert parse_retry_after(formatdate(now - 30, usegmt=True), now=now) == 0.0
+
+
+def test_parse_host_rates():
+    assert parse_host_rates("card.wb.ru=8, search.wb.ru = 4,bad,=1,x=") == {"card.wb.ru": 8.0, "search.wb.ru": 4.0}
+    assert parse_host_rates(None) == {}
+
+
+def test_detail_retry_backoff_goes_through_limiter(make_parser, mock_wb, monkeypatch):
+    parser = make_parser(mock_wb.base_url)
+    flaky = parser.DETAIL_URLS[0]
+    real_get = parser._get
+    failures = iter([True, True])
+    penalties = []
+
+    def get(url, **kwargs):
+        if url == flaky and next(failures, False):
+            raise requests.ConnectionError("reset")
+        return real_get(url, **kwargs)
+
+    monkeypatch.setattr(parser, "_get", get)
+    monkeypatch.setattr(parser.rate_limiter, "penalty", lambda host, sec: penalties.append((host, sec)))
+    monkeypatch.setattr(wb_api.time, "sleep", lambda sec: pytest.fail("пауза мимо лимитера"))
+    id2stock = {}
+    assert parser._detail_batch([100_000_000], id2stock, {})
+    assert 100_000_000 in id2stock
+    assert penalties == [("127.0.0.1", wb_api.ERROR_BACKOFF), ("127.0.0.1", 2 * wb_api.ERROR_BACKOFF)]
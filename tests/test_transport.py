@@ -0,0 +1,79 @@
+"""Соединения urllib3 через кэш DNS: перебор адресов хоста."""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from parser import transport
+
+
+class _Ok(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = HTTPServer(("127.0.0.1", 0), _Ok)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv.server_address[1]
+    srv.shutdown()
+
+
+@pytest.fixture
+def session():
+    s = requests.Session()
+    s.mount("http://", transport.HostPoolAdapter())
+    yield s
+    s.close()
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    """Подменяем адреса хоста в dns_cache; резолвер при этом не вызывается."""
+    cache = transport.DNSCache()
+    monkeypatch.setattr(transport, "dns_cache", cache)
+
+    def set_addrs(host, port, addrs):
+        cache._cache.set((host, port), addrs, 60)
+
+    return cache, set_addrs
+
+
+def _refused_addr(port: int) -> str:
+    # сервер слушает только 127.0.0.1 — на 127.0.0.2 тот же порт отвечает отказом
+    with socket.socket() as s:
+        if s.connect_ex(("127.0.0.2", port)) == 0:
+            pytest.skip("127.0.0.2 недоступен для проверки отказа")
+    return "127.0.0.2"
+
+
+def test_refused_address_falls_through_to_next(server, session, dns):
+    cache, set_addrs = dns
+    set_addrs("wb.test", server, [_refused_addr(server), "127.0.0.1"])
+    r = session.get(f"http://wb.test:{server}/", timeout=5)
+    assert r.status_code == 200 and r.text == "ok"
+
+
+def test_all_addresses_refused(server, session, dns):
+    cache, set_addrs = dns
+    set_addrs("wb.test", server, [_refused_addr(server)])
+    with pytest.raises(requests.ConnectionError):
+        session.get(f"http://wb.test:{server}/", timeout=5)
+    # запись выброшена — следующее соединение резолвит заново
+    assert cache._cache.get(("wb.test", server)) is None
+
+
+def test_empty_resolve_uses_urllib3(server, session, dns):
+    cache, set_addrs = dns
+    set_addrs("127.0.0.1", server, [])
+    r = session.get(f"http://127.0.0.1:{server}/", timeout=5)
+    assert r.status_code == 200
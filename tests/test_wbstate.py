@@ -0,0 +1,80 @@
+"""Разбор window.__WBSTATE__: JSON-декодер против прежних регэкспов и откат на них."""
+import json
+
+import pytest
+
+from bench.wbstate import make_state, page, to_js
+from parser.wb_api import WBApiParser
+
+
+@pytest.fixture
+def parser():
+    return WBApiParser.__new__(WBApiParser)
+
+
+def _flat_state(n: int):
+    """Товары id -> index -> цена без вложенных id: здесь регэкспы не ошибаются, ответы должны совпасть."""
+    products, expected = [], {}
+    for i in range(n):
+        nm_id = 300_000_000 + i
+        key = ("salePriceU", "priceU", "promoPriceU")[i % 3]
+        products.append({"id": nm_id, "index": i, "name": f"Товар {i}", key: (i + 1) * 1000})
+        expected[nm_id] = {"wallet_price": (i + 1) * 10, "index": i}
+    return {"catalog": {"products": products}}, expected
+
+
+@pytest.mark.parametrize("n", [1, 20, 200])
+def test_decode_matches_regex(parser, n):
+    state, expected = _flat_state(n)
+    html = page(json.dumps(state, ensure_ascii=False))
+    assert parser._extract_from_wbstate(html) == expected
+    assert parser._extract_from_wbstate_regex(html) == expected
+
+
+@pytest.mark.parametrize("kind", ["json", "gaps", "js"])
+def test_decode_generated_states(parser, kind):
+    # вложенные sizes[].price и товары без цены — здесь регэкспы берут цену соседа, декодер — нет
+    state, expected = make_state(50, gaps=kind == "gaps")
+    html = page(to_js(state) if kind == "js" else json.dumps(state, ensure_ascii=False))
+    assert parser._extract_from_wbstate(html) == {k: v for k, v in expected.items() if v is not None}
+
+
+def test_js_literal(parser):
+    html = page("{catalog: {products: [{id: 7, index: 0, name: 'a \\'b\\' {c}', priceU: 990, x: undefined,},],}, // конец\n}")
+    assert parser._extract_from_wbstate(html) == {7: {"wallet_price": 9, "index": 0}}
+
+
+BROKEN = {
+    "не литерал": '{"products":[{"id":11,"index":0,"salePriceU":12300}],"t":new Date(5)}',
+    "без закрывающих скобок": '{"products":[{"id":12,"index":0,"salePriceU":45600},{"id":13,"index":1,"priceU":700}',
+    "лишняя скобка": '{"products":[{"id":14,"index":2,"priceU":10000}]]}',
+}
+
+
+@pytest.mark.parametrize("src", BROKEN.values(), ids=BROKEN.keys())
+def test_broken_state_falls_back_to_regex(parser, monkeypatch, src):
+    html = page(src)
+    expected = parser._extract_from_wbstate_regex(html)
+    assert expected
+
+    calls = []
+    regex = parser._extract_from_wbstate_regex
+
+    def spy(h):
+        calls.append(h)
+        return regex(h)
+
+    monkeypatch.setattr(parser, "_extract_from_wbstate_regex", spy)
+    assert parser._extract_from_wbstate(html) == expected
+    assert calls == [html]
+
+
+def test_truncated_page(parser):
+    html = 'window.__WBSTATE__ = {"products":[{"id":15,"index":0,"priceU":1'
+    assert parser._extract_from_wbstate(html) == parser._extract_from_wbstate_regex(html) == {}
+
+
+def test_no_state(parser):
+    html = "<html><body><script>window.other = {};</script></body></html>"
+    assert parser._extract_from_wbstate(html) == {}
+    assert parser._extract_from_wbstate_regex(html) == {}